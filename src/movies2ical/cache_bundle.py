@@ -0,0 +1,209 @@
+import contextlib
+import datetime
+import io
+import json
+import logging
+import os
+from pathlib import Path, PurePosixPath
+import shutil
+import sqlite3
+import tarfile
+import tempfile
+
+from .__about__ import __version__
+from .cache_io import atomic_write, key_lock
+from .constants import (
+    CACHE_BUNDLE_PATHS,
+    CACHE_ROOT_DIR,
+    FRAGMENT_CACHE_FILE,
+    IMDB_CACHE_DIR,
+    SHOWINGS_DB_FILE,
+)
+from .database import merge_db
+from .imdb import cached_info_sets, load_imdb_info_cache, merge_imdb_info
+
+logger = logging.getLogger(__name__)
+
+# bump when bundle layout changes incompatibly
+BUNDLE_FORMAT_VERSION = 1
+BUNDLE_MANIFEST_NAME = "manifest.json"
+
+# sqlite3 databases among bundle files, copied consistently even if in use
+BUNDLE_DB_FILES = [SHOWINGS_DB_FILE, FRAGMENT_CACHE_FILE]
+
+
+def bundle_files():
+    """Yield every cache file that belongs in a bundle
+    """
+    for cache_path in CACHE_BUNDLE_PATHS:
+        if cache_path.is_dir():
+            # skip hidden files, e.g. temporary files of atomic_write()
+            yield from sorted(
+                x
+                for x in cache_path.rglob("*")
+                if x.is_file() and not x.name.startswith(".")
+            )
+        elif cache_path.is_file():
+            yield cache_path
+
+
+def snapshot_db(db_filename, snapshot_filename):
+    """Copy sqlite3 database with the backup API, so the copy is consistent
+    even while another process writes to the database
+    """
+    with contextlib.closing(sqlite3.connect(str(db_filename))) as conn:
+        with contextlib.closing(sqlite3.connect(str(snapshot_filename))) as snapshot:
+            conn.backup(snapshot)
+
+
+def export_cache(bundle_filename):
+    """Pack all cache files into one versioned, compressed bundle file
+
+    The showings database only exists (and is only bundled) once a run has
+    stored showings in it with --db.
+
+    Returns:
+        int: number of cache files in bundle
+    """
+    manifest = {
+        "format_version": BUNDLE_FORMAT_VERSION,
+        "movies2ical_version": __version__,
+        "created": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+    }
+    manifest_bin = json.dumps(manifest, indent=4).encode("utf-8")
+
+    num_files = 0
+    with tempfile.TemporaryDirectory() as tmp_dir, tarfile.open(
+        bundle_filename, "w:gz"
+    ) as bundle:
+        manifest_info = tarfile.TarInfo(BUNDLE_MANIFEST_NAME)
+        manifest_info.size = len(manifest_bin)
+        manifest_info.mtime = int(datetime.datetime.now().timestamp())
+        bundle.addfile(manifest_info, io.BytesIO(manifest_bin))
+
+        for cache_file in bundle_files():
+            if cache_file in BUNDLE_DB_FILES:
+                snapshot = Path(tmp_dir) / cache_file.name
+                snapshot_db(cache_file, snapshot)
+                # keep database's own times, which import compares
+                cache_stat = cache_file.stat()
+                os.utime(snapshot, (cache_stat.st_atime, cache_stat.st_mtime))
+            else:
+                snapshot = cache_file
+            bundle.add(
+                str(snapshot),
+                arcname=cache_file.relative_to(CACHE_ROOT_DIR).as_posix(),
+            )
+            num_files += 1
+
+    logger.info("Exported %d cache files to %s", num_files, bundle_filename)
+    if not SHOWINGS_DB_FILE.exists():
+        logger.info(
+            "No showings database to export (showings are only stored by runs "
+            "with --db)"
+        )
+    return num_files
+
+
+def _bundle_member_path(member):
+    """Return local path for bundle member, or None if it doesn't belong
+    """
+    member_path = PurePosixPath(member.name)
+    if not member.isfile() or member_path.is_absolute() or ".." in member_path.parts:
+        return None
+    local_path = CACHE_ROOT_DIR / Path(*member_path.parts)
+    for cache_path in CACHE_BUNDLE_PATHS:
+        if local_path == cache_path or cache_path in local_path.parents:
+            return local_path
+    return None
+
+
+def import_imdb_info(local_path, member_fh, member):
+    """Merge cached imdb info of one movie from bundle into local cache file
+
+    Returns:
+        bool: True if local cache file changed
+    """
+    bundle_movie = json.load(member_fh)
+    # same lock as fetch_imdb_info_cache() holds while adding info sets
+    with key_lock(str(local_path)):
+        local_movie = load_imdb_info_cache(local_path)
+        if member.mtime > local_path.stat().st_mtime:
+            merged = merge_imdb_info(bundle_movie, local_movie)
+        else:
+            merged = merge_imdb_info(local_movie, bundle_movie)
+        # records cached before info sets were configurable lack "_info"
+        if merged == dict(local_movie, _info=cached_info_sets(local_movie)):
+            return False
+        atomic_write(
+            local_path,
+            json.dumps(merged),
+            mtime=max(member.mtime, local_path.stat().st_mtime),
+        )
+    return True
+
+
+def import_cache(bundle_filename):
+    """Merge cache files from bundle into local cache
+
+    Files missing locally are added, and files that are newer in the bundle
+    replace local ones.  The showings database is merged row by row, keeping
+    the newer of rows with the same key.  Cached imdb info of a movie is
+    merged by info set, so e.g. a plot cached only in the older is kept.
+
+    Returns:
+        tuple: (num_added, num_updated, num_skipped)
+    """
+    (num_added, num_updated, num_skipped) = (0, 0, 0)
+    with tarfile.open(bundle_filename, "r:*") as bundle:
+        manifest = json.load(bundle.extractfile(BUNDLE_MANIFEST_NAME))
+        if manifest.get("format_version", 0) > BUNDLE_FORMAT_VERSION:
+            raise ValueError(
+                "%s is cache bundle format %s, but only up to %d is supported"
+                % (bundle_filename, manifest.get("format_version"), BUNDLE_FORMAT_VERSION)
+            )
+
+        for member in bundle:
+            local_path = _bundle_member_path(member)
+            if local_path is None:
+                continue
+
+            if local_path == SHOWINGS_DB_FILE and local_path.exists():
+                # merge rows instead of replacing whole database, whatever
+                #   the file times: rows are newer or older one by one
+                with tempfile.TemporaryDirectory() as tmp_dir:
+                    tmp_db = Path(tmp_dir) / local_path.name
+                    with open(tmp_db, "wb") as tmp_db_fh:
+                        shutil.copyfileobj(bundle.extractfile(member), tmp_db_fh)
+                    merge_db(tmp_db, local_path)
+                num_updated += 1
+                continue
+
+            if local_path.parent == IMDB_CACHE_DIR and local_path.exists():
+                if import_imdb_info(local_path, bundle.extractfile(member), member):
+                    num_updated += 1
+                else:
+                    num_skipped += 1
+                continue
+
+            if local_path.exists():
+                if member.mtime <= local_path.stat().st_mtime:
+                    num_skipped += 1
+                    continue
+                num_updated += 1
+            else:
+                num_added += 1
+
+            local_path.parent.mkdir(exist_ok=True, parents=True)
+            atomic_write(
+                local_path, bundle.extractfile(member).read(), mtime=member.mtime
+            )
+
+    logger.info(
+        "Imported from %s: %d added, %d updated, %d already up to date",
+        bundle_filename,
+        num_added,
+        num_updated,
+        num_skipped,
+    )
+    return (num_added, num_updated, num_skipped)
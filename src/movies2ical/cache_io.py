@@ -0,0 +1,70 @@
+"""Cache file writes and locks that are safe between concurrent processes
+"""
+import contextlib
+import hashlib
+import os
+from pathlib import Path
+import tempfile
+
+try:
+    import fcntl
+except ImportError:
+    # no advisory file locks (e.g. Windows): writes are still atomic
+    fcntl = None
+
+from .constants import LOCK_DIR
+
+
+def atomic_write(filename, data, mtime=None):
+    """Write data to filename so readers only ever see old or new contents
+
+    Data is written to a temporary file in the same directory, which then
+    replaces filename.
+
+    Args:
+        filename (Path): file to write
+        data (bytes or str): contents (str is written as utf-8)
+        mtime (float): if given, set modification time of file to this
+    """
+    filename = Path(filename)
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+
+    (tmp_fd, tmp_filename) = tempfile.mkstemp(
+        dir=str(filename.parent), prefix="." + filename.name + ".", suffix=".tmp"
+    )
+    try:
+        with os.fdopen(tmp_fd, "wb") as tmp_fh:
+            tmp_fh.write(data)
+            tmp_fh.flush()
+            os.fsync(tmp_fh.fileno())
+        if mtime is not None:
+            os.utime(tmp_filename, (mtime, mtime))
+        os.replace(tmp_filename, str(filename))
+    except BaseException:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(tmp_filename)
+        raise
+
+
+@contextlib.contextmanager
+def key_lock(key):
+    """Hold an exclusive lock on key (e.g. a cache filename) across processes
+
+    Used so that only one process (or thread) at a time fetches any one
+    cache entry, and the others then find it already in the cache.
+    """
+    if fcntl is None:
+        yield
+        return
+
+    LOCK_DIR.mkdir(exist_ok=True, parents=True)
+    lock_filename = LOCK_DIR / (
+        hashlib.sha1(str(key).encode("utf-8")).hexdigest() + ".lock"
+    )
+    with open(lock_filename, "w") as lock_fh:
+        fcntl.flock(lock_fh, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_fh, fcntl.LOCK_UN)
@@ -13,6 +13,9 @@ MAX_PLOT_LEN = 800
 # Stanford Theatre is in the same timezone as Los Angeles
 THEATER_TZ = pytz.timezone("America/Los_Angeles")
 
+# where Stanford Theatre showings take place, for calendar events
+THEATER_LOCATION = "221 University Ave, Palo Alto, CA (Stanford Theatre)"
+
 # where the configuration file is
 CONFIG_DIR = Path.home() / ".config" / "movies2ical"
 CONFIG_FILE = CONFIG_DIR / "config.toml"
@@ -23,12 +26,96 @@ CACHE_ROOT_DIR = Path.home() / ".cache" / "movies2ical"
 # where to store cached json files for imdb movie data we fetch
 IMDB_CACHE_DIR = CACHE_ROOT_DIR / "imdb_cache"
 
+# normalized title and year of every movie in IMDB_CACHE_DIR
+IMDB_TITLE_INDEX_FILE = CACHE_ROOT_DIR / "imdb_title_index.json"
+
+# imdb url of movie number, for movies listed without a link
+IMDB_TITLE_URL = "http://www.imdb.com/title/tt%s/"
+
+# fields of imdb info in each info set (fetched from its own imdb page)
+IMDB_INFO_SETS = {
+    "main": ["title", "director", "writer", "cast", "runtimes", "year", "rating"],
+    "plot": ["plot"],
+}
+
+# info sets fetched for every movie when enriching calendars (main is always
+#   fetched, for runtimes).  Others are only fetched when an output needs them.
+DEFAULT_IMDB_INFO = ["main"]
+
 # where to put output .ics files
 ICAL_OUT_DIR = Path(".")
 
 # where to store cached stanford theater htmls files
 THEATER_CACHE_DIR = CACHE_ROOT_DIR / "stanford_movie_cache"
 
+# where to store cached calendar html files of other venues, one dir each
+VENUE_CACHE_DIR = CACHE_ROOT_DIR / "venue_cache"
+
+# where to keep lock files coordinating cache access between processes
+LOCK_DIR = CACHE_ROOT_DIR / "locks"
+
+# notifications that could not be delivered yet, retried on next run
+NOTIFY_QUEUE_FILE = CACHE_ROOT_DIR / "notify_queue.json"
+
+# (connect, read) timeout in seconds for sending each notification
+NOTIFY_TIMEOUT = (5, 15)
+
+# give up on a notification after this many failed deliveries
+NOTIFY_MAX_ATTEMPTS = 20
+
+# how many log records to buffer before writing them to json log file
+LOG_BUFFER_RECORDS = 1000
+
+# default sqlite3 database of all showings seen, with imdb info
+SHOWINGS_DB_FILE = CACHE_ROOT_DIR / "showings.sqlite3"
+
+# serialized VEVENTs of previous runs, reused when writing ical files
+FRAGMENT_CACHE_FILE = CACHE_ROOT_DIR / "vevent_cache.sqlite3"
+
+# checkpoints of current (or last) run's progress with each set of
+#   arguments, for --resume
+RUN_JOURNAL_DIR = CACHE_ROOT_DIR / "run_journals"
+
+# date range of each fetched calendar, and whether it is frozen (ended)
+CALENDAR_LIFECYCLE_FILE = CACHE_ROOT_DIR / "calendar_lifecycle.json"
+
+# days after its last show date that a calendar is frozen: no longer checked
+#   for changes or reprocessed (unless --include-frozen).  Weeks, since only
+#   --include-frozen undoes it, e.g. if a run was extended
+CALENDAR_FREEZE_AFTER_DAYS = 28
+
+# default work queue shared by 'movies2ical worker' processes (put it on
+#   storage shared by all machines to spread a run across them)
+WORK_QUEUE_FILE = CACHE_ROOT_DIR / "work_queue.sqlite3"
+
+# seconds a worker holds a job before others may take it over (renewed while
+#   the worker is alive)
+WORK_LEASE_SECONDS = 300
+
+# attempts at a job before it is marked failed
+WORK_MAX_ATTEMPTS = 5
+
+# seconds before first retry of a failed job, doubling with each attempt
+WORK_RETRY_DELAY = 30
+
+# seconds an idle worker waits before looking for new jobs
+WORK_POLL_SECONDS = 5
+
+# drop cached VEVENTs that haven't been used for this many days
+FRAGMENT_CACHE_MAX_AGE_DAYS = 60
+
+# cache files and directories packed by 'movies2ical cache export'
+CACHE_BUNDLE_PATHS = [
+    IMDB_CACHE_DIR,
+    THEATER_CACHE_DIR,
+    VENUE_CACHE_DIR,
+    SHOWINGS_DB_FILE,
+    FRAGMENT_CACHE_FILE,
+]
+
+# file extensions of calendar files found when searching directories
+CALENDAR_FILE_SUFFIXES = (".html", ".htm")
+
 # months in order to convert to/from numbers
 MONTHS = [
     "January",
@@ -71,6 +158,24 @@ DEFAULT_CONFIG_TOML_STR = textwrap.dedent(
     """
     # Information for movies2ical
 
+    [theater]
+        base_url = "http://www.stanfordtheatre.org/"
+
+    # To fetch calendars from several venues at once, instead list each one
+    #   as a [[sources]] table (plugin is required, the rest are optional)
+    # [[sources]]
+    #     plugin = "stanford"
+    #     name = "stanford"
+    #     base_url = "http://www.stanfordtheatre.org/"
+    #     timezone = "America/Los_Angeles"
+    #     location = "221 University Ave, Palo Alto, CA (Stanford Theatre)"
+
+    # IMDb info sets fetched for every movie (main is always fetched).  Add
+    #   "plot" to fetch plots up front; otherwise they are only fetched for ical
+    #   files (ndjson output and the database do without them)
+    # [imdb]
+    #     info = ["main", "plot"]
+
     [notify17]
         new_calendar_url = "https://hook.notify17.net/api/template/<your-template-specifier>"
         error_url = "https://hook.notify17.net/api/template/<your-template-specifier>"
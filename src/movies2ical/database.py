@@ -0,0 +1,372 @@
+import datetime
+import json
+import re
+import sqlite3
+import time
+
+import pytz
+
+from .imdb import imdb_movie_num
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS movies (
+    imdb_id TEXT PRIMARY KEY,
+    title TEXT,
+    year INTEGER,
+    rating REAL,
+    runtimes TEXT,
+    writer TEXT,
+    "cast" TEXT,
+    plot TEXT,
+    updated REAL NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS movie_directors (
+    imdb_id TEXT NOT NULL,
+    director TEXT NOT NULL COLLATE NOCASE,
+    PRIMARY KEY (imdb_id, director)
+);
+CREATE TABLE IF NOT EXISTS showings (
+    venue TEXT NOT NULL,
+    timezone TEXT NOT NULL,
+    imdb_id TEXT NOT NULL,
+    start_utc TEXT NOT NULL,
+    end_utc TEXT NOT NULL,
+    rrule_count INTEGER NOT NULL,
+    first_date TEXT NOT NULL,
+    last_date TEXT NOT NULL,
+    name TEXT NOT NULL,
+    imdb_url TEXT NOT NULL,
+    calendar TEXT,
+    updated REAL NOT NULL DEFAULT 0,
+    PRIMARY KEY (venue, imdb_id, start_utc)
+);
+CREATE TABLE IF NOT EXISTS director_keys (
+    name_key TEXT NOT NULL,
+    imdb_id TEXT NOT NULL,
+    PRIMARY KEY (name_key, imdb_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS showings_dates ON showings (first_date, last_date);
+CREATE INDEX IF NOT EXISTS showings_last_date ON showings (last_date);
+CREATE INDEX IF NOT EXISTS showings_imdb_id ON showings (imdb_id);
+CREATE INDEX IF NOT EXISTS movie_directors_director ON movie_directors (director);
+"""
+SCHEMA_VERSION = 3
+
+
+def director_name_key(name):
+    """Returns (str): name normalized for matching, lower-case words separated
+        by single spaces
+    """
+    return " ".join(re.findall(r"\w+", name.lower()))
+
+
+def director_name_keys(name):
+    """Returns (list): keys of director name, one starting at each of its
+        words, so a search matches from the start of any word by prefix, e.g.
+        "alfred hitchcock" and "hitchcock" for "Alfred Hitchcock"
+    """
+    words = director_name_key(name).split(" ")
+    return [" ".join(words[i:]) for i in range(len(words)) if words[i]]
+
+
+def _add_director_keys(conn):
+    conn.executemany(
+        "INSERT OR IGNORE INTO director_keys (name_key, imdb_id) VALUES (?, ?)",
+        [
+            (name_key, imdb_id)
+            for (imdb_id, director) in conn.execute(
+                "SELECT imdb_id, director FROM movie_directors"
+            ).fetchall()
+            for name_key in director_name_keys(director)
+        ],
+    )
+
+# MIGRATIONS[n] upgrades tables of a database at version n to version n + 1
+MIGRATIONS = [
+    # showings from before there were venues are all the Stanford Theatre's
+    """
+    ALTER TABLE showings RENAME TO showings_old;
+    CREATE TABLE showings (
+        venue TEXT NOT NULL,
+        timezone TEXT NOT NULL,
+        imdb_id TEXT NOT NULL,
+        start_utc TEXT NOT NULL,
+        end_utc TEXT NOT NULL,
+        rrule_count INTEGER NOT NULL,
+        first_date TEXT NOT NULL,
+        last_date TEXT NOT NULL,
+        name TEXT NOT NULL,
+        imdb_url TEXT NOT NULL,
+        calendar TEXT,
+        PRIMARY KEY (venue, imdb_id, start_utc)
+    );
+    INSERT INTO showings
+        SELECT 'stanford', 'America/Los_Angeles', * FROM showings_old;
+    DROP TABLE showings_old;
+    """,
+    # when each row was stored, so merging databases keeps the newer row
+    """
+    ALTER TABLE movies ADD COLUMN updated REAL NOT NULL DEFAULT 0;
+    ALTER TABLE showings ADD COLUMN updated REAL NOT NULL DEFAULT 0;
+    """,
+    # plots not yet fetched are NULL, not json null, so they can be kept
+    """
+    UPDATE movies SET plot = NULL WHERE plot = 'null';
+    CREATE TABLE director_keys (
+        name_key TEXT NOT NULL,
+        imdb_id TEXT NOT NULL,
+        PRIMARY KEY (name_key, imdb_id)
+    ) WITHOUT ROWID;
+    """,
+]
+
+# run after MIGRATIONS[n], for what sql alone can't do
+MIGRATION_STEPS = {2: _add_director_keys}
+
+
+def _migrate_db(conn):
+    """Upgrade tables made by an older version to SCHEMA_VERSION
+    """
+    # lock database first, in case another process is upgrading it too
+    conn.execute("BEGIN IMMEDIATE")
+    (version,) = conn.execute("PRAGMA user_version").fetchone()
+    (has_tables,) = conn.execute(
+        "SELECT COUNT(*) FROM sqlite_master WHERE type = 'table' AND name = 'showings'"
+    ).fetchone()
+    if has_tables:
+        for (step, migration) in enumerate(MIGRATIONS[version:], version):
+            for statement in migration.split(";"):
+                if statement.strip():
+                    conn.execute(statement)
+            if step in MIGRATION_STEPS:
+                MIGRATION_STEPS[step](conn)
+    conn.execute("PRAGMA user_version = %d" % SCHEMA_VERSION)
+    conn.commit()
+
+
+def open_db(db_filename):
+    """Open (creating or upgrading if needed) the showings database
+    """
+    # generous timeout so parallel calendar processes can share database
+    conn = sqlite3.connect(str(db_filename), timeout=60)
+    (version,) = conn.execute("PRAGMA user_version").fetchone()
+    if version < SCHEMA_VERSION:
+        _migrate_db(conn)
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def store_play_dates(db_filename, play_dates, venue, tz, calendar=None):
+    """Upsert every showing in play_dates, with its imdb info, into database
+
+    Args:
+        db_filename (Path): sqlite3 database file
+        play_dates (list): play_dates with imdb_info and showings computed
+        venue (str): name of venue showings are at
+        tz (pytz.timezone): timezone of venue, for local dates of showings
+        calendar (str): name of calendar play_dates came from
+    """
+    now = time.time()
+    conn = open_db(db_filename)
+    with conn:
+        for play_date in play_dates:
+            imdb_id = imdb_movie_num(play_date["imdb_url"])
+            imdb_info = play_date["imdb_info"]
+            # keep stored plot if this run didn't fetch it
+            conn.execute(
+                "INSERT INTO movies "
+                "(imdb_id, title, year, rating, runtimes, writer, \"cast\", plot, "
+                "updated) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (imdb_id) DO UPDATE SET title = excluded.title, "
+                "year = excluded.year, rating = excluded.rating, "
+                "runtimes = excluded.runtimes, writer = excluded.writer, "
+                '"cast" = excluded."cast", '
+                "plot = COALESCE(excluded.plot, movies.plot), "
+                "updated = excluded.updated",
+                (
+                    imdb_id,
+                    imdb_info["title"],
+                    imdb_info["year"],
+                    imdb_info["rating"],
+                    json.dumps(imdb_info["runtimes"]),
+                    json.dumps(imdb_info["writer"]),
+                    json.dumps(imdb_info["cast"]),
+                    # plot is only there if already fetched
+                    json.dumps(imdb_info["plot"]) if "plot" in imdb_info else None,
+                    now,
+                ),
+            )
+            conn.executemany(
+                "INSERT OR IGNORE INTO movie_directors (imdb_id, director) "
+                "VALUES (?, ?)",
+                [(imdb_id, director) for director in imdb_info["director"]],
+            )
+            conn.executemany(
+                "INSERT OR IGNORE INTO director_keys (name_key, imdb_id) "
+                "VALUES (?, ?)",
+                [
+                    (name_key, imdb_id)
+                    for director in imdb_info["director"]
+                    for name_key in director_name_keys(director)
+                ],
+            )
+            for showing in play_date["showings"]:
+                first_date = showing["datetime_start"].astimezone(tz).date()
+                last_date = first_date + datetime.timedelta(
+                    days=showing["rrule_count"] - 1
+                )
+                conn.execute(
+                    "INSERT OR REPLACE INTO showings "
+                    "(venue, timezone, imdb_id, start_utc, end_utc, rrule_count, "
+                    "first_date, last_date, name, imdb_url, calendar, updated) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (
+                        venue,
+                        tz.zone,
+                        imdb_id,
+                        showing["datetime_start"].isoformat(),
+                        showing["datetime_end"].isoformat(),
+                        showing["rrule_count"],
+                        first_date.isoformat(),
+                        last_date.isoformat(),
+                        play_date["name"],
+                        play_date["imdb_url"],
+                        calendar,
+                        now,
+                    ),
+                )
+    conn.close()
+
+
+def merge_db(src_db_filename, db_filename):
+    """Merge all rows from database src_db_filename into db_filename
+
+    Rows from src_db_filename are added, or replace rows with the same key
+    that were stored longer ago.  Directors of movies are added to those
+    already known.
+    """
+    # bring src up to same schema, so columns line up
+    open_db(src_db_filename).close()
+    conn = open_db(db_filename)
+    conn.execute("ATTACH DATABASE ? AS src", (str(src_db_filename),))
+    with conn:
+        conn.execute(
+            "INSERT OR IGNORE INTO movie_directors SELECT * FROM src.movie_directors"
+        )
+        conn.execute(
+            "INSERT OR IGNORE INTO director_keys SELECT * FROM src.director_keys"
+        )
+        for (table, key) in (
+            ("movies", "imdb_id"),
+            ("showings", "venue, imdb_id, start_utc"),
+        ):
+            columns = [
+                '"%s"' % x[1]
+                for x in conn.execute("PRAGMA main.table_info(%s)" % table)
+            ]
+            # "WHERE true" so sqlite doesn't take ON CONFLICT for a join
+            conn.execute(
+                "INSERT INTO {table} ({columns}) "
+                "SELECT {columns} FROM src.{table} WHERE true "
+                "ON CONFLICT ({key}) DO UPDATE SET {updates} "
+                "WHERE excluded.updated > {table}.updated".format(
+                    table=table,
+                    columns=", ".join(columns),
+                    key=key,
+                    updates=", ".join(
+                        # a row without plot doesn't replace a known plot
+                        "plot = COALESCE(excluded.plot, movies.plot)"
+                        if x == '"plot"'
+                        else "%s = excluded.%s" % (x, x)
+                        for x in columns
+                    ),
+                )
+            )
+    conn.execute("DETACH DATABASE src")
+    conn.close()
+
+
+def query_showings(
+    db_filename,
+    director=None,
+    imdb_id=None,
+    on_date=None,
+    since=None,
+    until=None,
+    venue=None,
+):
+    """Find showings in database matching all of the given criteria
+
+    Args:
+        db_filename (Path): sqlite3 database file
+        director (str): start of director's name, or of any word of it
+            (case-insensitive), e.g. "hitchcock" or "alfred hitch"
+        imdb_id (str): imdb movie number (digits after "tt")
+        on_date (datetime.date): showings playing on this date
+        since (datetime.date): showings playing on or after this date
+        until (datetime.date): showings playing on or before this date
+        venue (str): showings at this venue
+
+    Returns:
+        list: of dicts, one per showing, sorted by start time
+    """
+    where = []
+    params = []
+    if director is not None:
+        # prefix range of index of name keys
+        name_key = director_name_key(director)
+        where.append(
+            "showings.imdb_id IN "
+            "(SELECT imdb_id FROM director_keys WHERE name_key >= ? AND name_key < ?)"
+        )
+        params.extend([name_key, name_key + "\U0010ffff"])
+    if imdb_id is not None:
+        where.append("showings.imdb_id = ?")
+        params.append(imdb_id)
+    if on_date is not None:
+        where.append("first_date <= ? AND last_date >= ?")
+        params.extend([on_date.isoformat(), on_date.isoformat()])
+    if venue is not None:
+        where.append("venue = ?")
+        params.append(venue)
+    if since is not None:
+        where.append("last_date >= ?")
+        params.append(since.isoformat())
+    if until is not None:
+        where.append("first_date <= ?")
+        params.append(until.isoformat())
+
+    sql = (
+        "SELECT venue, timezone, showings.imdb_id, name, imdb_url, start_utc, "
+        "end_utc, rrule_count, first_date, last_date, calendar, title, year "
+        "FROM showings LEFT JOIN movies ON showings.imdb_id = movies.imdb_id"
+    )
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += " ORDER BY start_utc, venue"
+
+    conn = open_db(db_filename)
+    conn.row_factory = sqlite3.Row
+    showings = [dict(row) for row in conn.execute(sql, params)]
+    conn.close()
+
+    return showings
+
+
+def report_showings(showings):
+    """Print one line per showing from query_showings(), with its time local
+    to its venue
+    """
+    for showing in showings:
+        start_time = (
+            datetime.datetime.fromisoformat(showing["start_utc"])
+            .astimezone(pytz.timezone(showing["timezone"]))
+            .strftime("%I:%M%p")
+        )
+        date_str = showing["first_date"]
+        if showing["last_date"] != showing["first_date"]:
+            date_str += " - " + showing["last_date"]
+        print(
+            "%-25s %s  %-12s %s"
+            % (date_str, start_time, showing["venue"], showing["name"])
+        )
@@ -0,0 +1,116 @@
+"""Cache of serialized VEVENT fragments, so ical files are mostly assembled
+from events serialized on previous runs
+
+Each fragment is keyed by a hash of everything that goes into its event (the
+showing, its play_date's name and imdb info, and the venue location), so a
+changed showing or updated imdb info simply gets a new key.  Fragments not
+used for FRAGMENT_CACHE_MAX_AGE_DAYS are removed.
+"""
+import datetime
+import hashlib
+import json
+import sqlite3
+
+from .constants import FRAGMENT_CACHE_FILE, FRAGMENT_CACHE_MAX_AGE_DAYS
+
+# change whenever events are serialized differently, to invalidate fragments
+FRAGMENT_FORMAT_VERSION = 1
+
+# max keys per sqlite query (sqlite allows at least 999 parameters)
+_QUERY_CHUNK = 500
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS fragments (
+    key TEXT PRIMARY KEY,
+    vevent BLOB NOT NULL,
+    last_used TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS fragments_last_used ON fragments (last_used);
+"""
+
+
+def vevent_key(play_date, showing, location):
+    """Returns (str): hash of every input to the VEVENT of showing
+    """
+    key_data = json.dumps(
+        [
+            FRAGMENT_FORMAT_VERSION,
+            play_date["name"],
+            play_date["imdb_url"],
+            showing["datetime_start"].isoformat(),
+            showing["datetime_end"].isoformat(),
+            showing["rrule_count"],
+            location,
+            play_date["imdb_info"],
+        ],
+        sort_keys=True,
+    )
+    return hashlib.sha256(key_data.encode("utf-8")).hexdigest()
+
+
+class FragmentCache:
+    """VEVENT fragments stored in a sqlite3 database, safe to share between
+    processes
+
+    Use as a context manager; new fragments are stored on exit.
+    """
+
+    def __init__(self, db_filename=FRAGMENT_CACHE_FILE):
+        self.db_filename = db_filename
+        self.conn = None
+        self.new_fragments = {}
+        self.used_keys = set()
+
+    def __enter__(self):
+        self.db_filename.parent.mkdir(exist_ok=True, parents=True)
+        # generous timeout so parallel processes can share cache
+        self.conn = sqlite3.connect(str(self.db_filename), timeout=60)
+        self.conn.executescript(SCHEMA)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.flush()
+        self.conn.close()
+        self.conn = None
+
+    def get_many(self, keys):
+        """Returns (dict): key to VEVENT bytes, for keys that are cached
+        """
+        keys = list(set(keys))
+        found = {}
+        for i in range(0, len(keys), _QUERY_CHUNK):
+            chunk = keys[i : i + _QUERY_CHUNK]
+            found.update(
+                self.conn.execute(
+                    "SELECT key, vevent FROM fragments WHERE key IN (%s)"
+                    % ",".join("?" * len(chunk)),
+                    chunk,
+                )
+            )
+        self.used_keys.update(found)
+        return found
+
+    def put(self, key, vevent):
+        self.new_fragments[key] = vevent
+
+    def flush(self):
+        """Store new fragments, mark used ones, and drop old unused ones
+        """
+        today = datetime.date.today()
+        expired = today - datetime.timedelta(days=FRAGMENT_CACHE_MAX_AGE_DAYS)
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO fragments (key, vevent, last_used) "
+                "VALUES (?, ?, ?)",
+                [(k, v, today.isoformat()) for (k, v) in self.new_fragments.items()],
+            )
+            self.conn.executemany(
+                "UPDATE fragments SET last_used = ? WHERE key = ? AND last_used < ?",
+                [(today.isoformat(), k, today.isoformat()) for k in self.used_keys],
+            )
+            self.conn.execute(
+                "DELETE FROM fragments WHERE last_used < ?", (expired.isoformat(),)
+            )
+        self.new_fragments = {}
+        self.used_keys = set()
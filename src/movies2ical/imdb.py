@@ -1,77 +1,298 @@
 import json
+import logging
 import re
-import sys
 
-from imdb import IMDb
+from imdb import IMDb, IMDbError
 
-from .constants import IMDB_CACHE_DIR
+from .cache_io import atomic_write, key_lock
+from .constants import (
+    DEFAULT_IMDB_INFO,
+    IMDB_CACHE_DIR,
+    IMDB_INFO_SETS,
+    IMDB_TITLE_URL,
+)
+from .title_index import get_title_index, normalize_title, split_name_year
 
+logger = logging.getLogger(__name__)
 
-def fetch_imdb_info_cache(imdb_movie_num, movie_name):
-    imdb_cache_filename = str(IMDB_CACHE_DIR / imdb_movie_num) + ".json"
+# fields of play_date["imdb_info"], in order
+IMDB_INFO_FIELDS = [
+    "title",
+    "director",
+    "writer",
+    "cast",
+    "runtimes",
+    "plot",
+    "year",
+    "rating",
+]
 
-    try:
-        with open(imdb_cache_filename, "r") as imdb_cache_fh:
-            imdb_movie = json.load(imdb_cache_fh)
-    except (FileNotFoundError, PermissionError):
-        # only do a CR progress-display if we are in a terminal (not directed
-        #   to a file)
-        if sys.stdout.isatty():
-            print("\r", end="")
-        else:
-            print("\n", end="")
-        print("Fetching info: " + movie_name + " " * (60 - len(movie_name)), end="")
-
-        ia = IMDb()
-        imdb_movie_web = ia.get_movie(imdb_movie_num, info=["main", "plot"])
-
-        imdb_movie = {}
+
+def fetch_imdb_movie(imdb_movie_num, movie_name, info=DEFAULT_IMDB_INFO):
+    """Fetch movie info from imdb.com, return it as json-serializable dict
+
+    Args:
+        imdb_movie_num (str): imdb movie number
+        movie_name (str): name of movie, for messages
+        info (list): info sets to fetch (see IMDB_INFO_SETS)
+
+    Returns:
+        dict: fields of info sets, and "_info": info sets it holds
+    """
+    logger.info(
+        "Fetching info (%s): %s",
+        ", ".join(info),
+        movie_name,
+        extra={"stage": "enrich", "movie": movie_name},
+    )
+
+    ia = IMDb()
+    imdb_movie_web = ia.get_movie(imdb_movie_num, info=list(info))
+
+    imdb_movie = {}
+    if "main" in info:
         imdb_movie["title"] = str(imdb_movie_web["title"])
         imdb_movie["director"] = [str(x) for x in imdb_movie_web["director"]]
         imdb_movie["writer"] = [str(x) for x in imdb_movie_web["writer"]]
         imdb_movie["cast"] = [str(x) for x in imdb_movie_web["cast"]]
         imdb_movie["runtimes"] = [str(x) for x in imdb_movie_web["runtimes"]]
+        imdb_movie["year"] = int(imdb_movie_web["year"])
+        imdb_movie["rating"] = float(imdb_movie_web["rating"])
+    if "plot" in info:
         try:
             imdb_movie["plot"] = [str(x) for x in imdb_movie_web["plot"]]
         except KeyError:
             # no plot in imdb info
             imdb_movie["plot"] = [""]
-        imdb_movie["year"] = int(imdb_movie_web["year"])
-        imdb_movie["rating"] = float(imdb_movie_web["rating"])
+    imdb_movie["_info"] = list(info)
 
-        try:
-            with open(imdb_cache_filename, "w") as imdb_cache_fh:
-                json.dump(imdb_movie, imdb_cache_fh)
-        except (IsADirectoryError, PermissionError):
-            print("Can't write to imdb_cache dir")
+    return imdb_movie
+
+
+def cached_info_sets(imdb_movie):
+    """Returns (list): info sets held by cached imdb info dict
+    """
+    # records cached before info sets were configurable always hold both
+    return imdb_movie.get("_info", ["main", "plot"])
+
+
+def load_imdb_info_cache(imdb_cache_filename):
+    """Returns (dict): cached imdb info, or None if not cached
+    """
+    try:
+        with open(imdb_cache_filename, "r") as imdb_cache_fh:
+            return json.load(imdb_cache_fh)
+    except (FileNotFoundError, PermissionError):
+        return None
+
+
+def merge_imdb_info(imdb_movie, other_movie):
+    """Merge two cached imdb info dicts of the same movie, keeping every info
+    set either holds, as fetch_imdb_info_cache() adds fetched info sets
+
+    Of info sets both hold, those of imdb_movie win.
+
+    Returns:
+        dict: merged imdb info
+    """
+    held = cached_info_sets(imdb_movie)
+    other_held = cached_info_sets(other_movie)
+    merged = {**other_movie, **imdb_movie}
+    for (info_set, fields) in IMDB_INFO_SETS.items():
+        if info_set not in held and info_set in other_held:
+            merged.update({x: other_movie[x] for x in fields if x in other_movie})
+    merged["_info"] = [x for x in IMDB_INFO_SETS if x in held or x in other_held]
+    return merged
+
+
+def fetch_imdb_info_cache(imdb_movie_num, movie_name, info=DEFAULT_IMDB_INFO):
+    """Get imdb info of movie, fetching any info sets not yet in cache
+
+    Returns:
+        dict: cached imdb info, holding at least info sets of info, or None
+            if it can't be loaded or fetched
+    """
+    imdb_cache_filename = str(IMDB_CACHE_DIR / imdb_movie_num) + ".json"
+
+    imdb_movie = None
+    try:
+        imdb_movie = load_imdb_info_cache(imdb_cache_filename)
+        if imdb_movie is None or not set(info) <= set(cached_info_sets(imdb_movie)):
+            # only one process fetches each movie, any others waiting on the
+            #   lock then find it in the cache
+            with key_lock(imdb_cache_filename):
+                imdb_movie = load_imdb_info_cache(imdb_cache_filename) or {}
+                held = cached_info_sets(imdb_movie) if imdb_movie else []
+                missing = [x for x in info if x not in held]
+                if missing:
+                    imdb_movie.update(
+                        fetch_imdb_movie(imdb_movie_num, movie_name, info=missing)
+                    )
+                    imdb_movie["_info"] = [
+                        x for x in IMDB_INFO_SETS if x in held or x in missing
+                    ]
+
+                    try:
+                        atomic_write(imdb_cache_filename, json.dumps(imdb_movie))
+                    except (IsADirectoryError, PermissionError):
+                        logger.error("Can't write to imdb_cache dir")
     except Exception as err:
-        print("Can't load: " + imdb_cache_filename)
-        print(type(err))
-        print(err)
+        logger.error("Can't load: %s (%s: %s)", imdb_cache_filename, type(err), err)
+        return None
 
     return imdb_movie
 
 
-def get_imdb_info(play_dates):
-    for play_date in play_dates:
-        imdb_mnum_re = re.search(r"\/tt(\d+)", play_date["imdb_url"])
-        if imdb_mnum_re:
-            imdb_movie_num = imdb_mnum_re.group(1)
-
-        imdb_movie = fetch_imdb_info_cache(imdb_movie_num, play_date["name"])
-
-        play_date["imdb_info"] = {}
-        play_date["imdb_info"]["title"] = imdb_movie["title"]
-        play_date["imdb_info"]["director"] = imdb_movie["director"]
-        play_date["imdb_info"]["writer"] = imdb_movie["writer"]
-        play_date["imdb_info"]["cast"] = imdb_movie["cast"]
-        play_date["imdb_info"]["runtimes"] = imdb_movie["runtimes"]
-        play_date["imdb_info"]["plot"] = imdb_movie["plot"]
-        play_date["imdb_info"]["year"] = imdb_movie["year"]
-        play_date["imdb_info"]["rating"] = imdb_movie["rating"]
-
-    # blank out last "Fetching data" line if we're in a terminal, else just \n
-    if sys.stdout.isatty():
-        print("\r" + " " * 78)
+def warn_imdb_info_failed(play_date):
+    logger.warning(
+        "Can't get IMDb info, skipping: %s",
+        play_date["name"],
+        extra={
+            "stage": "enrich",
+            "warning_type": "imdb_info_failed",
+            "movie": play_date["name"],
+        },
+    )
+
+
+def imdb_movie_num(imdb_url):
+    """Extract imdb movie number (digits after "tt") from imdb url
+    """
+    imdb_mnum_re = re.search(r"\/tt(\d+)", imdb_url)
+    if imdb_mnum_re:
+        return imdb_mnum_re.group(1)
     else:
-        print("\n", end="")
+        return None
+
+
+def search_imdb_movie(movie_name):
+    """Search imdb.com for the one movie with title and year of movie_name
+
+    Returns:
+        str: imdb movie number, or None if not found
+
+    Raises:
+        IMDbError, OSError: if IMDb can't be searched
+    """
+    logger.info(
+        "Searching IMDb: %s",
+        movie_name,
+        extra={"stage": "enrich", "movie": movie_name},
+    )
+    (title, year) = split_name_year(movie_name)
+    title_cmp = normalize_title(title)
+
+    ia = IMDb()
+    for result in ia.search_movie(title):
+        result_title = split_name_year(str(result.get("title", "")))[0]
+        if normalize_title(result_title) != title_cmp:
+            continue
+        if year != -1 and result.get("year") != year:
+            continue
+        return result.movieID
+    return None
+
+
+def resolve_unlinked(play_dates):
+    """Find imdb url of each play_date listed without an imdb link, that
+    wasn't found in the title index when parsed
+
+    Returns:
+        list: play_dates, without any that can't be found (or searched for,
+            if IMDb can't be reached)
+    """
+    resolved = []
+    for play_date in play_dates:
+        if play_date["imdb_url"] is None:
+            # another calendar may have found it since this one was parsed
+            title_index = get_title_index()
+            movie_num = title_index.lookup(play_date["name"])
+            if movie_num is None:
+                try:
+                    movie_num = search_imdb_movie(play_date["name"])
+                except (IMDbError, OSError) as err:
+                    # leave it unlinked, to search for again next run
+                    logger.warning(
+                        "Can't search IMDb, skipping: %s (%s: %s)",
+                        play_date["name"],
+                        type(err).__name__,
+                        err,
+                        extra={
+                            "stage": "enrich",
+                            "warning_type": "imdb_search_failed",
+                            "movie": play_date["name"],
+                        },
+                    )
+                    continue
+                if movie_num is None:
+                    logger.warning(
+                        "Can't find on IMDb, skipping: %s",
+                        play_date["name"],
+                        extra={
+                            "stage": "enrich",
+                            "warning_type": "imdb_not_found",
+                            "movie": play_date["name"],
+                        },
+                    )
+                    continue
+                imdb_movie = fetch_imdb_info_cache(movie_num, play_date["name"])
+                if imdb_movie is None:
+                    # leave it unlinked, to search for again next run
+                    warn_imdb_info_failed(play_date)
+                    continue
+                title_index.add(movie_num, imdb_movie)
+            play_date["imdb_url"] = IMDB_TITLE_URL % movie_num
+        resolved.append(play_date)
+    return resolved
+
+
+def get_imdb_info(play_dates, info=DEFAULT_IMDB_INFO):
+    """Returns (list): play_dates with imdb info added, without any whose
+        info can't be loaded or fetched
+    """
+    return list(iter_imdb_info(play_dates, info=info))
+
+
+def set_imdb_info(play_date, imdb_movie):
+    """Set play_date["imdb_info"] to every field imdb_movie holds
+    """
+    play_date["imdb_info"] = {
+        x: imdb_movie[x] for x in IMDB_INFO_FIELDS if x in imdb_movie
+    }
+
+
+def iter_imdb_info(play_dates, info=DEFAULT_IMDB_INFO):
+    """Add imdb info to each play_date, yielding it as soon as done
+
+    Info sets in info are fetched if not cached; others are added only if
+    already cached (see require_imdb_info()).  Play_dates whose info can't
+    be loaded or fetched are skipped.
+    """
+    for play_date in play_dates:
+        imdb_movie = fetch_imdb_info_cache(
+            imdb_movie_num(play_date["imdb_url"]), play_date["name"], info=info
+        )
+        if imdb_movie is None:
+            warn_imdb_info_failed(play_date)
+            continue
+        set_imdb_info(play_date, imdb_movie)
+
+        yield play_date
+
+
+def require_imdb_info(play_dates, info):
+    """Make sure imdb_info of each play_date holds info sets in info,
+    fetching any that are missing
+    """
+    fields = [x for info_set in info for x in IMDB_INFO_SETS[info_set]]
+    for play_date in play_dates:
+        if all(x in play_date["imdb_info"] for x in fields):
+            continue
+        imdb_movie = fetch_imdb_info_cache(
+            imdb_movie_num(play_date["imdb_url"]), play_date["name"], info=info
+        )
+        if imdb_movie is None:
+            # described without a plot, like movies IMDb has no plot for
+            play_date["imdb_info"].setdefault("plot", [""])
+            continue
+        set_imdb_info(play_date, dict(play_date["imdb_info"], **imdb_movie))
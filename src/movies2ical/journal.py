@@ -0,0 +1,178 @@
+"""Run journal: checkpoints of each calendar's progress through the pipeline,
+so an interrupted run can be resumed with --resume instead of starting over
+
+The journal is a json-lines file, appended to as each calendar finishes
+each stage, so it survives the run being killed at any point (a partly
+written last line is ignored).  Runs with different arguments keep separate
+journals (named by hash of run_signature()), and a run holds a lock on its
+journal until it ends, so a run with the same arguments waits for it
+instead of overwriting its checkpoints.  A journal's first line describes
+the run, and its last line marks the run complete.  Each checkpoint line is:
+
+    {"calendar": key, "stage": stage, ...stage data}
+
+where stage is one of:
+    "fetched": data is srcfile, relpath, is_new, source (name)
+    "parsed": data is play_dates, as parsed
+    "enriched": no data, imdb info is in cache, datetimes are recomputed
+    "written": data is wrote
+"""
+import contextlib
+import datetime
+import hashlib
+import json
+import logging
+import threading
+
+from .cache_io import key_lock
+from .constants import RUN_JOURNAL_DIR
+
+logger = logging.getLogger(__name__)
+
+JOURNAL_STAGES = ["fetched", "parsed", "enriched", "written"]
+
+
+def run_signature(args, sources):
+    """Returns (dict): everything about a run that must match to resume it
+    """
+    return {
+        "file": args.file,
+        "srcfile": [str(x) for x in args.srcfile],
+        "sources": [x.name for x in sources],
+        "format": args.format,
+        "output": args.output,
+        "db": None if args.db is None else str(args.db),
+        "correct_times": args.correct_times,
+        "imdb_info": args.imdb_info,
+        "base_urls": [x.base_url for x in sources],
+    }
+
+
+def journal_filename(signature, journal_dir=RUN_JOURNAL_DIR):
+    """Returns (Path): journal file of runs with signature
+    """
+    signature_hash = hashlib.sha1(
+        json.dumps(signature, sort_keys=True).encode("utf-8")
+    ).hexdigest()
+    return journal_dir / (signature_hash[:16] + ".jsonl")
+
+
+def load_journal(journal_filename):
+    """Returns (tuple): (run info dict or None, list of checkpoint dicts,
+        True if run completed)
+    """
+    run_info = None
+    checkpoints = []
+    complete = False
+    try:
+        with open(journal_filename, "r", encoding="utf-8") as journal_fh:
+            for line in journal_fh:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # partly written line of killed run
+                    continue
+                if "run" in entry:
+                    run_info = entry["run"]
+                elif entry.get("complete"):
+                    complete = True
+                elif "calendar" in entry:
+                    checkpoints.append(entry)
+    except FileNotFoundError:
+        pass
+    return (run_info, checkpoints, complete)
+
+
+class RunJournal:
+    """Checkpoints of this run, and of the interrupted run being resumed
+    """
+
+    def __init__(self, journal_dir=RUN_JOURNAL_DIR):
+        self.journal_dir = journal_dir
+        self.journal_filename = None
+        self.journal_fh = None
+        # holds lock on journal file from start() to close()
+        self.exit_stack = contextlib.ExitStack()
+        # calendar key to merged checkpoints of resumed run
+        self.resumed = {}
+        self.lock = threading.Lock()
+
+    def start(self, signature, resume=False):
+        """Start journal of new run, first loading checkpoints of the last
+        run if resume and it was interrupted doing the same thing
+
+        Waits for any other run with the same signature to end first.
+        """
+        self.journal_filename = journal_filename(signature, self.journal_dir)
+        self.journal_dir.mkdir(exist_ok=True, parents=True)
+        self.exit_stack.enter_context(key_lock(self.journal_filename))
+        if resume:
+            (run_info, checkpoints, complete) = load_journal(self.journal_filename)
+            if run_info is None:
+                logger.info("No interrupted run to resume, starting over")
+            elif complete:
+                logger.info("Last run completed, starting over")
+            elif run_info.get("signature") != signature:
+                # same hash, different signature: not the same run after all
+                logger.warning(
+                    "Can't resume: interrupted run had different arguments, "
+                    "starting over",
+                    extra={"warning_type": "resume_mismatch"},
+                )
+            else:
+                for checkpoint in checkpoints:
+                    state = self.resumed.setdefault(checkpoint["calendar"], {})
+                    state.update(checkpoint)
+                logger.info(
+                    "Resuming run started %s (%d calendars in progress or done)",
+                    run_info.get("started"),
+                    len(self.resumed),
+                )
+
+        self.journal_fh = open(self.journal_filename, "w", encoding="utf-8")
+        self._write(
+            {
+                "run": {
+                    "started": datetime.datetime.now().isoformat(),
+                    "signature": signature,
+                }
+            }
+        )
+        # carry over resumed checkpoints, so they survive another interruption
+        for state in self.resumed.values():
+            self._write(state)
+
+    def resumed_state(self, calendar_key, stage=None):
+        """Returns (dict): merged checkpoints of calendar in resumed run, or
+            None if it didn't get to stage (or at all)
+        """
+        state = self.resumed.get(calendar_key)
+        if state is None:
+            return None
+        if stage is not None and JOURNAL_STAGES.index(
+            state["stage"]
+        ) < JOURNAL_STAGES.index(stage):
+            return None
+        return state
+
+    def checkpoint(self, calendar_key, stage, **data):
+        """Record that calendar finished stage
+        """
+        self._write(dict(data, calendar=calendar_key, stage=stage))
+
+    def complete(self):
+        self._write({"complete": True})
+        self.close()
+
+    def close(self):
+        with self.lock:
+            if self.journal_fh is not None:
+                self.journal_fh.close()
+                self.journal_fh = None
+        self.exit_stack.close()
+
+    def _write(self, entry):
+        line = json.dumps(entry) + "\n"
+        with self.lock:
+            self.journal_fh.write(line)
+            self.journal_fh.flush()
@@ -0,0 +1,154 @@
+"""Lifecycle of fetched calendars: each calendar's date range, from its parse
+results, and whether it has ended
+
+A calendar whose last show date is more than CALENDAR_FREEZE_AFTER_DAYS ago
+is frozen: runs no longer check the web for changes to it, or reprocess its
+cached html, so scheduled runs only cost as much as current calendars.  A
+run with --include-frozen checks and reprocesses them all again, and
+re-freezes only those that are still over.
+
+Calendars don't give their year, so it is guessed from the date they were
+fetched, and a calendar of January shows fetched in December parses as
+January of the year that is ending.  Such a calendar is judged by its dates
+a year later instead.  Other calendars whose shows all end before they were
+fetched are over, and frozen like any other.
+
+State is kept in a json file, by calendar key (venue/link, as in the run
+journal):
+
+    {key: {"first_date": "YYYY-MM-DD", "last_date": "YYYY-MM-DD",
+        "frozen": bool, "updated": "YYYY-MM-DD"}}
+"""
+import datetime
+import json
+import logging
+import threading
+
+from .cache_io import atomic_write, key_lock
+from .constants import CALENDAR_FREEZE_AFTER_DAYS, CALENDAR_LIFECYCLE_FILE
+
+logger = logging.getLogger(__name__)
+
+
+def load_lifecycle(lifecycle_filename):
+    try:
+        with open(lifecycle_filename, "r", encoding="utf-8") as lifecycle_fh:
+            return json.load(lifecycle_fh)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def play_dates_range(play_dates):
+    """Returns (tuple): (first, last) datetime.date of play_dates, or None if
+        there are none
+    """
+    if not play_dates:
+        return None
+    return (
+        min(datetime.date(*x["show_startdate"]) for x in play_dates),
+        max(datetime.date(*x["show_enddate"]) for x in play_dates),
+    )
+
+
+def next_year(date):
+    """Returns (datetime.date): date a year later (February 29 becomes 28)
+    """
+    try:
+        return date.replace(year=date.year + 1)
+    except ValueError:
+        return date.replace(year=date.year + 1, day=28)
+
+
+def misparsed_year(date_range, fetch_date):
+    """Returns (bool): True if calendar of date_range, fetched on fetch_date,
+        may be of the year after the one it was parsed as, i.e. it was
+        fetched in December and starts in January of that year
+    """
+    return (
+        fetch_date.month == 12
+        and date_range[0].year == fetch_date.year
+        and date_range[0].month == 1
+        and date_range[1] < fetch_date
+    )
+
+
+class CalendarLifecycle:
+    """Date ranges and frozen state of calendars, updated during a run and
+    saved at its end
+    """
+
+    def __init__(self, lifecycle_filename=CALENDAR_LIFECYCLE_FILE):
+        self.lifecycle_filename = lifecycle_filename
+        self.calendars = load_lifecycle(lifecycle_filename)
+        # calendars recorded this run, guarded by lock
+        self.updated = {}
+        self.lock = threading.Lock()
+
+    def is_frozen(self, calendar_key):
+        return self.calendars.get(calendar_key, {}).get("frozen", False)
+
+    def record(self, calendar_key, play_dates, fetch_date=None, today=None):
+        """Record date range of calendar from its play_dates, freezing it if
+        it has ended
+
+        Args:
+            calendar_key (str): venue/link of calendar
+            play_dates (list): play_dates parsed from calendar
+            fetch_date (datetime.date): date calendar's html was fetched, if
+                known
+            today (datetime.date): date to judge by (Default: today)
+
+        Returns:
+            bool: True if calendar is now frozen
+        """
+        date_range = play_dates_range(play_dates)
+        if date_range is None:
+            # nothing to go by, keep checking it
+            return False
+        today = today or datetime.date.today()
+        if fetch_date is not None and misparsed_year(date_range, fetch_date):
+            logger.debug(
+                "January calendar fetched in December (%s), judging it by "
+                "dates a year later",
+                fetch_date.isoformat(),
+                extra={
+                    "calendar": calendar_key,
+                    "warning_type": "year_boundary",
+                },
+            )
+            date_range = (next_year(date_range[0]), next_year(date_range[1]))
+        frozen = (today - date_range[1]).days > CALENDAR_FREEZE_AFTER_DAYS
+        with self.lock:
+            self.updated[calendar_key] = {
+                "first_date": date_range[0].isoformat(),
+                "last_date": date_range[1].isoformat(),
+                "frozen": frozen,
+                "updated": today.isoformat(),
+            }
+        return frozen
+
+    def save(self):
+        """Merge calendars recorded this run into lifecycle file
+        """
+        if not self.updated:
+            return
+        self.lifecycle_filename.parent.mkdir(exist_ok=True, parents=True)
+        # other runs may have recorded other calendars since this one started
+        with key_lock(self.lifecycle_filename):
+            calendars = load_lifecycle(self.lifecycle_filename)
+            with self.lock:
+                calendars.update(self.updated)
+            atomic_write(
+                self.lifecycle_filename, json.dumps(calendars, indent=1, sort_keys=True)
+            )
+        num_frozen = sum(
+            x["frozen"] and not self.is_frozen(key)
+            for (key, x) in self.updated.items()
+        )
+        self.calendars = calendars
+        if num_frozen:
+            logger.info(
+                "%d calendar%s ended, now frozen",
+                num_frozen,
+                "s" if num_frozen != 1 else "",
+            )
@@ -0,0 +1,166 @@
+"""Logging setup: human-readable console messages, plus optional buffered
+json-lines log file with structured fields
+
+Modules log with logging.getLogger(__name__), and add structured fields
+with extra=, e.g.:
+
+    logger.warning("...", extra={"warning_type": "inconsistent_year"})
+
+Fields used: calendar, stage, duration (seconds), warning_type, movie, url
+"""
+import contextlib
+import datetime
+import json
+import logging
+import logging.handlers
+import sys
+import threading
+import time
+
+from .constants import LOG_BUFFER_RECORDS
+
+LOGGER_NAME = "movies2ical"
+
+# attributes every LogRecord has, i.e. not structured fields from extra=
+_STANDARD_RECORD_ATTRS = set(
+    logging.LogRecord("", 0, "", 0, "", (), None).__dict__
+) | {"message", "asctime"}
+
+_context = threading.local()
+
+
+@contextlib.contextmanager
+def calendar_context(calendar):
+    """Add calendar=calendar to every record logged by this thread within
+    """
+    old_calendar = getattr(_context, "calendar", None)
+    _context.calendar = calendar
+    try:
+        yield
+    finally:
+        _context.calendar = old_calendar
+
+
+@contextlib.contextmanager
+def stage_context(calendar, stage):
+    """Tag records logged by this thread within with calendar, and log how
+    long this pipeline stage took for calendar
+    """
+    start_time = time.monotonic()
+    with calendar_context(calendar):
+        yield
+        duration = time.monotonic() - start_time
+        logging.getLogger(LOGGER_NAME).debug(
+            "%s took %.2fs",
+            stage,
+            duration,
+            extra={"stage": stage, "duration": round(duration, 4)},
+        )
+
+
+class CalendarFilter(logging.Filter):
+    def filter(self, record):
+        if not hasattr(record, "calendar"):
+            record.calendar = getattr(_context, "calendar", None)
+        return True
+
+
+class ConsoleFormatter(logging.Formatter):
+    """Message, after name of its calendar if it has one, so messages of
+    calendars processed in parallel can be told apart
+    """
+
+    def format(self, record):
+        message = super().format(record)
+        if getattr(record, "calendar", None):
+            message = "%s: %s" % (record.calendar, message)
+        return message
+
+
+class JsonLinesFormatter(logging.Formatter):
+    def format(self, record):
+        log_entry = {
+            "time": datetime.datetime.fromtimestamp(record.created).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for (key, value) in record.__dict__.items():
+            if key not in _STANDARD_RECORD_ATTRS and value is not None:
+                log_entry[key] = value
+        if record.exc_info:
+            log_entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(log_entry, default=str)
+
+
+def setup_logging(verbose=False, quiet=False, json_log=None, console=None):
+    """Configure movies2ical logger
+
+    Args:
+        verbose (bool): show debug messages on console
+        quiet (bool): only show warnings and errors on console
+        json_log (Path): if given, append every message (including debug)
+            as a json line to this file, buffered in memory and written in
+            large chunks
+        console (file): stream for console messages (default: sys.stdout)
+    """
+    logger = logging.getLogger(LOGGER_NAME)
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+        handler.close()
+    logger.setLevel(logging.DEBUG)
+    logger.propagate = False
+
+    console_handler = logging.StreamHandler(console or sys.stdout)
+    console_handler.setFormatter(ConsoleFormatter("%(message)s"))
+    if quiet:
+        console_handler.setLevel(logging.WARNING)
+    elif verbose:
+        console_handler.setLevel(logging.DEBUG)
+    else:
+        console_handler.setLevel(logging.INFO)
+    console_handler.addFilter(CalendarFilter())
+    logger.addHandler(console_handler)
+
+    if json_log is not None:
+        file_handler = logging.FileHandler(str(json_log), mode="a", encoding="utf-8")
+        file_handler.setFormatter(JsonLinesFormatter())
+        buffer_handler = logging.handlers.MemoryHandler(
+            LOG_BUFFER_RECORDS, flushLevel=logging.ERROR, target=file_handler
+        )
+        buffer_handler.addFilter(CalendarFilter())
+        logger.addHandler(buffer_handler)
+
+    return logger
+
+
+def start_worker_logging():
+    """Start forwarding log records from worker processes to our handlers
+
+    Returns:
+        tuple: (log_queue, listener) pass log_queue to init_worker_logging()
+            in each worker, call listener.stop() when workers are done
+    """
+    # imported here so threads-only runs never start multiprocessing machinery
+    import multiprocessing
+
+    logger = logging.getLogger(LOGGER_NAME)
+    log_queue = multiprocessing.Queue()
+    listener = logging.handlers.QueueListener(
+        log_queue, *logger.handlers, respect_handler_level=True
+    )
+    listener.start()
+    return (log_queue, listener)
+
+
+def init_worker_logging(log_queue):
+    """In worker process, send all log records to parent through log_queue
+    """
+    logger = logging.getLogger(LOGGER_NAME)
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    queue_handler.addFilter(CalendarFilter())
+    logger.addHandler(queue_handler)
+    logger.setLevel(logging.DEBUG)
+    logger.propagate = False
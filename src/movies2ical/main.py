@@ -4,12 +4,13 @@
 
 import sys
 import argparse
+import contextlib
 import datetime
+import logging
+import os
 from pathlib import Path
 import plistlib
-import traceback
 
-import requests
 import toml
 
 # from movies2ical.constants import (
@@ -17,16 +18,30 @@ from .constants import (
     CONFIG_DIR,
     CONFIG_FILE,
     IMDB_CACHE_DIR,
-    ICAL_OUT_DIR,
     THEATER_CACHE_DIR,
     DEFAULT_PLIST_INFO,
     DEFAULT_CONFIG_TOML_STR,
+    DEFAULT_IMDB_INFO,
+    IMDB_INFO_SETS,
+    SHOWINGS_DB_FILE,
+    THEATER_BASEURL,
+    WORK_LEASE_SECONDS,
+    WORK_MAX_ATTEMPTS,
+    WORK_POLL_SECONDS,
+    WORK_QUEUE_FILE,
 )
-from .parse_schedule import parse_html_calendar, compute_datetimes
-from .schedule_acquire import fetch_schedule_htmls
-from .verify import check_for_problems
-from .imdb import get_imdb_info
-from .outputs import gen_ical
+from .pipeline import run_pipeline
+from .database import query_showings, report_showings
+from .cache_bundle import export_cache, import_cache
+from .replay_server import make_replay_server
+from .sources import load_sources
+from .synthetic import BENCHMARK_SIZES, run_benchmark, write_synthetic
+from .notify import NotifyDispatcher
+from .log import setup_logging
+from .work_queue import WorkQueue
+from .worker import report_queue_status, run_worker, submit_run
+
+logger = logging.getLogger(__name__)
 
 
 def process_command_line(argv):
@@ -61,7 +76,33 @@ def process_command_line(argv):
         "--file",
         action="store_true",
         help="Parse files from arguments instead of going to "
-        "www.stanfordtheatre.org to find calendar.",
+        "www.stanfordtheatre.org to find calendar.  Directories are "
+        "searched recursively, and their .ics files are written to a "
+        "mirrored directory tree.",
+    )
+    parser.add_argument(
+        "--source",
+        action="append",
+        dest="sources",
+        metavar="NAME",
+        help="Only fetch calendars of this venue, by name from a [[sources]] "
+        "section of config file.  Can be given more than once.  With -f, "
+        "files are parsed as calendars of the first venue. (Default: all "
+        "venues)",
+    )
+    parser.add_argument(
+        "--base-url",
+        help="Theater website to fetch calendars from (of the first venue, if "
+        "there are several).  (Default: base_url in [theater] or [[sources]] "
+        "section of config file, or %s)" % THEATER_BASEURL,
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="Number of calendars to parse and enrich in parallel. (Default: "
+        "number of CPUs)",
     )
     parser.add_argument(
         "-c",
@@ -70,15 +111,75 @@ def process_command_line(argv):
         help="If runtime from imdb causes movie end time to overlap next "
         "movie's scheduled start time, correct end time.",
     )
+    parser.add_argument(
+        "--imdb-info",
+        action="append",
+        choices=sorted(IMDB_INFO_SETS),
+        metavar="SET",
+        help="IMDb info set (%s) to fetch for every movie.  Can be given more "
+        "than once.  main is always fetched; other sets are only fetched when "
+        "an output needs them. (Default: info in [imdb] section of config "
+        "file, or %s)"
+        % (", ".join(sorted(IMDB_INFO_SETS)), " ".join(DEFAULT_IMDB_INFO)),
+    )
+    parser.add_argument(
+        "--include-frozen",
+        action="store_true",
+        help="Also check and reprocess calendars whose showings are all over, "
+        "which are otherwise frozen (skipped) once processed.",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Continue an interrupted run from its journal, skipping calendars "
+        "it already finished, instead of starting over.",
+    )
     parser.add_argument(
         "-v", "--verbose", action="store_true", help="More verbose messages."
     )
+    parser.add_argument(
+        "-q",
+        "--quiet",
+        action="store_true",
+        help="Only show warnings and errors.",
+    )
+    parser.add_argument(
+        "--log-json",
+        type=Path,
+        help="Also append all messages, with structured fields (calendar, "
+        "stage, duration, warning_type), to this file as json lines.",
+    )
     parser.add_argument(
         "-n",
         "--notify",
         action="store_true",
         help="Use Notify17 to send notifications on success or failure.",
     )
+    parser.add_argument(
+        "--format",
+        choices=["ics", "ndjson"],
+        default="ics",
+        help="Output format: ical files, or newline-delimited json records, "
+        "one per showing. (Default: ics)",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        help="With --format ndjson, write records for all calendars to this "
+        "one file ('-' for stdout) instead of one file per calendar.  Records "
+        "are written as soon as each is ready, so records of different "
+        "calendars may be interleaved.",
+    )
+    parser.add_argument(
+        "--db",
+        nargs="?",
+        const=SHOWINGS_DB_FILE,
+        default=None,
+        type=Path,
+        help="Also store all showings and their imdb info in a sqlite3 "
+        "database, for use with 'movies2ical query'. (Default database: %s)"
+        % SHOWINGS_DB_FILE,
+    )
     parser.add_argument(
         "--plist",
         action="store_true",
@@ -90,10 +191,512 @@ def process_command_line(argv):
     return args
 
 
-def send_notify17(notify17_url, data):
-    r = requests.post(url=notify17_url, data=data)
-    # print reply
-    print(r.text, file=sys.stderr)
+def iso_date(date_str):
+    return datetime.datetime.strptime(date_str, "%Y-%m-%d").date()
+
+
+def process_query_command_line(argv):
+    """Process command line arguments for the query subcommand.
+
+    Args:
+        argv: list of arguments after "query"
+
+    Returns:
+        args: Namespace with named attributes of arguments and switches
+    """
+    parser = argparse.ArgumentParser(
+        prog="movies2ical query",
+        description="Search database of past and present showings "
+        "(populated by running with --db).",
+    )
+    parser.add_argument(
+        "--db",
+        default=SHOWINGS_DB_FILE,
+        type=Path,
+        help="sqlite3 database to search. (Default: %s)" % SHOWINGS_DB_FILE,
+    )
+    parser.add_argument(
+        "--director",
+        help="Showings of movies by this director (start of name or of any "
+        "word of it, e.g. hitchcock).",
+    )
+    parser.add_argument(
+        "--imdb", help="Showings of this imdb movie number (e.g. tt0048473)."
+    )
+    parser.add_argument(
+        "--date", type=iso_date, help="Showings playing on this date (YYYY-MM-DD)."
+    )
+    parser.add_argument(
+        "--since", type=iso_date, help="Showings on or after this date (YYYY-MM-DD)."
+    )
+    parser.add_argument(
+        "--until",
+        type=iso_date,
+        help="Showings on or before this date (YYYY-MM-DD).",
+    )
+    parser.add_argument("--venue", help="Showings at this venue.")
+
+    args = parser.parse_args(argv)
+
+    return args
+
+
+def query_main(argv):
+    args = process_query_command_line(argv)
+
+    imdb_id = args.imdb
+    if imdb_id is not None:
+        imdb_id = imdb_id.lstrip("t")
+    showings = query_showings(
+        args.db,
+        director=args.director,
+        imdb_id=imdb_id,
+        on_date=args.date,
+        since=args.since,
+        until=args.until,
+        venue=args.venue,
+    )
+    report_showings(showings)
+
+    return 0
+
+
+def process_cache_command_line(argv):
+    """Process command line arguments for the cache subcommand.
+
+    Args:
+        argv: list of arguments after "cache"
+
+    Returns:
+        args: Namespace with named attributes of arguments and switches
+    """
+    parser = argparse.ArgumentParser(
+        prog="movies2ical cache",
+        description="Export or import all cached imdb info, calendar html "
+        "files, and showings database (written by runs with --db) as one "
+        "bundle file, e.g. to warm-start a new machine.",
+    )
+    subparsers = parser.add_subparsers(dest="action")
+    subparsers.required = True
+
+    export_parser = subparsers.add_parser("export", help="Write cache bundle.")
+    export_parser.add_argument(
+        "-o",
+        "--output",
+        type=Path,
+        default=Path(
+            "movies2ical_cache_%s.tar.gz" % datetime.date.today().strftime("%Y%m%d")
+        ),
+        help="Bundle file to write. (Default: movies2ical_cache_<date>.tar.gz)",
+    )
+
+    import_parser = subparsers.add_parser(
+        "import", help="Merge cache bundle(s) into local cache, newest wins."
+    )
+    import_parser.add_argument("bundle", nargs="+", type=Path, help="Bundle file.")
+
+    args = parser.parse_args(argv)
+
+    return args
+
+
+def cache_main(argv):
+    args = process_cache_command_line(argv)
+
+    if args.action == "export":
+        export_cache(args.output)
+    else:
+        for bundle_filename in args.bundle:
+            import_cache(bundle_filename)
+
+    return 0
+
+
+def process_replay_command_line(argv):
+    """Process command line arguments for the replay-server subcommand.
+
+    Args:
+        argv: list of arguments after "replay-server"
+
+    Returns:
+        args: Namespace with named attributes of arguments and switches
+    """
+    parser = argparse.ArgumentParser(
+        prog="movies2ical replay-server",
+        description="Serve a directory of saved calendar html files as a "
+        "local stand-in for the theater website, for use with --base-url.",
+    )
+    parser.add_argument(
+        "corpus_dir",
+        nargs="?",
+        type=Path,
+        default=Path("test"),
+        help="Directory of calendar html files. (Default: test)",
+    )
+    parser.add_argument("--host", default="localhost", help="(Default: localhost)")
+    parser.add_argument("--port", type=int, default=8000, help="(Default: 8000)")
+    parser.add_argument(
+        "--latency",
+        type=float,
+        default=0.0,
+        help="Mean seconds to delay each response. (Default: 0)",
+    )
+    parser.add_argument(
+        "--error-rate",
+        type=float,
+        default=0.0,
+        help="Fraction of requests to answer with a 503 error. (Default: 0)",
+    )
+    parser.add_argument(
+        "--no-last-modified",
+        action="store_true",
+        help="Don't send Last-Modified or honor If-Modified-Since.",
+    )
+    parser.add_argument(
+        "--no-etag",
+        action="store_true",
+        help="Don't send ETag or honor If-None-Match.",
+    )
+    parser.add_argument(
+        "--seed", type=int, help="Random seed for latency and error injection."
+    )
+
+    args = parser.parse_args(argv)
+
+    return args
+
+
+def replay_main(argv):
+    args = process_replay_command_line(argv)
+
+    server = make_replay_server(
+        args.corpus_dir,
+        host=args.host,
+        port=args.port,
+        latency=args.latency,
+        error_rate=args.error_rate,
+        last_modified=not args.no_last_modified,
+        etag=not args.no_etag,
+        seed=args.seed,
+    )
+    logger.info(
+        "Serving %s at http://%s:%d/", args.corpus_dir, *server.server_address[:2]
+    )
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+    return 0
+
+
+def process_synthetic_command_line(argv):
+    """Process command line arguments for the synthetic subcommand.
+
+    Args:
+        argv: list of arguments after "synthetic"
+
+    Returns:
+        args: Namespace with named attributes of arguments and switches
+    """
+    parser = argparse.ArgumentParser(
+        prog="movies2ical synthetic",
+        description="Write a synthetic Stanford-Theatre-style calendar of any "
+        "size, plus imdb fixture records for its movies (copy them into the "
+        "imdb cache to process the calendar with -f).",
+    )
+    parser.add_argument(
+        "out_dir", type=Path, help="Directory to write calendar and records to."
+    )
+    parser.add_argument(
+        "--play-dates",
+        type=int,
+        default=1000,
+        help="Number of play dates (movie and date range). (Default: 1000)",
+    )
+    parser.add_argument(
+        "--movies",
+        type=int,
+        help="Number of different movies. (Default: half the play dates, up "
+        "to 2000)",
+    )
+    parser.add_argument(
+        "--year", type=int, default=2019, help="Year of calendar. (Default: 2019)"
+    )
+    parser.add_argument("--seed", type=int, help="Random seed.")
+
+    args = parser.parse_args(argv)
+
+    return args
+
+
+def synthetic_main(argv):
+    args = process_synthetic_command_line(argv)
+
+    write_synthetic(
+        args.out_dir,
+        args.play_dates,
+        num_movies=args.movies,
+        year=args.year,
+        seed=args.seed,
+    )
+
+    return 0
+
+
+def process_benchmark_command_line(argv):
+    """Process command line arguments for the benchmark subcommand.
+
+    Args:
+        argv: list of arguments after "benchmark"
+
+    Returns:
+        args: Namespace with named attributes of arguments and switches
+    """
+    parser = argparse.ArgumentParser(
+        prog="movies2ical benchmark",
+        description="Time each stage (parse, datetimes, verify, output...) on "
+        "synthetic calendars of increasing size, and report how fast each "
+        "grows.  No network or cache is used.",
+    )
+    parser.add_argument(
+        "--sizes",
+        type=int,
+        nargs="+",
+        default=BENCHMARK_SIZES,
+        help="Play dates per calendar.  Every stage is linear, but 100000 "
+        "still takes a few minutes. (Default: %s)"
+        % " ".join(str(x) for x in BENCHMARK_SIZES),
+    )
+    parser.add_argument(
+        "--seed", type=int, default=0, help="Random seed. (Default: 0)"
+    )
+
+    args = parser.parse_args(argv)
+
+    return args
+
+
+def benchmark_main(argv):
+    args = process_benchmark_command_line(argv)
+
+    run_benchmark(sizes=args.sizes, seed=args.seed)
+
+    return 0
+
+
+def process_queue_command_line(argv):
+    """Process command line arguments for the queue subcommand.
+
+    Args:
+        argv: list of arguments after "queue"
+
+    Returns:
+        args: Namespace with named attributes of arguments and switches
+    """
+    parser = argparse.ArgumentParser(
+        prog="movies2ical queue",
+        description="Submit a run to a work queue, to be processed by any "
+        "number of 'movies2ical worker' processes (on any machines sharing "
+        "the queue file), or show the queue's progress.",
+    )
+    parser.add_argument(
+        "--queue-db",
+        type=Path,
+        default=WORK_QUEUE_FILE,
+        help="Work queue database. (Default: %s)" % WORK_QUEUE_FILE,
+    )
+    subparsers = parser.add_subparsers(dest="action")
+    subparsers.required = True
+
+    submit_parser = subparsers.add_parser(
+        "submit", help="Add a run (same as a plain movies2ical run) to queue."
+    )
+    submit_parser.add_argument(
+        "srcfile", nargs="*", help="Source directory (recursively searched)."
+    )
+    submit_parser.add_argument(
+        "-f",
+        "--file",
+        action="store_true",
+        help="Parse files from arguments (which workers must be able to read) "
+        "instead of fetching calendars from the web.",
+    )
+    submit_parser.add_argument(
+        "--source",
+        action="append",
+        dest="sources",
+        metavar="NAME",
+        help="Only fetch calendars of this venue. (Default: all venues)",
+    )
+    submit_parser.add_argument(
+        "--base-url", help="Theater website to fetch calendars from."
+    )
+    submit_parser.add_argument(
+        "-c",
+        "--correct_times",
+        action="store_true",
+        help="Correct end times that overlap next movie's start time.",
+    )
+    submit_parser.add_argument(
+        "--imdb-info",
+        action="append",
+        choices=sorted(IMDB_INFO_SETS),
+        metavar="SET",
+        help="IMDb info set (%s) to fetch for every movie.  Can be given more "
+        "than once.  main is always fetched; other sets are only fetched when "
+        "an output needs them. (Default: info in [imdb] section of config "
+        "file, or %s)"
+        % (", ".join(sorted(IMDB_INFO_SETS)), " ".join(DEFAULT_IMDB_INFO)),
+    )
+    submit_parser.add_argument(
+        "--format",
+        choices=["ics", "ndjson"],
+        default="ics",
+        help="Output format. (Default: ics)",
+    )
+    submit_parser.add_argument(
+        "--db",
+        nargs="?",
+        const=SHOWINGS_DB_FILE,
+        default=None,
+        type=Path,
+        help="Also store all showings in a sqlite3 database. (Default "
+        "database: %s)" % SHOWINGS_DB_FILE,
+    )
+    submit_parser.add_argument(
+        "--out-dir",
+        type=Path,
+        default=Path("."),
+        help="Directory workers write output files to. (Default: current "
+        "directory)",
+    )
+    submit_parser.add_argument(
+        "-v", "--verbose", action="store_true", help="More verbose messages."
+    )
+
+    status_parser = subparsers.add_parser(
+        "status", help="Show progress of jobs, and throughput of workers."
+    )
+    status_parser.add_argument(
+        "--window",
+        type=int,
+        default=10,
+        help="Minutes of recent work to measure throughput over. (Default: 10)",
+    )
+
+    args = parser.parse_args(argv)
+
+    return args
+
+
+def queue_main(argv):
+    args = process_queue_command_line(argv)
+
+    with WorkQueue(args.queue_db) as work_queue:
+        if args.action == "submit":
+            config_info = get_config_info()
+            args.imdb_info = imdb_info_sets(args.imdb_info, config_info)
+            sources = load_sources(
+                config_info, names=args.sources, base_url=args.base_url
+            )
+            submit_run(work_queue, args, sources)
+        else:
+            report_queue_status(work_queue, window_minutes=args.window)
+
+    return 0
+
+
+def process_worker_command_line(argv):
+    """Process command line arguments for the worker subcommand.
+
+    Args:
+        argv: list of arguments after "worker"
+
+    Returns:
+        args: Namespace with named attributes of arguments and switches
+    """
+    parser = argparse.ArgumentParser(
+        prog="movies2ical worker",
+        description="Do fetch, parse, enrich and write jobs from a work queue "
+        "until stopped.  Workers can be started and stopped at any time; jobs "
+        "of a stopped worker are taken over by others when their lease runs "
+        "out.",
+    )
+    parser.add_argument(
+        "--queue-db",
+        type=Path,
+        default=WORK_QUEUE_FILE,
+        help="Work queue database. (Default: %s)" % WORK_QUEUE_FILE,
+    )
+    parser.add_argument(
+        "--worker-id", help="Name of worker in queue. (Default: host:pid)"
+    )
+    parser.add_argument(
+        "--lease",
+        type=float,
+        default=WORK_LEASE_SECONDS,
+        help="Seconds a job is held, renewed while it is worked on. (Default: "
+        "%d)" % WORK_LEASE_SECONDS,
+    )
+    parser.add_argument(
+        "--max-attempts",
+        type=int,
+        default=WORK_MAX_ATTEMPTS,
+        help="Attempts at a job before marking it failed. (Default: %d)"
+        % WORK_MAX_ATTEMPTS,
+    )
+    parser.add_argument(
+        "--poll",
+        type=float,
+        default=WORK_POLL_SECONDS,
+        help="Seconds to wait between looking for jobs when there are none. "
+        "(Default: %d)" % WORK_POLL_SECONDS,
+    )
+    parser.add_argument(
+        "--exit-when-idle",
+        action="store_true",
+        help="Stop when no jobs are left pending or being worked on.",
+    )
+    parser.add_argument(
+        "--max-jobs", type=int, help="Stop after doing this many jobs."
+    )
+    parser.add_argument(
+        "-v", "--verbose", action="store_true", help="More verbose messages."
+    )
+    parser.add_argument(
+        "-q",
+        "--quiet",
+        action="store_true",
+        help="Only show warnings and errors.",
+    )
+    parser.add_argument(
+        "--log-json",
+        type=Path,
+        help="Also append all messages, with structured fields, to this file "
+        "as json lines.",
+    )
+
+    args = parser.parse_args(argv)
+
+    return args
+
+
+def worker_main(argv):
+    args = process_worker_command_line(argv)
+
+    setup_logging(verbose=args.verbose, quiet=args.quiet, json_log=args.log_json)
+
+    run_worker(
+        lambda: WorkQueue(args.queue_db, max_attempts=args.max_attempts),
+        worker_id=args.worker_id,
+        lease_seconds=args.lease,
+        poll_seconds=args.poll,
+        exit_when_idle=args.exit_when_idle,
+        max_jobs=args.max_jobs,
+    )
+
+    return 0
 
 
 def setup_app_directories():
@@ -107,6 +710,18 @@ def setup_app_directories():
         config_toml_example_fh.write(DEFAULT_CONFIG_TOML_STR)
 
 
+def imdb_info_sets(arg_info, config_info):
+    """Returns (list): imdb info sets to fetch for every movie, from command
+        line or else config file
+    """
+    info = arg_info or config_info.get("imdb", {}).get("info", DEFAULT_IMDB_INFO)
+    unknown = set(info) - set(IMDB_INFO_SETS)
+    if unknown:
+        raise ValueError("Unknown IMDb info set(s): %s" % ", ".join(sorted(unknown)))
+    # main is always needed, for runtimes
+    return ["main"] + [x for x in IMDB_INFO_SETS if x != "main" and x in info]
+
+
 def get_config_info():
     try:
         config_info = toml.load(CONFIG_FILE)
@@ -124,88 +739,92 @@ def generate_plist_file(config_info):
         plistlib.dump(plist_info, plist_fh)
 
 
-def main(config_info, argv=None):
+def main(config_info, notifier, argv=None):
+    if argv is not None and len(argv) > 1 and argv[1] in SUBCOMMANDS:
+        return SUBCOMMANDS[argv[1]](argv[2:])
+
     args = process_command_line(argv)
 
+    if args.notify:
+        # retry any undelivered notifications from previous runs while we work
+        notifier.start()
+
     if args.plist:
         generate_plist_file(config_info)
         return 0
 
-    print("-" * 78)
-    print("Started at " + datetime.datetime.today().strftime("%I:%M%p %B %d, %Y"))
-    print("-" * 78, file=sys.stderr)
-    print(
-        "Started at " + datetime.datetime.today().strftime("%I:%M%p %B %d, %Y"),
-        file=sys.stderr,
-    )
-    if args.file:
-        new_srcfiles = [Path(x) for x in args.srcfile]
-        old_srcfiles = []
-    else:
-        (new_srcfiles, old_srcfiles) = fetch_schedule_htmls()
-
-    new_icals = []
-    for srcfile in new_srcfiles + old_srcfiles:
-        print("-" * 30)
-        print(srcfile.name)
-        print("-" * 30, file=sys.stderr)
-        print(srcfile.name, file=sys.stderr)
-
-        ics_filename = ICAL_OUT_DIR / (srcfile.stem + ".ics")
-
-        # parse html file, extract showtime info
-        play_dates = parse_html_calendar(srcfile, args.verbose)
-
-        # add imdb info to play_dates
-        get_imdb_info(play_dates)
-
-        # compute datetime data
-        compute_datetimes(play_dates)
+    sources = load_sources(config_info, names=args.sources, base_url=args.base_url)
+    args.imdb_info = imdb_info_sets(args.imdb_info, config_info)
+
+    with contextlib.ExitStack() as stack:
+        ndjson_fh = None
+        console = sys.stdout
+        if args.format == "ndjson" and args.output == "-":
+            ndjson_fh = sys.stdout
+            # keep stdout clean for records, send all messages to stderr
+            console = sys.stderr
+        elif args.format == "ndjson" and args.output is not None:
+            ndjson_fh = stack.enter_context(open(args.output, "w"))
+
+        setup_logging(
+            verbose=args.verbose,
+            quiet=args.quiet,
+            json_log=args.log_json,
+            console=console,
+        )
 
-        # check for schedule overlap, inconsistent data
-        check_for_problems(play_dates, correct_endtimes=args.correct_times)
+        logger.info("-" * 78)
+        logger.info(
+            "Started at %s",
+            datetime.datetime.today().strftime("%I:%M%p %B %d, %Y"),
+            extra={"stage": "start"},
+        )
 
-        # (debug) text report of play_dates
-        # report_playdates(play_dates)
+        calendars = run_pipeline(args, sources, ndjson_fh=ndjson_fh)
 
-        # write ical if we have any valid playdates
-        if play_dates:
-            gen_ical(play_dates, ical_filename=ics_filename)
-            if srcfile in new_srcfiles:
-                new_icals.append(ics_filename)
+    new_icals = [x["ics_filename"] for x in calendars if x["wrote"] and x["is_new"]]
 
-        # print "finished" at date/time message
-        print("Finished at " + datetime.datetime.today().strftime("%I:%M%p %B %d, %Y"))
-        print(
-            "Finished at " + datetime.datetime.today().strftime("%I:%M%p %B %d, %Y"),
-            file=sys.stderr,
-        )
     if new_icals and args.notify and "new_calendar_url" in config_info["notify17"]:
-        send_notify17(
-            notify17_url=config_info["notify17"]["new_calendar_url"],
-            data={"calendar_name": new_icals[0], "calendar_list": new_icals},
+        new_icals = [str(x) for x in new_icals]
+        notifier.notify(
+            config_info["notify17"]["new_calendar_url"],
+            {"calendar_name": new_icals[0], "calendar_list": new_icals},
+            batch="new_calendar",
         )
 
     return 0
 
 
+# subcommands with their own command line, selected by first argument
+SUBCOMMANDS = {
+    "query": query_main,
+    "cache": cache_main,
+    "replay-server": replay_main,
+    "synthetic": synthetic_main,
+    "benchmark": benchmark_main,
+    "queue": queue_main,
+    "worker": worker_main,
+}
+
+
 def cli():
+    setup_logging()
+    notifier = NotifyDispatcher()
     try:
         setup_app_directories()
         config_info = get_config_info()
-        status = main(config_info, sys.argv)
+        status = main(config_info, notifier, sys.argv)
     except KeyboardInterrupt:
-        print("Stopped by Keyboard Interrupt", file=sys.stderr)
+        logger.error("Stopped by Keyboard Interrupt")
         # exit error code for Ctrl-C
         status = 130
     except Exception as e:
-        traceback.print_exc()
+        logger.exception("Stopped by error: %s", e)
         if "error_url" in config_info["notify17"]:
-            send_notify17(
-                notify17_url=config_info["notify17"]["error_url"],
-                data={"error_text": str(e)},
-            )
+            notifier.notify(config_info["notify17"]["error_url"], {"error_text": str(e)})
         status = 1
+    finally:
+        notifier.close()
 
     sys.exit(status)
 
@@ -0,0 +1,223 @@
+"""Background delivery of Notify17 notifications, with an on-disk retry queue
+"""
+import json
+import logging
+import queue
+import threading
+import uuid
+
+import requests
+
+from .cache_io import atomic_write, key_lock
+from .constants import NOTIFY_MAX_ATTEMPTS, NOTIFY_QUEUE_FILE, NOTIFY_TIMEOUT
+
+logger = logging.getLogger(__name__)
+
+
+def load_notify_queue(queue_filename):
+    try:
+        with open(queue_filename, "r") as queue_fh:
+            return json.load(queue_fh)
+    except (FileNotFoundError, ValueError):
+        return []
+
+
+def notification_ids(notification):
+    """Returns (list): ids of queued notifications notification delivers
+    (more than one if it is a batch)
+    """
+    return notification.get("ids", [notification["id"]])
+
+
+def batch_notifications(notifications):
+    """Combine all new-calendar notifications to the same url into one
+
+    Returns:
+        list: notifications, with batched ones in place of the first one
+            of each batch
+    """
+    batched = []
+    batches = {}
+    for notification in notifications:
+        key = (notification["url"], notification.get("batch"))
+        if notification.get("batch") is None:
+            batched.append(notification)
+        elif key not in batches:
+            batches[key] = dict(
+                notification,
+                data=dict(notification["data"]),
+                ids=notification_ids(notification),
+            )
+            batched.append(batches[key])
+        else:
+            batch = batches[key]
+            batch["ids"] = batch["ids"] + notification_ids(notification)
+            for calendar in notification["data"]["calendar_list"]:
+                if calendar not in batch["data"]["calendar_list"]:
+                    batch["data"]["calendar_list"].append(calendar)
+            batch["attempts"] = min(batch["attempts"], notification["attempts"])
+    return batched
+
+
+class NotifyDispatcher:
+    """Send notifications from a background thread, so slow or unreachable
+    endpoints never hold up a run for longer than close() allows
+
+    Notifications not delivered by close() (failed, or still waiting) are
+    saved to queue_filename, and retried by the next run's start().  Queued
+    notifications stay in queue_filename until they are delivered, so none
+    are lost if a run is killed (but some may be delivered twice).
+    """
+
+    def __init__(self, queue_filename=NOTIFY_QUEUE_FILE, timeout=NOTIFY_TIMEOUT):
+        self.queue_filename = queue_filename
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.to_send = queue.Queue()
+        # notifications being sent, and ones that failed, guarded by lock
+        self.in_flight = []
+        self.undelivered = []
+        self.lock = threading.Lock()
+        # ids of notifications that are in queue_filename
+        self.queued_ids = set()
+        self.thread = None
+
+    def start(self):
+        """Start background delivery, beginning with previously queued ones
+        """
+        if self.thread is not None:
+            return
+
+        with key_lock(self.queue_filename):
+            retries = load_notify_queue(self.queue_filename)
+            # notifications queued before they had ids need them to be
+            #   removed from queue once delivered
+            if any("id" not in x for x in retries):
+                for notification in retries:
+                    notification.setdefault("id", uuid.uuid4().hex)
+                atomic_write(self.queue_filename, json.dumps(retries))
+        for notification in retries:
+            self.queued_ids.add(notification["id"])
+            self.to_send.put(notification)
+
+        self.thread = threading.Thread(target=self._deliver_all, daemon=True)
+        self.thread.start()
+
+    def notify(self, url, data, batch=None):
+        """Queue notification for delivery
+
+        Args:
+            url (str): Notify17 url to POST to
+            data (dict): form data, with json-serializable values
+            batch (str): if given, notifications with same url and batch are
+                combined (their "calendar_list"s merged) into one POST
+        """
+        self.start()
+        self.to_send.put(
+            {
+                "id": uuid.uuid4().hex,
+                "url": url,
+                "data": data,
+                "batch": batch,
+                "attempts": 0,
+            }
+        )
+
+    def close(self, wait=None):
+        """Wait up to wait seconds for queued notifications to be delivered,
+        then save any undelivered ones for the next run
+        """
+        if wait is None:
+            wait = self.timeout[0] + self.timeout[1]
+        if self.thread is not None:
+            self.to_send.put(None)
+            self.thread.join(wait)
+
+        # anything still being sent or waiting is undelivered (and may be
+        #   delivered twice, if it finishes sending after we exit)
+        with self.lock:
+            undelivered = self.undelivered + self.in_flight
+        while True:
+            try:
+                notification = self.to_send.get_nowait()
+            except queue.Empty:
+                break
+            if notification is not None:
+                undelivered.append(notification)
+
+        # undelivered notifications replace queued ones they were made from
+        #   (with their attempts counted), or drop them after too many
+        replaced_ids = {x for y in undelivered for x in notification_ids(y)}
+        undelivered = [
+            {x: y for (x, y) in notification.items() if x != "ids"}
+            for notification in undelivered
+            if notification["attempts"] < NOTIFY_MAX_ATTEMPTS
+        ]
+        if undelivered or replaced_ids & self.queued_ids:
+            self._save_queue(undelivered, remove_ids=replaced_ids)
+        if undelivered:
+            logger.warning(
+                "%d notification%s not delivered, will retry next run",
+                len(undelivered),
+                "s" if len(undelivered) != 1 else "",
+                extra={"stage": "notify", "warning_type": "notify_undelivered"},
+            )
+        self.session.close()
+
+    def _save_queue(self, notifications, remove_ids=()):
+        """Rewrite queue_filename without notifications in remove_ids, and
+        with notifications added (keeping ones queued by other runs)
+        """
+        with key_lock(self.queue_filename):
+            saved = load_notify_queue(self.queue_filename)
+            saved = [x for x in saved if x.get("id") not in remove_ids]
+            atomic_write(self.queue_filename, json.dumps(saved + notifications))
+
+    def _deliver_all(self):
+        done = False
+        while not done:
+            notifications = [self.to_send.get()]
+            # batch everything else that is already waiting
+            while True:
+                try:
+                    notifications.append(self.to_send.get_nowait())
+                except queue.Empty:
+                    break
+            if None in notifications:
+                done = True
+                notifications = [x for x in notifications if x is not None]
+
+            with self.lock:
+                self.in_flight = batch_notifications(notifications)
+            for notification in list(self.in_flight):
+                self._deliver(notification)
+
+    def _deliver(self, notification):
+        try:
+            r = self.session.post(
+                url=notification["url"],
+                data=notification["data"],
+                timeout=self.timeout,
+            )
+            r.raise_for_status()
+        except requests.RequestException as err:
+            logger.warning(
+                "Notification failed: %s",
+                err,
+                extra={
+                    "stage": "notify",
+                    "warning_type": "notify_failed",
+                    "url": notification["url"],
+                },
+            )
+            with self.lock:
+                self.in_flight.remove(notification)
+                notification["attempts"] += 1
+                self.undelivered.append(notification)
+        else:
+            logger.info("Notification reply: %s", r.text, extra={"stage": "notify"})
+            delivered_ids = set(notification_ids(notification)) & self.queued_ids
+            if delivered_ids:
+                self._save_queue([], remove_ids=delivered_ids)
+            with self.lock:
+                self.in_flight.remove(notification)
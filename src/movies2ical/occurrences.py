@@ -0,0 +1,168 @@
+"""Expansion of showings into every actual occurrence, correct across DST
+
+Show times are local to the venue, so a daily run that crosses a daylight
+saving time transition keeps its local start time but changes its UTC start
+time.  compute_datetimes() therefore splits each run into segments of
+constant UTC offset (each one showing with an rrule_count), using UtcOffsets
+so each day's offset is only computed once per calendar.
+
+expand_occurrences() turns the showings of a calendar into one sorted,
+compact array of occurrences, for checks and outputs that need every
+individual occurrence instead of showings with rrule_counts.
+"""
+import array
+import datetime
+
+import pytz
+
+SECONDS_PER_DAY = 24 * 60 * 60
+
+
+class UtcOffsets:
+    """UTC offset of timezone tz on each local calendar day, computed once
+
+    Offsets are taken at local noon.  Timezones change offset in the early
+    morning, and all show times are afternoon or evening.
+    """
+
+    def __init__(self, tz):
+        self.tz = tz
+        self._offsets = {}
+
+    def __getitem__(self, day):
+        try:
+            return self._offsets[day]
+        except KeyError:
+            offset = self.tz.localize(
+                datetime.datetime.combine(day, datetime.time(12, 0))
+            ).utcoffset()
+            self._offsets[day] = offset
+            return offset
+
+    def segments(self, first_day, last_day):
+        """Split days first_day to last_day (inclusive) into runs of days
+        with the same UTC offset
+
+        Yields:
+            tuple: (segment_first_day, num_days, offset)
+        """
+        segment_start = first_day
+        segment_offset = self[first_day]
+        day = first_day + datetime.timedelta(days=1)
+        while day <= last_day:
+            offset = self[day]
+            if offset != segment_offset:
+                yield (segment_start, (day - segment_start).days, segment_offset)
+                (segment_start, segment_offset) = (day, offset)
+            day += datetime.timedelta(days=1)
+        yield (segment_start, (last_day - segment_start).days + 1, segment_offset)
+
+
+def local_run_showings(first_day, last_day, local_time, duration, offsets):
+    """Showings (UTC datetime_start, datetime_end, rrule_count) for a daily
+    run at local_time, one for each segment of constant UTC offset
+
+    Args:
+        first_day (datetime.date): local date of first occurrence
+        last_day (datetime.date): local date of last occurrence
+        local_time (datetime.time): local start time every day
+        duration (datetime.timedelta): length of each occurrence
+        offsets (UtcOffsets): for venue timezone
+
+    Returns:
+        list: showing dicts
+    """
+    showings = []
+    for (segment_day, num_days, offset) in offsets.segments(first_day, last_day):
+        datetime_start = (
+            datetime.datetime.combine(segment_day, local_time) - offset
+        ).replace(tzinfo=pytz.utc)
+        showings.append(
+            {
+                "datetime_start": datetime_start,
+                "datetime_end": datetime_start + duration,
+                "rrule_count": num_days,
+            }
+        )
+    return showings
+
+
+class Occurrences:
+    """Every occurrence of every showing of a calendar, sorted by start
+
+    Attributes:
+        starts (array): UTC start of each occurrence, in epoch seconds
+        ends (array): UTC end of each occurrence, in epoch seconds
+        showing_ids (array): showing of each occurrence, index into showings
+        showings (list): (play_date, showing) for each showing id
+    """
+
+    def __init__(self, showings, starts, ends, showing_ids):
+        self.showings = showings
+        self.starts = starts
+        self.ends = ends
+        self.showing_ids = showing_ids
+        self._indices_by_showing = None
+
+    def __len__(self):
+        return len(self.starts)
+
+    def set_duration(self, showing_id, duration):
+        """Change length (seconds) of every occurrence of a showing, and
+        update the showing's datetime_end to match
+        """
+        for i in self.indices_by_showing()[showing_id]:
+            self.ends[i] = self.starts[i] + duration
+        showing = self.showings[showing_id][1]
+        showing["datetime_end"] = showing["datetime_start"] + datetime.timedelta(
+            seconds=duration
+        )
+
+    def indices_by_showing(self):
+        """Returns (list): for each showing id, list of its occurrence indices
+        """
+        if self._indices_by_showing is None:
+            self._indices_by_showing = [[] for _ in self.showings]
+            for (i, showing_id) in enumerate(self.showing_ids):
+                self._indices_by_showing[showing_id].append(i)
+        return self._indices_by_showing
+
+    def showing_starts(self, showing_id):
+        """Returns (list): UTC datetimes of every occurrence of showing
+        """
+        return [
+            datetime.datetime.fromtimestamp(self.starts[i], pytz.utc)
+            for i in self.indices_by_showing()[showing_id]
+        ]
+
+
+def expand_occurrences(play_dates):
+    """Expand showings of play_dates into every occurrence
+
+    Each showing (from compute_datetimes()) has a constant UTC offset, so
+    its occurrences are exactly one day apart in UTC.
+
+    Returns:
+        Occurrences: sorted by start, then end
+    """
+    showings = []
+    expanded = []
+    for play_date in play_dates:
+        for showing in play_date["showings"]:
+            showing_id = len(showings)
+            showings.append((play_date, showing))
+            start = int(showing["datetime_start"].timestamp())
+            duration = int(
+                (showing["datetime_end"] - showing["datetime_start"]).total_seconds()
+            )
+            for day in range(showing["rrule_count"]):
+                day_start = start + day * SECONDS_PER_DAY
+                expanded.append((day_start, day_start + duration, showing_id))
+    expanded.sort()
+
+    return Occurrences(
+        showings,
+        array.array("q", [x[0] for x in expanded]),
+        array.array("q", [x[1] for x in expanded]),
+        array.array("l", [x[2] for x in expanded]),
+    )
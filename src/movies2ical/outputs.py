@@ -1,8 +1,16 @@
+import contextlib
+import json
+import logging
 import re
 
 from icalendar import Calendar, Event
 
-from .constants import MAX_PLOT_LEN, MONTHS
+from .cache_io import atomic_write
+from .constants import MAX_PLOT_LEN, MONTHS, THEATER_LOCATION
+from .fragment_cache import vevent_key
+from .imdb import require_imdb_info
+
+logger = logging.getLogger(__name__)
 
 
 def persons_list_print(person_list):
@@ -27,6 +35,9 @@ def persons_list_print(person_list):
 def movie_synopsis(play_date):
     out_str = ""
 
+    # plot is only fetched when a description needs it
+    require_imdb_info([play_date], ["plot"])
+
     plot = re.sub(r"::.*$", "", play_date["imdb_info"]["plot"][-1])
     # cut off plot descriptions that are too long
     if len(plot) > MAX_PLOT_LEN:
@@ -70,43 +81,151 @@ def report_playdates(play_dates):
         print(movie_synopsis(play_date))
 
 
-def gen_ical(play_dates, ical_filename="test.ics"):
+def make_vevent(play_date, showing, location):
+    """Returns (icalendar.Event): event for one showing of play_date
+    """
+    datetime_start = showing["datetime_start"]
+    datetime_end = showing["datetime_end"]
+    rrule_count = showing["rrule_count"]
+
+    # unique uid for each event
+    uid = datetime_start.strftime("%Y%m%dT%H%M%S%Z")
+    uid += "@itsayellow.com"
+
+    # assemble event
+    event = Event()
+    event.add("dtstart", datetime_start)
+    event.add("dtend", datetime_end)
+    event.add("dtstamp", datetime_start)
+    event.add("uid", uid)
+    if rrule_count > 1:
+        event.add("rrule", {"FREQ": "DAILY", "COUNT": rrule_count})
+    event.add("summary", play_date["name"])
+    event.add("url", play_date["imdb_url"])
+    event.add("description", movie_synopsis(play_date))
+    event.add("location", location)
+    return event
+
+
+def gen_ical(
+    play_dates, ical_filename="test.ics", location=THEATER_LOCATION, fragment_cache=None
+):
+    """Write ical file with an event for every showing in play_dates
+
+    play_dates can be any iterable (e.g. from iter_datetimes()), and is only
+    looped over once.  location is the venue address put in every event.
+
+    With fragment_cache (an open FragmentCache), events serialized on
+    previous runs are reused as-is, and only new or changed ones are built
+    and serialized.
+
+    Returns:
+        tuple: (num_reused, num_serialized) events
+    """
     cal = Calendar()
     cal.add("prodid", "-//Stanford Theatre Calendar//itsayellow@gmail.com//")
     cal.add("version", "3.0")
-    location = "221 University Ave, Palo Alto, CA (Stanford Theatre)"
-
-    for play_date in play_dates:
-        for showing in play_date["showings"]:
-            datetime_start = showing["datetime_start"]
-            datetime_end = showing["datetime_end"]
-            rrule_count = showing["rrule_count"]
-
-            # unique uid for each event
-            uid = datetime_start.strftime("%Y%m%dT%H%M%S%Z")
-            uid += "@itsayellow.com"
-
-            # assemble event and add to calendar
-            event = Event()
-            event.add("dtstart", datetime_start)
-            event.add("dtend", datetime_end)
-            event.add("dtstamp", datetime_start)
-            event.add("uid", uid)
-            if rrule_count > 1:
-                event.add("rrule", {"FREQ": "DAILY", "COUNT": rrule_count})
-            event.add("summary", play_date["name"])
-            event.add("url", play_date["imdb_url"])
-            event.add("description", movie_synopsis(play_date))
-            event.add("location", location)
-            cal.add_component(event)
-
-    # icalendar writes out bytes, so use 'wb'
+    # serialized calendar is its properties, then its events, then end line
+    cal_end = b"END:VCALENDAR\r\n"
+    cal_head = cal.to_ical()[: -len(cal_end)]
+
+    showings = [
+        (play_date, showing)
+        for play_date in play_dates
+        for showing in play_date["showings"]
+    ]
+    # event descriptions need plots, and cached events are keyed by them
+    require_imdb_info(list({id(x): x for (x, _) in showings}.values()), ["plot"])
+    if fragment_cache is not None:
+        keys = [vevent_key(pd, showing, location) for (pd, showing) in showings]
+        fragments = fragment_cache.get_many(keys)
+    else:
+        keys = [None] * len(showings)
+        fragments = {}
+
+    vevents = []
+    num_serialized = 0
+    for ((play_date, showing), key) in zip(showings, keys):
+        vevent = fragments.get(key)
+        if vevent is None:
+            vevent = make_vevent(play_date, showing, location).to_ical()
+            num_serialized += 1
+            if fragment_cache is not None:
+                fragments[key] = vevent
+                fragment_cache.put(key, vevent)
+        vevents.append(vevent)
+    num_reused = len(vevents) - num_serialized
+
+    if fragment_cache is not None:
+        logger.debug(
+            "%s: reused %d of %d cached events",
+            ical_filename,
+            num_reused,
+            len(vevents),
+            extra={"stage": "write"},
+        )
+
+    # icalendar writes out bytes
     try:
-        with open(ical_filename, "wb") as ical_fh:
-            ical_fh.write(cal.to_ical())
+        atomic_write(ical_filename, b"".join([cal_head] + vevents + [cal_end]))
     except (IsADirectoryError, PermissionError) as err:
-        print("Can't write: " + str(ical_filename))
-        print(type(err))
-        print(err)
+        logger.error("Can't write: %s (%s: %s)", ical_filename, type(err), err)
     else:
-        print("\nWrote: " + str(ical_filename))
+        logger.info("Wrote: %s", ical_filename, extra={"stage": "write"})
+
+    return (num_reused, num_serialized)
+
+
+def showing_records(play_dates, calendar=None, venue=None, occurrences=None):
+    """Yield one flat, json-serializable dict per showing in play_dates
+
+    With occurrences (from expand_occurrences(play_dates)), each record also
+    lists the start of every occurrence of its showing.
+    """
+    if occurrences is None:
+        showings = (
+            (play_date, showing)
+            for play_date in play_dates
+            for showing in play_date["showings"]
+        )
+    else:
+        showings = occurrences.showings
+    for (showing_id, (play_date, showing)) in enumerate(showings):
+        record = {
+            "venue": venue,
+            "calendar": calendar,
+            "name": play_date["name"],
+            "imdb_url": play_date["imdb_url"],
+            "start": showing["datetime_start"].isoformat(),
+            "end": showing["datetime_end"].isoformat(),
+            "rrule_count": showing["rrule_count"],
+            "imdb_info": play_date["imdb_info"],
+        }
+        if occurrences is not None:
+            record["occurrences"] = [
+                x.isoformat() for x in occurrences.showing_starts(showing_id)
+            ]
+        yield record
+
+
+def gen_ndjson(
+    play_dates, ndjson_fh, calendar=None, venue=None, occurrences=None, lock=None
+):
+    """Write one json record per line for each showing, as it is produced
+
+    Args:
+        play_dates (iterable): play_dates with imdb_info and showings computed
+        ndjson_fh (file): text file handle to write to (e.g. sys.stdout)
+        calendar (str): name of calendar play_dates came from
+        venue (str): name of venue (source) calendar came from
+        occurrences (Occurrences): if given, list every occurrence in records
+        lock (threading.Lock): if given, held while writing each record, for
+            ndjson_fh shared by threads
+    """
+    for record in showing_records(
+        play_dates, calendar=calendar, venue=venue, occurrences=occurrences
+    ):
+        line = json.dumps(record) + "\n"
+        with lock if lock is not None else contextlib.nullcontext():
+            ndjson_fh.write(line)
+            ndjson_fh.flush()
@@ -1,16 +1,68 @@
 import datetime
+import html
+import logging
 from pathlib import Path
 import re
-import sys
 
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, NavigableString, Tag
 import bleach
-import pytz
 
-from .constants import MONTHS, THEATER_TZ
+from .constants import IMDB_TITLE_URL, MONTHS, THEATER_TZ
+from .occurrences import UtcOffsets, local_run_showings
+from .title_index import get_title_index
+
+logger = logging.getLogger(__name__)
+
+# month names and abbreviations to month number
+MONTH_NUMBERS = {name: i % 12 + 1 for (i, name) in enumerate(MONTHS)}
+MONTH_NUMBERS["Sept"] = 9
+
+# tokens of human-readable date strings
+DATE_TOKEN_RE = re.compile(
+    r"(?P<word>[A-Za-z]+)|(?P<num>\d+)|(?P<dash>[-\u2013\u2014])|(?P<space>\s+)"
+    r"|(?P<other>.)",
+    re.S,
+)
+DATE_TOKEN_CODES = {"month": "M", "word": "W", "num": "N", "dash": "-", "other": ","}
+
+# date grammar rules, in order of precedence, on token codes:
+#   (rule_re, month_start, date_start, month_end, date_end)
+#   where month_*, date_* are token index of value in match (from start of
+#   match if >= 0, from end of match if < 0)
+DATE_RULES = [
+    # July 18-19
+    (re.compile(r"MN-N"), 0, 1, 0, -1),
+    # August 31-September 1, Friday July 1 - Friday July 8
+    (re.compile(r"MN-W?MN"), 0, 1, -2, -1),
+    # December 24
+    (re.compile(r"MN(?!-)"), 0, 1, 0, -1),
+]
+
+# "ticket sale" and all text after it
+TICKET_SALE_RE = re.compile(r"ticket.+sale.+$")
+# strings in parentheses, or runs of digits and colons (possible times)
+MOVIE_TIME_TOKEN_RE = re.compile(r"\((?P<paren>[^)]*)\)|[0-9:]+")
+TIME_RE = re.compile(r"\d:\d\d")
+TIME_EXTRA_RE = re.compile(r"(\d+:\d\d)")
+SAT_RE = re.compile(r"sat", re.I)
+SUN_RE = re.compile(r"sun", re.I)
+IMDB_LINK_RE = re.compile(r"https?://[^/]*imdb\.")
+# text that is only a movie name and year, e.g. "Ninotchka (1939)", i.e. a
+#   movie listed without an imdb link.  Other text can look like that too
+#   (e.g. "Restored Print (1999)"), so these are only candidates, taken as
+#   movies once an IMDb movie with that exact title and year is found
+UNLINKED_MOVIE_RE = re.compile(
+    r"^\s*[A-Z0-9\"'][^()\n]{0,79}\(\s*(19|20)\d\d\s*\)\s*$"
+)
 
 
 def parse_html_calendar(html_file, verbose=False):
+    return list(iter_html_calendar(html_file, verbose=verbose))
+
+
+def iter_html_calendar(html_file, verbose=False):
+    """Yield each play_date in html_file as soon as its <td> is parsed
+    """
     # start by assuming calendar is in current year
     calendar_year = datetime.date.today().year
 
@@ -19,7 +71,7 @@ def parse_html_calendar(html_file, verbose=False):
     cal_year_re = re.search(r"_(20\d\d)(\d{4})?($|\.)", str(Path(html_file).stem))
     if cal_year_re:
         calendar_year = int(cal_year_re.group(1))
-    print("Calendar Year: %d" % calendar_year)
+    logger.debug("Calendar Year: %d", calendar_year, extra={"stage": "parse"})
 
     with open(html_file, "rb") as html_fh:
         html_bin = html_fh.read()
@@ -38,29 +90,34 @@ def parse_html_calendar(html_file, verbose=False):
     #   a little slower but worth it
     soup = BeautifulSoup(html_bin, "html5lib")
 
-    tables = soup.find_all("table")
-
-    assert len(tables) == 1
+    # calendar is normally one table, but parse every outermost table in
+    #   case it is ever split, so no table within is parsed twice
+    tables = [x for x in soup.find_all("table") if x.find_parent("table") is None]
+    if not tables:
+        logger.warning(
+            "No calendar table found in %s",
+            Path(html_file).name,
+            extra={"stage": "parse", "warning_type": "no_calendar_table"},
+        )
 
     # search only for td, because sometimes bad html has no <tr> start tag!
     #   (but html5lib should clean this up and add a <tr>)
-    play_dates = []
-    for td in tables[0].find_all("td"):
-        td_play_dates = parse_td(td, calendar_year, verbose=verbose)
+    for table in tables:
+        for td in table.find_all("td"):
+            td_play_dates = parse_td(td, calendar_year, verbose=verbose)
 
-        if td_play_dates is not None:
-            play_dates.extend(td_play_dates)
-
-    return play_dates
+            if td_play_dates is not None:
+                yield from td_play_dates
 
 
 def parse_td(td, calendar_year, verbose=False):
     # init
     movies = []
 
-    # extract all links to imdb movies and text they contain
-    movie_list = extract_movies_imdb(td)
-    # if this td has no imdb link contained in it, presume not a movie playdate
+    # extract all links to imdb movies (and movies without links) and text
+    #   they contain
+    movie_list = extract_movies(td)
+    # if this td has no movie contained in it, presume not a movie playdate
     #   and return immediately
     if not movie_list:
         return None
@@ -84,7 +141,16 @@ def parse_td(td, calendar_year, verbose=False):
     for (i, movie) in enumerate(movie_list):
         # remove all tags to get text
         movie_name = bleach.clean(movie[2].strip(), tags=[], strip=True)
-        imdb_link = movie[1].strip()
+        if movie[1] is not None:
+            imdb_link = movie[1].strip()
+        else:
+            # find movie in imdb cache, else leave it to be searched for
+            #   (see imdb.resolve_unlinked())
+            imdb_movie_num = get_title_index().lookup(movie_name)
+            if imdb_movie_num is not None:
+                imdb_link = IMDB_TITLE_URL % imdb_movie_num
+            else:
+                imdb_link = None
         time_str = bleach.clean(td_splits[i + 1].strip(), tags=[], strip=True)
 
         # if (movieyear) string is after link and ends up in time_str,
@@ -121,13 +187,28 @@ def parse_td(td, calendar_year, verbose=False):
         return None
 
 
-def extract_movies_imdb(td):
+def extract_movies(td):
+    """Find movies in td, in order: imdb links, and text that is only a movie
+    name and year (with no link)
+
+    Returns:
+        list: [html string of movie, imdb link or None, movie text] for each
+    """
     movies = []
 
-    for link in td.find_all("a"):
-        if re.search(r"https?://[^/]*imdb\.", link["href"]):
-            movie_text = "".join([str(x) for x in link.contents])
-            movies.append([str(link), link["href"], movie_text])
+    for element in td.descendants:
+        if isinstance(element, Tag):
+            if element.name == "a" and IMDB_LINK_RE.search(element["href"]):
+                movie_text = "".join([str(x) for x in element.contents])
+                movies.append([str(element), element["href"], movie_text])
+        elif (
+            type(element) is NavigableString
+            and UNLINKED_MOVIE_RE.search(element)
+            and element.find_parent("a") is None
+        ):
+            movie_text = element.strip()
+            # as it appears in html of td
+            movies.append([html.escape(movie_text, quote=False), None, movie_text])
 
     return movies
 
@@ -140,8 +221,11 @@ def extract_playdate(td, calendar_year):
     if p_date and re.search(r"\S", "".join(p_date.contents)):
         (td_startdate, td_enddate) = parse_datestr(p_date.contents[0], calendar_year)
     else:
-        print("Warning: could not find date in:", file=sys.stderr)
-        print(str(td)[:78], file=sys.stderr)
+        logger.warning(
+            "Warning: could not find date in:\n%s",
+            str(td)[:78],
+            extra={"stage": "parse", "warning_type": "no_date"},
+        )
         (td_startdate, td_enddate) = (None, None)
 
     return (td_startdate, td_enddate)
@@ -158,82 +242,82 @@ def parse_datestr(content_str, calendar_year):
         tuple: (td_startdate, td_enddate)
             where td_*date is tuple: (year_int, month_int, date_int)
     """
-    td_startdate = None
-    td_enddate = None
-    month_start_num = None
-
     # movie dates (possibly)
     # Searching for one of:
     #   July 18-19
     #   August 31-September 1
     #   December 24
     #   August 31-Sept 3
+    #   November 30 &ndash; December 2
+    #   Friday July 1 - Friday July 8
     # somebody occasionally uses month abbreviations, need to parse
-    #   in month_regexp
+    #   in MONTH_NUMBERS
     #   Oct 3-4
-    month_regexp = "(" + "|".join(MONTHS) + ")"
-    onemonth_multdate_re = re.search(
-        month_regexp + r"\s+(\d+)\s*-\s*(\d+)($|\D)", content_str
-    )
-    multmonth_multdate_re = re.search(
-        month_regexp + r"\s+(\d+)\s*-\s*" + month_regexp + r"\s*(\d+)($|\D)",
-        content_str,
-    )
-    # note: will also match last date in multmonth_multdate_re
-    onemonth_onedate_re = re.search(month_regexp + r"\s+(\d+)\s*($|[^-])", content_str)
-    if onemonth_multdate_re:
-        month_start_num = MONTHS.index(onemonth_multdate_re.group(1)) % 12 + 1
-        date_start_num = int(onemonth_multdate_re.group(2))
-        month_end_num = month_start_num
-        date_end_num = int(onemonth_multdate_re.group(3))
-    elif multmonth_multdate_re:
-        month_start_num = MONTHS.index(multmonth_multdate_re.group(1)) % 12 + 1
-        date_start_num = int(multmonth_multdate_re.group(2))
-        month_end_num = MONTHS.index(multmonth_multdate_re.group(3)) % 12 + 1
-        date_end_num = int(multmonth_multdate_re.group(4))
-    elif onemonth_onedate_re:
-        month_start_num = MONTHS.index(onemonth_onedate_re.group(1)) % 12 + 1
-        date_start_num = int(onemonth_onedate_re.group(2))
-        month_end_num = month_start_num
-        date_end_num = date_start_num
-
-    if month_start_num is not None:
-        td_startdate = (calendar_year, month_start_num, date_start_num)
-        td_enddate = (calendar_year, month_end_num, date_end_num)
 
-    return (td_startdate, td_enddate)
+    # tokenize content_str in one pass, into a string of one-character
+    #   token codes (see DATE_TOKEN_CODES) and a parallel list of values
+    codes = []
+    values = []
+    for token in DATE_TOKEN_RE.finditer(content_str):
+        kind = token.lastgroup
+        if kind == "space":
+            continue
+        value = token.group()
+        if kind == "word" and value in MONTH_NUMBERS:
+            kind = "month"
+            value = MONTH_NUMBERS[value]
+        elif kind == "num":
+            value = int(value)
+        codes.append(DATE_TOKEN_CODES[kind])
+        values.append(value)
+    codes = "".join(codes)
+
+    # first date grammar rule that matches anywhere in codes wins
+    for (rule_re, month_start_i, date_start_i, month_end_i, date_end_i) in DATE_RULES:
+        rule_match = rule_re.search(codes)
+        if rule_match:
+
+            def value(i):
+                return values[rule_match.start() + i if i >= 0 else rule_match.end() + i]
+
+            td_startdate = (calendar_year, value(month_start_i), value(date_start_i))
+            td_enddate = (calendar_year, value(month_end_i), value(date_end_i))
+            return (td_startdate, td_enddate)
+
+    return (None, None)
 
 
 def process_movie_time_str(movie_time):
     # Eliminate text after "ticket sale"
     #   Usually is entry saying what time tickets go on sale, not movie time.
-    movie_time = re.sub(r"ticket.+sale.+$", "", movie_time, re.I)
-    # Check every string in parentheses.
-    #   Can be extra time typically for sat and/or sun
+    movie_time = TICKET_SALE_RE.sub("", movie_time)
+
+    # One pass over string finds every time, and every string in parentheses.
+    #   String in parentheses can be extra time typically for sat and/or sun
     #   Can be random jibberish
+    movie_times = []
     time_extra = None
-    paren_re = re.search(r"\(([^)]*)\)", movie_time)
-    while paren_re:
-        paren_full = paren_re.group(1)
-        time_extra_re = re.search(r"(\d+:\d\d)", paren_full)
+    for token in MOVIE_TIME_TOKEN_RE.finditer(movie_time):
+        paren_full = token.group("paren")
+        if paren_full is None:
+            # remove all non-time entries
+            if TIME_RE.search(token.group()):
+                movie_times.append(token.group())
+            continue
+
+        time_extra_re = TIME_EXTRA_RE.search(paren_full)
         if time_extra_re:
             time_extra = time_extra_re.group(1)
-            if re.search(r"sat", paren_full, re.I):
+            if SAT_RE.search(paren_full):
                 time_extra += " sat"
-            if re.search(r"sun", paren_full, re.I):
+            if SUN_RE.search(paren_full):
                 time_extra += " sun"
         else:
-            print("Warning: extra movie time " + paren_full + " is unparseable.")
-        # remove extra string in parens
-        movie_time = re.sub(re.escape(paren_re.group(0)), "", movie_time).strip()
-        paren_re = re.search(r"\(([^)]*)\)", movie_time)
-
-    # change all non-digit, non-: to single space character
-    movie_time = re.sub(r"[^0-9:]+", " ", movie_time).strip()
-    # convert times to list
-    movie_times = movie_time.split(" ")
-    # remove all non-time entries
-    movie_times = [x for x in movie_times if re.search(r"\d:\d\d", x)]
+            logger.warning(
+                "Warning: extra movie time %s is unparseable.",
+                paren_full,
+                extra={"stage": "parse", "warning_type": "unparseable_time"},
+            )
 
     if time_extra:
         movie_times.append(time_extra)
@@ -241,75 +325,88 @@ def process_movie_time_str(movie_time):
     return movie_times
 
 
-def compute_datetimes(play_dates):
+def compute_datetimes(play_dates, tz=THEATER_TZ):
+    for _ in iter_datetimes(play_dates, tz=tz):
+        pass
+
+
+def iter_datetimes(play_dates, tz=THEATER_TZ):
+    """Compute showings for each play_date, yielding it as soon as done
+
+    Args:
+        play_dates (iterable): play_dates with imdb_info
+        tz (pytz.timezone): timezone of venue the show times are local to
+    """
+    # shared by all play_dates, so each day's UTC offset is computed once
+    offsets = UtcOffsets(tz)
     for play_date in play_dates:
-        # TODO: check for other runtimes instead of just using first one
-        runtime = int(play_date["imdb_info"]["runtimes"][0])
-        play_date_start = datetime.date(*play_date["show_startdate"])
-        play_date_end = datetime.date(*play_date["show_enddate"])
-
-        play_date["showings"] = []
-
-        for show_time in play_date["show_times"]:
-            if " " not in show_time:
-                # normal showtime every day in range
-                this_time = show_time
-                this_play_date_start = play_date_start
-                this_play_date_end = play_date_end
-            else:
-                # showtimes only on saturday and/or sunday
-
-                # get weekday (e.g. Monday, Tuesday, etc.) number of
-                #   play_date_start.  Monday=0, Tuesday=1, etc.
-                weekday_start = play_date_start.weekday()
-
-                # figure out play_date start and end based on sat and/or sun
-                this_play_date_start = None
-                this_play_date_end = None
-                if "sat" in show_time:
-                    # set this_play_date_start to saturday (weekday=5) after
-                    #   play_date_start
-                    this_play_date_start = play_date_start + datetime.timedelta(
-                        days=5 - weekday_start
-                    )
-                if "sun" in show_time:
-                    # set this_play_date_end to sunday (weekday=6) after
-                    #   play_date_start
-                    this_play_date_end = play_date_start + datetime.timedelta(
-                        days=6 - weekday_start
-                    )
-                if not this_play_date_start:
-                    this_play_date_start = this_play_date_end
-                if not this_play_date_end:
-                    this_play_date_end = this_play_date_start
-
-                this_time = show_time.split(" ")[0]
-
-            # process times, dates
-            (hour, minute) = this_time.split(":")
-            # assume all times are PM, so add 12 to time
-            hour = int(hour) + 12
-            minute = int(minute)
-
-            # DON'T USE tzinfo!  USE pytz.timezone.localize()
-            #   for some reason using tzinfo with datetime.combine
-            #   gives a strange timezone (-07:53)
-            datetime_start = datetime.datetime.combine(
-                this_play_date_start, datetime.time(hour, minute, 0)
-            )
-            # put extracted time in THEATER timezone
-            datetime_start = THEATER_TZ.localize(datetime_start)
-            # Convert to UTC timezone
-            datetime_start = datetime_start.astimezone(pytz.utc)
+        compute_play_date_datetimes(play_date, tz=tz, offsets=offsets)
+        yield play_date
 
-            datetime_end = datetime_start + datetime.timedelta(minutes=runtime)
-            # rrule_count is how many days including this one
-            rrule_count = (this_play_date_end - this_play_date_start).days + 1
 
-            play_date["showings"].append(
-                {
-                    "datetime_start": datetime_start,
-                    "datetime_end": datetime_end,
-                    "rrule_count": rrule_count,
-                }
+def compute_play_date_datetimes(play_date, tz=THEATER_TZ, offsets=None):
+    """Set play_date["showings"] from its dates and show times
+
+    Each show time becomes one showing per run of days with the same UTC
+    offset (i.e. two showings if the run crosses a DST transition), so that
+    every occurrence of a showing is at the same local time.
+    """
+    if offsets is None:
+        offsets = UtcOffsets(tz)
+    # TODO: check for other runtimes instead of just using first one
+    runtime = int(play_date["imdb_info"]["runtimes"][0])
+    play_date_start = datetime.date(*play_date["show_startdate"])
+    play_date_end = datetime.date(*play_date["show_enddate"])
+
+    play_date["showings"] = []
+
+    for show_time in play_date["show_times"]:
+        if " " not in show_time:
+            # normal showtime every day in range
+            this_time = show_time
+            this_play_date_start = play_date_start
+            this_play_date_end = play_date_end
+        else:
+            # showtimes only on saturday and/or sunday
+
+            # get weekday (e.g. Monday, Tuesday, etc.) number of
+            #   play_date_start.  Monday=0, Tuesday=1, etc.
+            weekday_start = play_date_start.weekday()
+
+            # figure out play_date start and end based on sat and/or sun
+            this_play_date_start = None
+            this_play_date_end = None
+            if "sat" in show_time:
+                # set this_play_date_start to saturday (weekday=5) after
+                #   play_date_start
+                this_play_date_start = play_date_start + datetime.timedelta(
+                    days=5 - weekday_start
+                )
+            if "sun" in show_time:
+                # set this_play_date_end to sunday (weekday=6) after
+                #   play_date_start
+                this_play_date_end = play_date_start + datetime.timedelta(
+                    days=6 - weekday_start
+                )
+            if not this_play_date_start:
+                this_play_date_start = this_play_date_end
+            if not this_play_date_end:
+                this_play_date_end = this_play_date_start
+
+            this_time = show_time.split(" ")[0]
+
+        # process times, dates
+        (hour, minute) = this_time.split(":")
+        # assume all times are PM, so add 12 to time
+        hour = int(hour) + 12
+        minute = int(minute)
+
+        play_date["showings"].extend(
+            local_run_showings(
+                this_play_date_start,
+                this_play_date_end,
+                datetime.time(hour, minute, 0),
+                datetime.timedelta(minutes=runtime),
+                offsets,
             )
+        )
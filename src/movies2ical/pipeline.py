@@ -0,0 +1,559 @@
+"""Overlapping fetch -> parse -> enrich -> write pipeline for calendars
+
+Each stage runs as asyncio tasks connected by bounded queues, with the
+blocking work of each stage done in executors, so that e.g. parsing of the
+first calendar starts while later calendars are still being fetched, and
+imdb fetches for one calendar overlap with parsing of the next.  Calendars
+of all venues (sources) are fetched concurrently, into the same stages,
+sharing one imdb cache.
+
+Each calendar's progress is checkpointed in a RunJournal, so that with
+--resume, calendars an interrupted run already fetched, parsed or wrote
+pick up where they left off.  Fetched calendars whose showings are all
+over are frozen in CalendarLifecycle, and skipped by later runs.
+
+For ndjson output (without --correct-times, which needs every showing of a
+calendar before any can be corrected), the enrich stage writes the records
+of each play_date as soon as it is enriched, and the write stage only
+stores showings in the database.
+
+Each calendar passing through the pipeline is a dict with keys:
+    "journal_key": identifies calendar in run journal
+    "source": VenueSource calendar came from
+    "srcfile": Path of calendar html file
+    "ics_filename": Path of output file (suffix replaced for ndjson)
+    "is_new": True if calendar is new or modified since last run
+    "resumed": True if interrupted run already wrote calendar's output
+    "play_dates": list of play_dates (after parse stage)
+    "occurrences": Occurrences of all showings (after enrich stage)
+    "streamed": True if enrich stage already wrote ndjson records
+    "wrote": True if an output file was written (after write stage)
+    "events_reused", "events_serialized": number of ical events taken from
+        fragment cache, and newly serialized (after write stage, ics only)
+"""
+import asyncio
+import concurrent.futures
+import datetime
+import contextlib
+import logging
+import threading
+from pathlib import Path
+
+from .constants import DEFAULT_IMDB_INFO, ICAL_OUT_DIR
+from .database import store_play_dates
+from .fragment_cache import FragmentCache
+from .imdb import get_imdb_info, iter_imdb_info, resolve_unlinked
+from .journal import RunJournal, run_signature
+from .lifecycle import CalendarLifecycle
+from .log import init_worker_logging, stage_context, start_worker_logging
+from .occurrences import expand_occurrences
+from .outputs import gen_ical, gen_ndjson
+from .parse_schedule import compute_datetimes, iter_datetimes
+from .schedule_acquire import (
+    cachefile_date,
+    find_calendar_files,
+    report_fetch_summary,
+)
+from .verify import check_for_problems
+
+logger = logging.getLogger(__name__)
+
+# max number of calendars waiting between any two stages
+STAGE_QUEUE_SIZE = 4
+
+# marks end of calendars in a stage queue
+_DONE = None
+
+
+def new_calendar(
+    journal_key, source, srcfile, relpath, is_new, out_dir=ICAL_OUT_DIR
+):
+    return {
+        "journal_key": journal_key,
+        "source": source,
+        "srcfile": srcfile,
+        # mirror any directory structure srcfiles were found in
+        "ics_filename": out_dir / relpath.with_suffix(".ics"),
+        "is_new": is_new,
+    }
+
+
+def fetched_calendar(journal, journal_key, source, srcfile, relpath, is_new):
+    """Make calendar dict of a newly fetched (or found) calendar file, and
+    checkpoint it
+    """
+    journal.checkpoint(
+        journal_key,
+        "fetched",
+        srcfile=str(srcfile),
+        relpath=str(relpath),
+        is_new=is_new,
+        source=source.name,
+    )
+    return new_calendar(journal_key, source, srcfile, relpath, is_new)
+
+
+def resumed_fetched_calendar(journal, journal_key, source):
+    """Make calendar dict from checkpoint of resumed run, if it fetched
+    calendar and the file is still there, else return None
+    """
+    state = journal.resumed_state(journal_key, "fetched")
+    if state is None or not Path(state["srcfile"]).is_file():
+        return None
+    return new_calendar(
+        journal_key,
+        source,
+        Path(state["srcfile"]),
+        Path(state["relpath"]),
+        state["is_new"],
+    )
+
+
+def resume_calendar(calendar, journal, resume_written=True):
+    """Fill in play_dates (and if resume_written, output status) of calendar
+    from checkpoints of resumed run, if it got that far
+    """
+    state = journal.resumed_state(calendar["journal_key"], "parsed")
+    if state is None:
+        return
+    calendar["play_dates"] = state["play_dates"]
+    if resume_written and state["stage"] == "written":
+        calendar["resumed"] = True
+        calendar["wrote"] = state["wrote"]
+
+
+def parse_calendar(source, srcfile, verbose=False):
+    """Parse calendar html file with source's parser, return its play_dates
+    """
+    with stage_context(srcfile.name, "parse"):
+        return source.parse_calendar(srcfile, verbose=verbose)
+
+
+def enrich_calendar(calendar, args):
+    """Add imdb info and datetimes to calendar's play_dates, and check them
+    """
+    with stage_context(calendar["srcfile"].name, "enrich"):
+        _enrich_calendar(calendar, args)
+
+
+def _enrich_calendar(calendar, args):
+    add_imdb_info(calendar, info=args.imdb_info)
+    add_datetimes(calendar, args)
+
+
+def add_imdb_info(calendar, info=DEFAULT_IMDB_INFO):
+    """Add imdb info to calendar's play_dates, fetching info sets in info
+    """
+    # find movies listed without imdb links that aren't in imdb cache
+    calendar["play_dates"] = resolve_unlinked(calendar["play_dates"])
+    calendar["play_dates"] = get_imdb_info(calendar["play_dates"], info=info)
+
+
+def add_datetimes(calendar, args):
+    """Compute showings of calendar's play_dates (with imdb info), and check
+    them
+    """
+    play_dates = calendar["play_dates"]
+    tz = calendar["source"].tz
+
+    # compute datetime data, and every occurrence of every showing
+    compute_datetimes(play_dates, tz=tz)
+    calendar["occurrences"] = expand_occurrences(play_dates)
+
+    # check for schedule overlap, inconsistent data
+    check_for_problems(
+        play_dates,
+        correct_endtimes=args.correct_times,
+        tz=tz,
+        occurrences=calendar["occurrences"],
+    )
+
+    # (debug) text report of play_dates
+    # report_playdates(play_dates)
+
+
+def streams_ndjson(args):
+    """True if records of args' run are written by enrich stage, as each
+    play_date is enriched
+    """
+    return args.format == "ndjson" and not args.correct_times
+
+
+def stream_ndjson_calendar(calendar, args, ndjson_fh=None, ndjson_lock=None):
+    """Add imdb info and datetimes to calendar's play_dates one at a time,
+    writing ndjson records of each as soon as it is done, then check them
+
+    Args:
+        calendar (dict): calendar from parse stage
+        args (Namespace): command-line arguments
+        ndjson_fh (file): if given, write ndjson records here instead of
+            to a file based on ics_filename; records of calendars streamed
+            at the same time are interleaved (each names its calendar)
+        ndjson_lock (threading.Lock): held while writing to ndjson_fh
+    """
+    with stage_context(calendar["srcfile"].name, "enrich"):
+        _stream_ndjson_calendar(calendar, args, ndjson_fh, ndjson_lock)
+
+
+def _stream_ndjson_calendar(calendar, args, ndjson_fh, ndjson_lock):
+    source = calendar["source"]
+    ndjson_filename = None
+    if ndjson_fh is None:
+        ndjson_filename = calendar["ics_filename"].with_suffix(".ndjson")
+
+    calendar["play_dates"] = resolve_unlinked(calendar["play_dates"])
+    play_dates = []
+    with contextlib.ExitStack() as stack:
+        for play_date in iter_datetimes(
+            iter_imdb_info(calendar["play_dates"], info=args.imdb_info),
+            tz=source.tz,
+        ):
+            # like write stage, only write a file if there are any play_dates
+            if ndjson_fh is None:
+                ndjson_filename.parent.mkdir(exist_ok=True, parents=True)
+                ndjson_fh = stack.enter_context(open(ndjson_filename, "w"))
+            gen_ndjson(
+                [play_date],
+                ndjson_fh,
+                calendar=calendar["srcfile"].name,
+                venue=source.name,
+                occurrences=expand_occurrences([play_date]),
+                lock=ndjson_lock,
+            )
+            play_dates.append(play_date)
+
+    calendar["play_dates"] = play_dates
+    calendar["streamed"] = True
+    calendar["wrote"] = ndjson_filename is not None and bool(play_dates)
+    if calendar["wrote"]:
+        logger.info("Wrote: %s", ndjson_filename, extra={"stage": "enrich"})
+
+    calendar["occurrences"] = expand_occurrences(play_dates)
+    check_for_problems(
+        play_dates, tz=source.tz, occurrences=calendar["occurrences"]
+    )
+
+
+def write_calendar(calendar, args, ndjson_fh=None):
+    """Write calendar's output file, and store its showings if requested
+
+    Args:
+        calendar (dict): calendar from enrich stage
+        args (Namespace): command-line arguments
+        ndjson_fh (file): if given, write ndjson records here instead of
+            to a file based on ics_filename
+    """
+    with stage_context(calendar["srcfile"].name, "write"):
+        _write_calendar(calendar, args, ndjson_fh)
+        logger.info(
+            "Finished at %s",
+            datetime.datetime.today().strftime("%I:%M%p %B %d, %Y"),
+            extra={"stage": "write"},
+        )
+
+
+def _write_calendar(calendar, args, ndjson_fh):
+    source = calendar["source"]
+    srcfile = calendar["srcfile"]
+    play_dates = calendar["play_dates"]
+
+    # enrich stage already wrote records of a streamed calendar
+    if not calendar.get("streamed"):
+        _write_output(calendar, args, ndjson_fh)
+
+    # record showings in database
+    if args.db is not None and play_dates:
+        store_play_dates(
+            args.db, play_dates, source.name, source.tz, calendar=srcfile.name
+        )
+
+
+def _write_output(calendar, args, ndjson_fh):
+    source = calendar["source"]
+    srcfile = calendar["srcfile"]
+    ics_filename = calendar["ics_filename"]
+    play_dates = calendar["play_dates"]
+    ndjson_kwargs = {
+        "calendar": srcfile.name,
+        "venue": source.name,
+        "occurrences": calendar["occurrences"],
+    }
+
+    # write output if we have any valid playdates
+    calendar["wrote"] = False
+    if play_dates and args.format == "ndjson" and ndjson_fh is not None:
+        gen_ndjson(play_dates, ndjson_fh, **ndjson_kwargs)
+    elif play_dates and args.format == "ndjson":
+        ndjson_filename = ics_filename.with_suffix(".ndjson")
+        ndjson_filename.parent.mkdir(exist_ok=True, parents=True)
+        with open(ndjson_filename, "w") as ndjson_fh:
+            gen_ndjson(play_dates, ndjson_fh, **ndjson_kwargs)
+        logger.info("Wrote: %s", ndjson_filename, extra={"stage": "write"})
+        calendar["wrote"] = True
+    elif play_dates:
+        ics_filename.parent.mkdir(exist_ok=True, parents=True)
+        with FragmentCache() as fragment_cache:
+            (calendar["events_reused"], calendar["events_serialized"]) = gen_ical(
+                play_dates,
+                ical_filename=ics_filename,
+                location=source.location,
+                fragment_cache=fragment_cache,
+            )
+        calendar["wrote"] = True
+
+
+async def _produce_files(out_queue, args, source, journal):
+    loop = asyncio.get_event_loop()
+    calendar_files = await loop.run_in_executor(
+        None, find_calendar_files, args.srcfile
+    )
+    for (srcfile, relpath) in calendar_files:
+        journal_key = str(srcfile)
+        calendar = resumed_fetched_calendar(journal, journal_key, source)
+        if calendar is None:
+            calendar = fetched_calendar(
+                journal, journal_key, source, srcfile, relpath, False
+            )
+        await out_queue.put(calendar)
+
+
+async def _produce_web(out_queue, source, out_subdir, journal, lifecycle, args):
+    loop = asyncio.get_event_loop()
+    cal_links = await loop.run_in_executor(None, source.fetch_calendar_links)
+    new_or_modified = 0
+    num_frozen = 0
+    for cal_link in cal_links:
+        journal_key = "%s/%s" % (source.name, cal_link)
+        # calendars that have ended aren't checked for changes or reprocessed
+        if lifecycle.is_frozen(journal_key) and not args.include_frozen:
+            num_frozen += 1
+            continue
+        # interrupted run already fetched it, and knows if it was new
+        calendar = resumed_fetched_calendar(journal, journal_key, source)
+        if calendar is None:
+            (cache_filename, is_new) = await loop.run_in_executor(
+                None, source.fetch_calendar, cal_link
+            )
+            if cache_filename:
+                calendar = fetched_calendar(
+                    journal,
+                    journal_key,
+                    source,
+                    cache_filename,
+                    out_subdir / cache_filename.name,
+                    is_new,
+                )
+        if calendar is not None:
+            new_or_modified += calendar["is_new"]
+            await out_queue.put(calendar)
+    report_fetch_summary(len(cal_links), new_or_modified, source.base_url)
+    if num_frozen:
+        logger.info(
+            "%d frozen calendar%s skipped, all showings over (check them with "
+            "--include-frozen)",
+            num_frozen,
+            "s" if num_frozen != 1 else "",
+            extra={"stage": "fetch"},
+        )
+
+
+async def _produce_all_web(out_queue, sources, journal, lifecycle, args):
+    if len(sources) > 1:
+        # keep calendars of each venue in their own output directory
+        await asyncio.gather(
+            *[
+                _produce_web(out_queue, x, Path(x.name), journal, lifecycle, args)
+                for x in sources
+            ]
+        )
+    else:
+        await _produce_web(out_queue, sources[0], Path(), journal, lifecycle, args)
+
+
+async def _stage(in_queue, out_queue, num_workers, work):
+    """Run num_workers copies of coroutine function work(calendar) on every
+    calendar from in_queue, passing each finished calendar to out_queue
+    """
+
+    async def worker():
+        while True:
+            calendar = await in_queue.get()
+            if calendar is _DONE:
+                break
+            await work(calendar)
+            if out_queue is not None:
+                await out_queue.put(calendar)
+
+    await asyncio.gather(*[worker() for _ in range(num_workers)])
+
+
+async def _close_stage(stage_coro, out_queue, num_next_workers):
+    """Await stage_coro, then tell every worker of next stage it is done
+    """
+    await stage_coro
+    for _ in range(num_next_workers):
+        await out_queue.put(_DONE)
+
+
+async def _run_pipeline(args, sources, ndjson_fh, parse_executor, journal, lifecycle):
+    loop = asyncio.get_event_loop()
+    num_workers = max(args.jobs, 1)
+    # all records go to one ndjson output file, which is started over, so
+    #   calendars written by the interrupted run must be written again
+    resume_written = not (args.format == "ndjson" and ndjson_fh is not None)
+
+    parse_queue = asyncio.Queue(maxsize=STAGE_QUEUE_SIZE)
+    enrich_queue = asyncio.Queue(maxsize=STAGE_QUEUE_SIZE)
+    write_queue = asyncio.Queue(maxsize=STAGE_QUEUE_SIZE)
+    calendars = []
+    # held by each enrich stage worker streaming a record to ndjson_fh
+    ndjson_lock = threading.Lock()
+
+    async def parse(calendar):
+        resume_calendar(calendar, journal, resume_written=resume_written)
+        if "play_dates" in calendar:
+            logger.debug(
+                "Resumed",
+                extra={"calendar": calendar["srcfile"].name, "stage": "parse"},
+            )
+        else:
+            logger.info(
+                "Parsing",
+                extra={"calendar": calendar["srcfile"].name, "stage": "parse"},
+            )
+            calendar["play_dates"] = await loop.run_in_executor(
+                parse_executor,
+                parse_calendar,
+                calendar["source"],
+                calendar["srcfile"],
+                args.verbose,
+            )
+            journal.checkpoint(
+                calendar["journal_key"], "parsed", play_dates=calendar["play_dates"]
+            )
+        if lifecycle is not None:
+            lifecycle.record(
+                calendar["journal_key"],
+                calendar["play_dates"],
+                fetch_date=cachefile_date(calendar["srcfile"]),
+            )
+
+    async def enrich(calendar):
+        if calendar.get("resumed"):
+            return
+        if streams_ndjson(args):
+            await loop.run_in_executor(
+                None, stream_ndjson_calendar, calendar, args, ndjson_fh, ndjson_lock
+            )
+        else:
+            await loop.run_in_executor(None, enrich_calendar, calendar, args)
+        journal.checkpoint(calendar["journal_key"], "enriched")
+
+    async def write(calendar):
+        if not calendar.get("resumed"):
+            await loop.run_in_executor(
+                None, write_calendar, calendar, args, ndjson_fh
+            )
+            journal.checkpoint(
+                calendar["journal_key"], "written", wrote=calendar["wrote"]
+            )
+        calendars.append(calendar)
+
+    if args.file:
+        # files are all parsed as calendars of the first venue
+        produce = _produce_files(parse_queue, args, sources[0], journal)
+    else:
+        produce = _produce_all_web(parse_queue, sources, journal, lifecycle, args)
+
+    tasks = [
+        asyncio.ensure_future(x)
+        for x in (
+            _close_stage(produce, parse_queue, num_workers),
+            _close_stage(
+                _stage(parse_queue, enrich_queue, num_workers, parse),
+                enrich_queue,
+                num_workers,
+            ),
+            _close_stage(
+                _stage(enrich_queue, write_queue, num_workers, enrich),
+                write_queue,
+                1,
+            ),
+            # single writer, so ics files and database writes never overlap
+            _stage(write_queue, None, 1, write),
+        )
+    ]
+    try:
+        await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        # let cancelled stages finish before event loop is closed
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+
+    return calendars
+
+
+def report_fragment_cache(calendars):
+    """Inform user how many ical events were reused from fragment cache
+    """
+    num_reused = sum(x.get("events_reused", 0) for x in calendars)
+    num_events = num_reused + sum(x.get("events_serialized", 0) for x in calendars)
+    if num_events:
+        logger.info(
+            "Event cache: reused %d of %d events (%.0f%%)",
+            num_reused,
+            num_events,
+            100 * num_reused / num_events,
+            extra={"stage": "write"},
+        )
+
+
+def run_pipeline(args, sources, ndjson_fh=None):
+    """Fetch (or find) all calendars and process each through to output
+
+    Args:
+        args (Namespace): command-line arguments
+        sources (list): VenueSource of each venue to fetch calendars from
+        ndjson_fh (file): if given, write all ndjson records here
+
+    Returns:
+        list: calendar dicts, in the order their output was written
+    """
+    if args.jobs > 1:
+        # parsing is CPU-bound, so use separate processes, whose log records
+        #   are all sent back here to be logged
+        (log_queue, log_listener) = start_worker_logging()
+        parse_executor = concurrent.futures.ProcessPoolExecutor(
+            max_workers=args.jobs,
+            initializer=init_worker_logging,
+            initargs=(log_queue,),
+        )
+    else:
+        parse_executor = None
+
+    journal = RunJournal()
+    journal.start(run_signature(args, sources), resume=args.resume)
+    # files given on command line are always processed
+    lifecycle = None if args.file else CalendarLifecycle()
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        calendars = loop.run_until_complete(
+            _run_pipeline(args, sources, ndjson_fh, parse_executor, journal, lifecycle)
+        )
+        journal.complete()
+        if lifecycle is not None:
+            lifecycle.save()
+    finally:
+        journal.close()
+        loop.close()
+        if parse_executor is not None:
+            parse_executor.shutdown()
+            log_listener.stop()
+
+    report_fragment_cache(calendars)
+
+    return calendars
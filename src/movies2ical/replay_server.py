@@ -0,0 +1,145 @@
+"""Local stand-in for the theater website, serving saved calendar html files
+
+Serves an index page linking to every calendar html file in a directory
+(e.g. the test/ corpus) under calendars/, plus the calendar files themselves,
+with Last-Modified/ETag headers and 304 Not Modified support.  Latency and
+server errors can be injected, to exercise and benchmark the fetch stage
+without going to the real website:
+
+    movies2ical replay-server test --port 8000 --latency 0.2 --error-rate 0.1
+    movies2ical --base-url http://localhost:8000/
+"""
+import email.utils
+import hashlib
+import html
+import http.server
+from pathlib import Path
+import random
+import threading
+import time
+import urllib.parse
+
+from .constants import CALENDAR_FILE_SUFFIXES
+
+
+class ReplayRequestHandler(http.server.BaseHTTPRequestHandler):
+    # set by make_replay_server()
+    calendars = {}
+    latency = 0.0
+    error_rate = 0.0
+    last_modified = True
+    etag = True
+    rng = random.Random()
+    rng_lock = threading.Lock()
+
+    def do_GET(self):
+        with self.rng_lock:
+            delay = self.rng.uniform(0.5, 1.5) * self.latency
+            inject_error = self.rng.random() < self.error_rate
+        time.sleep(delay)
+        if inject_error:
+            self.send_error(503, "Injected error")
+            return
+
+        path = urllib.parse.unquote(urllib.parse.urlsplit(self.path).path)
+        if path in ("/", "/index.html"):
+            self.send_index()
+        elif path.startswith("/calendars/") and path[11:] in self.calendars:
+            self.send_calendar(self.calendars[path[11:]])
+        else:
+            self.send_error(404)
+
+    def send_index(self):
+        links = "\n".join(
+            '<p><a href="calendars/%s">%s</a></p>'
+            % (html.escape(name, quote=True), html.escape(name))
+            for name in sorted(self.calendars)
+        )
+        body = (
+            "<html><head><title>Replay</title></head><body>\n"
+            '<p><a href="calendars/index.html">Previous Festivals</a></p>\n'
+            "%s\n</body></html>\n" % links
+        ).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_calendar(self, calendar_file):
+        body = calendar_file.read_bytes()
+        mtime = int(calendar_file.stat().st_mtime)
+        etag = '"%s"' % hashlib.sha1(body).hexdigest()
+
+        not_modified = False
+        if self.etag and "If-None-Match" in self.headers:
+            not_modified = etag in self.headers["If-None-Match"]
+        elif self.last_modified and "If-Modified-Since" in self.headers:
+            try:
+                since = email.utils.parsedate_to_datetime(
+                    self.headers["If-Modified-Since"]
+                )
+            except (TypeError, ValueError):
+                since = None
+            not_modified = since is not None and mtime <= since.timestamp()
+
+        self.send_response(304 if not_modified else 200)
+        if self.last_modified:
+            self.send_header(
+                "Last-Modified", email.utils.formatdate(mtime, usegmt=True)
+            )
+        if self.etag:
+            self.send_header("ETag", etag)
+        if not_modified:
+            self.end_headers()
+            return
+        self.send_header("Content-Type", "text/html")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def make_replay_server(
+    corpus_dir,
+    host="localhost",
+    port=8000,
+    latency=0.0,
+    error_rate=0.0,
+    last_modified=True,
+    etag=True,
+    seed=None,
+):
+    """Make (but don't start) http server replaying calendars in corpus_dir
+
+    Args:
+        corpus_dir (Path): directory of calendar html files
+        host (str): address to listen on
+        port (int): port to listen on (0 for any free port)
+        latency (float): mean seconds to delay each response
+        error_rate (float): fraction of requests answered with 503 error
+        last_modified (bool): send Last-Modified, honor If-Modified-Since
+        etag (bool): send ETag, honor If-None-Match
+        seed (int): random seed for reproducible latency and errors
+
+    Returns:
+        http.server.ThreadingHTTPServer: call serve_forever() to start
+    """
+    calendars = {
+        x.name: x
+        for x in sorted(Path(corpus_dir).iterdir())
+        if x.is_file() and x.suffix.lower() in CALENDAR_FILE_SUFFIXES
+    }
+    handler = type(
+        "ConfiguredReplayRequestHandler",
+        (ReplayRequestHandler,),
+        {
+            "calendars": calendars,
+            "latency": latency,
+            "error_rate": error_rate,
+            "last_modified": last_modified,
+            "etag": etag,
+            "rng": random.Random(seed),
+            "rng_lock": threading.Lock(),
+        },
+    )
+    return http.server.ThreadingHTTPServer((host, port), handler)
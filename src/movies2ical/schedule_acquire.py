@@ -1,4 +1,7 @@
 import datetime
+import email.utils
+import hashlib
+import logging
 from pathlib import Path
 import re
 import urllib.request
@@ -9,10 +12,15 @@ from bs4 import BeautifulSoup
 import pytz
 from tzlocal import get_localzone
 
-from .constants import THEATER_BASEURL, THEATER_CACHE_DIR
+from .cache_io import atomic_write, key_lock
+from .constants import CALENDAR_FILE_SUFFIXES, THEATER_BASEURL, THEATER_CACHE_DIR
 
+logger = logging.getLogger(__name__)
 
-def make_cache_filename(filepath, filedate=datetime.date.today()):
+
+def make_cache_filename(
+    filepath, filedate=datetime.date.today(), cache_dir=THEATER_CACHE_DIR
+):
     out_filename = "%s_%04d%02d%02d%s" % (
         str(Path(filepath).stem),
         filedate.year,
@@ -20,7 +28,7 @@ def make_cache_filename(filepath, filedate=datetime.date.today()):
         filedate.day,
         str(Path(filepath).suffix),
     )
-    return THEATER_CACHE_DIR / out_filename
+    return cache_dir / out_filename
 
 
 def lastmod_datetime(last_mod_str):
@@ -52,16 +60,38 @@ def fetch_url(url, newer_than_date=None):
     # 'Python-urllib' in string yields a HTTP Error 403: Forbidden
     user_agent = "Mozilla/5.0"
     headers = {"User-Agent": user_agent}
+    if newer_than_date is not None:
+        newer_than = datetime.datetime.combine(
+            newer_than_date, datetime.time(0, 0, 1)
+        )
+        tz_local = get_localzone()
+        if hasattr(tz_local, "localize"):
+            newer_than = tz_local.localize(newer_than)
+        else:
+            # tzlocal >= 3 returns zoneinfo timezones, not pytz
+            newer_than = newer_than.replace(tzinfo=tz_local)
+        newer_than = newer_than.astimezone(pytz.utc)
+        # let server answer 304 Not Modified instead of sending page
+        headers["If-Modified-Since"] = email.utils.formatdate(
+            newer_than.timestamp(), usegmt=True
+        )
     request = urllib.request.Request(url, headers=headers)
     html = None
     info = None
     try:
         response = urllib.request.urlopen(request)
     except urllib.error.URLError as err:
-        if hasattr(err, "code"):
-            print(err.code)
+        if getattr(err, "code", None) == 304:
+            # not modified since newer_than_date
+            pass
+        elif hasattr(err, "code"):
+            logger.error(
+                "%s: HTTP error %s", url, err.code, extra={"stage": "fetch", "url": url}
+            )
         else:
-            print(err.reason)
+            logger.error(
+                "%s: %s", url, err.reason, extra={"stage": "fetch", "url": url}
+            )
     else:
         info = response.info()
         if newer_than_date is not None:
@@ -70,13 +100,6 @@ def fetch_url(url, newer_than_date=None):
             else:
                 last_mod_datetime = None
 
-            newer_than = datetime.datetime.combine(
-                newer_than_date, datetime.time(0, 0, 1)
-            )
-            tz_local = get_localzone()
-            newer_than = tz_local.localize(newer_than)
-            newer_than = newer_than.astimezone(pytz.utc)
-
             # fetch from web if no valid last_mod_datetime or
             #   last modified is after the newer_than date
             fetch_from_web = (
@@ -94,17 +117,12 @@ def fetch_url(url, newer_than_date=None):
     return html
 
 
-def fetch_schedule_htmls():
-    """
-    Get latest versions of available theater calendar pages, and if they
-    are newer than previous versions, deposit them in THEATER_CACHE_DIR
+def fetch_calendar_links(base_url=THEATER_BASEURL):
+    """Find links to all calendar pages on the theater main page
 
-    Returns (list): only new versions of calendar html files, either
-        from web (if newer than cache) or from cache (if newer than web)
+    Returns (list): calendar links, relative to base_url
     """
-    new_or_modified = 0
-
-    mainpage_html = fetch_url(THEATER_BASEURL)
+    mainpage_html = fetch_url(base_url)
 
     soup = BeautifulSoup(mainpage_html, "html5lib")
 
@@ -116,46 +134,80 @@ def fetch_schedule_htmls():
         cal_links.remove("calendars/index.html")
     cal_links = [urllib.parse.quote(x) for x in cal_links]
 
-    new_files = []
-    old_files = []
-    for cal_link in cal_links:
+    return cal_links
 
-        cache_date = find_last_cachefile_date(Path(cal_link).name)
 
-        this_html = fetch_url(THEATER_BASEURL + cal_link, newer_than_date=cache_date)
+def fetch_calendar(cal_link, base_url=THEATER_BASEURL, cache_dir=THEATER_CACHE_DIR):
+    """
+    Get latest version of one theater calendar page, and if it is newer
+    than the previous version, deposit it in cache_dir
 
-        if this_html:
-            cache_filename = make_cache_filename(Path(cal_link).name)
+    Returns (tuple): (cache_filename, is_new) where cache_filename is
+        the new version from web (if newer than cache, is_new=True), or the
+        last version from cache (is_new=False), or None if neither exists
+    """
+    # only one process checks and fetches each calendar at a time, any
+    #   others then find today's version already in the cache
+    with key_lock(cache_dir / Path(cal_link).name):
+        cache_date = find_last_cachefile_date(Path(cal_link).name, cache_dir)
 
-            with open(cache_filename, "wb") as cache_fh:
-                cache_fh.write(this_html)
+        this_html = fetch_url(base_url + cal_link, newer_than_date=cache_date)
 
-            new_files.append(cache_filename)
-            new_or_modified += 1
+        if this_html:
+            cache_filename = make_cache_filename(
+                Path(cal_link).name, cache_dir=cache_dir
+            )
+            atomic_write(cache_filename, this_html)
+            return (cache_filename, True)
         else:
-            cache_filename = find_last_cachefile(Path(cal_link).name)
-            if cache_filename:
-                old_files.append(cache_filename)
-
-    # inform user on links and new/modified calendars
-    print(
-        "%d calendar link%s found on %s"
-        % (len(cal_links), "s" if len(cal_links) > 1 else "", THEATER_BASEURL)
+            return (find_last_cachefile(Path(cal_link).name, cache_dir), False)
+
+
+def report_fetch_summary(num_links, new_or_modified, base_url=THEATER_BASEURL):
+    """Inform user on links and new/modified calendars
+    """
+    logger.info(
+        "%d calendar link%s found on %s",
+        num_links,
+        "s" if num_links > 1 else "",
+        base_url,
+        extra={"stage": "fetch"},
     )
-    print(
-        "%d calendar%s that %s new or modified"
-        % (
-            new_or_modified,
-            "s" if new_or_modified != 1 else "",
-            "are" if new_or_modified != 1 else "is",
-        )
+    logger.info(
+        "%d calendar%s that %s new or modified",
+        new_or_modified,
+        "s" if new_or_modified != 1 else "",
+        "are" if new_or_modified != 1 else "is",
+        extra={"stage": "fetch"},
     )
 
+
+def fetch_schedule_htmls(base_url=THEATER_BASEURL, cache_dir=THEATER_CACHE_DIR):
+    """
+    Get latest versions of available theater calendar pages, and if they
+    are newer than previous versions, deposit them in cache_dir
+
+    Returns (list): only new versions of calendar html files, either
+        from web (if newer than cache) or from cache (if newer than web)
+    """
+    cal_links = fetch_calendar_links(base_url)
+
+    new_files = []
+    old_files = []
+    for cal_link in cal_links:
+        (cache_filename, is_new) = fetch_calendar(cal_link, base_url, cache_dir)
+        if is_new:
+            new_files.append(cache_filename)
+        elif cache_filename:
+            old_files.append(cache_filename)
+
+    report_fetch_summary(len(cal_links), len(new_files), base_url)
+
     return (new_files, old_files)
 
 
-def find_last_cachefile(filepath):
-    matched_files = THEATER_CACHE_DIR.glob(
+def find_last_cachefile(filepath, cache_dir=THEATER_CACHE_DIR):
+    matched_files = cache_dir.glob(
         "".join((Path(filepath).stem, "_*", Path(filepath).suffix))
     )
 
@@ -171,17 +223,91 @@ def find_last_cachefile(filepath):
     return cache_file
 
 
-def find_last_cachefile_date(filepath):
+def cachefile_date(cache_filename):
+    """Returns (datetime.date): date cache file was fetched (from its name, see
+        make_cache_filename()), or None if its name has no date
+    """
+    # date is added at end of name, which may have other dates in it
+    date_re = re.search(r"_(\d{4})(\d{2})(\d{2})$", Path(cache_filename).stem)
+    if date_re:
+        return datetime.date(
+            int(date_re.group(1)), int(date_re.group(2)), int(date_re.group(3))
+        )
+    return None
+
+
+def find_last_cachefile_date(filepath, cache_dir=THEATER_CACHE_DIR):
     # init to earliest possible date
     cache_date = None
 
-    last_cache_file = find_last_cachefile(filepath)
+    last_cache_file = find_last_cachefile(filepath, cache_dir)
 
     if last_cache_file:
-        date_re = re.search(r"_(\d{4})(\d{2})(\d{2})", last_cache_file.stem)
-        if date_re:
-            cache_date = datetime.date(
-                int(date_re.group(1)), int(date_re.group(2)), int(date_re.group(3))
-            )
+        cache_date = cachefile_date(last_cache_file)
 
     return cache_date
+
+
+def file_digest(filepath):
+    """Return sha256 hex digest of the contents of filepath
+    """
+    digest = hashlib.sha256()
+    with open(filepath, "rb") as file_fh:
+        for chunk in iter(lambda: file_fh.read(1 << 16), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def find_calendar_files(srcpaths):
+    """Expand files and directories (recursively searched) into calendar files
+
+    Files with identical contents are only returned once, the first time
+    they are found.  Different files whose outputs would be written to the
+    same path (e.g. files of the same name given directly) are an error.
+
+    Args:
+        srcpaths (list): Paths of html files and/or directories
+
+    Returns:
+        list: of (srcfile, relpath) tuples, where relpath is the path of
+            srcfile relative to the directory argument it was found in
+            (or just its filename if it was given directly), suitable for
+            mirroring into an output tree.
+
+    Raises:
+        ValueError: if two different files have the same relpath, apart
+            from its suffix
+    """
+    calendar_files = []
+    seen_digests = set()
+    # output path (relpath without suffix) to srcfile written there
+    output_srcfiles = {}
+    for srcpath in srcpaths:
+        srcpath = Path(srcpath)
+        if srcpath.is_dir():
+            found = sorted(
+                x
+                for x in srcpath.rglob("*")
+                if x.is_file() and x.suffix.lower() in CALENDAR_FILE_SUFFIXES
+            )
+            found = [(x, x.relative_to(srcpath)) for x in found]
+        else:
+            found = [(srcpath, Path(srcpath.name))]
+
+        for (srcfile, relpath) in found:
+            digest = file_digest(srcfile)
+            if digest in seen_digests:
+                logger.info("Skipping duplicate: %s", srcfile)
+                continue
+            seen_digests.add(digest)
+            output = relpath.with_suffix("")
+            if output in output_srcfiles:
+                raise ValueError(
+                    "Calendars %s and %s would be written to the same output "
+                    "file, give the directory they are in instead"
+                    % (output_srcfiles[output], srcfile)
+                )
+            output_srcfiles[output] = srcfile
+            calendar_files.append((srcfile, relpath))
+
+    return calendar_files
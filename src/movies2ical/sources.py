@@ -0,0 +1,202 @@
+"""Venue source plugins: where each venue's calendars come from, how to parse
+them, and where and in what timezone its showings happen
+
+Venues are configured as [[sources]] tables in the config file, e.g.:
+
+    [[sources]]
+        plugin = "stanford"
+        name = "stanford"
+        base_url = "http://www.stanfordtheatre.org/"
+        timezone = "America/Los_Angeles"
+        location = "221 University Ave, Palo Alto, CA (Stanford Theatre)"
+
+Only plugin is required.  Without any [[sources]], the one venue is the
+Stanford Theatre at base_url from the [theater] section.
+
+Other packages can add plugins for other venues' websites by registering a
+VenueSource subclass under the "movies2ical.sources" entry point group.
+Sources are sent to parse worker processes, so must be picklable.
+"""
+import abc
+import inspect
+import logging
+from pathlib import Path
+
+import pytz
+
+from .constants import (
+    THEATER_BASEURL,
+    THEATER_CACHE_DIR,
+    THEATER_LOCATION,
+    THEATER_TZ,
+    VENUE_CACHE_DIR,
+)
+from .parse_schedule import parse_html_calendar
+from .schedule_acquire import fetch_calendar, fetch_calendar_links
+
+logger = logging.getLogger(__name__)
+
+SOURCE_ENTRY_POINT_GROUP = "movies2ical.sources"
+
+
+class VenueSource(abc.ABC):
+    """One venue: its calendar fetcher and parser, timezone, and location
+
+    Subclasses must implement parse_calendar() (a subclass that doesn't is
+    abstract, and rejected when its plugin is loaded), and set plugin and
+    any default_* attributes.  The default fetcher finds calendar links on
+    base_url the way the Stanford Theatre website lays them out.
+    """
+
+    # name of plugin in config file
+    plugin = None
+    default_base_url = None
+    default_timezone = THEATER_TZ.zone
+    default_location = None
+
+    def __init__(
+        self, name=None, base_url=None, timezone=None, location=None, cache_dir=None
+    ):
+        self.name = name or self.plugin
+        self.base_url = base_url or self.default_base_url
+        if self.base_url and not self.base_url.endswith("/"):
+            self.base_url += "/"
+        self.tz = pytz.timezone(timezone or self.default_timezone)
+        self.location = location or self.default_location
+        if cache_dir is None:
+            cache_dir = VENUE_CACHE_DIR / self.name
+        self.cache_dir = Path(cache_dir)
+
+    def __repr__(self):
+        return "%s(name=%r, base_url=%r)" % (
+            type(self).__name__,
+            self.name,
+            self.base_url,
+        )
+
+    def fetch_calendar_links(self):
+        """Returns (list): links to all current calendars of venue
+        """
+        return fetch_calendar_links(self.base_url)
+
+    def fetch_calendar(self, cal_link):
+        """Returns (tuple): (cache_filename, is_new), see fetch_calendar()
+        """
+        self.cache_dir.mkdir(exist_ok=True, parents=True)
+        return fetch_calendar(cal_link, self.base_url, self.cache_dir)
+
+    @abc.abstractmethod
+    def parse_calendar(self, html_file, verbose=False):
+        """Returns (list): play_dates in calendar html_file
+        """
+
+
+class StanfordTheatreSource(VenueSource):
+    plugin = "stanford"
+    default_base_url = THEATER_BASEURL
+    default_timezone = THEATER_TZ.zone
+    default_location = THEATER_LOCATION
+
+    def __init__(self, name=None, cache_dir=None, **kwargs):
+        # the original venue keeps its calendar cache where it always was
+        if cache_dir is None and name in (None, self.plugin):
+            cache_dir = THEATER_CACHE_DIR
+        super().__init__(name=name, cache_dir=cache_dir, **kwargs)
+
+    def parse_calendar(self, html_file, verbose=False):
+        return parse_html_calendar(html_file, verbose=verbose)
+
+
+def check_source_plugin(plugin_class):
+    """Raise TypeError if plugin_class isn't a complete VenueSource subclass
+    """
+    if not (inspect.isclass(plugin_class) and issubclass(plugin_class, VenueSource)):
+        raise TypeError("%r is not a VenueSource subclass" % (plugin_class,))
+    if inspect.isabstract(plugin_class):
+        raise TypeError(
+            "%s doesn't implement %s"
+            % (
+                plugin_class.__name__,
+                ", ".join(sorted(plugin_class.__abstractmethods__)),
+            )
+        )
+
+
+def source_plugins():
+    """Returns (dict): plugin name to VenueSource subclass, for built-in
+        plugins and those installed by other packages
+    """
+    plugins = {StanfordTheatreSource.plugin: StanfordTheatreSource}
+    try:
+        from importlib.metadata import entry_points
+    except ImportError:
+        # python < 3.8: only built-in plugins
+        return plugins
+
+    all_entry_points = entry_points()
+    if hasattr(all_entry_points, "select"):
+        plugin_entry_points = all_entry_points.select(group=SOURCE_ENTRY_POINT_GROUP)
+    else:
+        plugin_entry_points = all_entry_points.get(SOURCE_ENTRY_POINT_GROUP, [])
+    for entry_point in plugin_entry_points:
+        try:
+            plugin_class = entry_point.load()
+            check_source_plugin(plugin_class)
+            plugins[entry_point.name] = plugin_class
+        except Exception as err:
+            logger.warning(
+                "Can't load source plugin %s: %s",
+                entry_point.name,
+                err,
+                extra={"warning_type": "source_plugin"},
+            )
+
+    return plugins
+
+
+def load_sources(config_info, names=None, base_url=None):
+    """Make a VenueSource for each venue configured in config_info
+
+    Args:
+        config_info (dict): from config file
+        names (list): if given, only venues with these names
+        base_url (str): if given, overrides base_url of the first venue
+
+    Returns:
+        list: VenueSource instances, in config file order
+    """
+    source_configs = config_info.get("sources")
+    if not source_configs:
+        source_configs = [
+            {
+                "plugin": StanfordTheatreSource.plugin,
+                "base_url": config_info.get("theater", {}).get("base_url"),
+            }
+        ]
+
+    plugins = source_plugins()
+    sources = []
+    for source_config in source_configs:
+        source_config = dict(source_config)
+        plugin = source_config.pop("plugin", None)
+        if plugin not in plugins:
+            raise ValueError(
+                "Unknown source plugin %r (available: %s)"
+                % (plugin, ", ".join(sorted(plugins)))
+            )
+        sources.append(plugins[plugin](**source_config))
+
+    if names:
+        unknown = set(names) - {x.name for x in sources}
+        if unknown:
+            raise ValueError("Unknown source(s): %s" % ", ".join(sorted(unknown)))
+        sources = [x for x in sources if x.name in names]
+
+    source_names = [x.name for x in sources]
+    if len(set(source_names)) < len(source_names):
+        raise ValueError("Source names must be unique: %s" % ", ".join(source_names))
+
+    if base_url is not None:
+        sources[0].base_url = base_url if base_url.endswith("/") else base_url + "/"
+
+    return sources
@@ -0,0 +1,468 @@
+"""Synthetic Stanford-Theatre-style calendars of any size, with matching imdb
+fixture records, for scale and stress benchmarks
+
+Generated calendars exercise the same things real ones do: date ranges
+spanning months, abbreviated months ("Sep", "Sept"), en-dashes, weekday
+names, extra Saturday/Sunday show times, and the broken markup seen on the
+real website (</tr> with no <tr>, <td> with no </td>).  Synthetic movies
+use imdb numbers from FIXTURE_IMDB_BASE up, which no real movie has.
+
+    movies2ical synthetic out_dir --play-dates 5000
+    movies2ical benchmark --sizes 10 100 1000 10000 100000
+"""
+import datetime
+import io
+import json
+import logging
+import math
+from pathlib import Path
+import random
+import tempfile
+import time
+
+from .constants import MONTHS
+from .fragment_cache import FragmentCache
+from .occurrences import expand_occurrences
+from .outputs import gen_ical, gen_ndjson
+from .parse_schedule import compute_datetimes, parse_html_calendar
+from .verify import check_for_problems
+
+logger = logging.getLogger(__name__)
+
+# first imdb movie number of synthetic movies
+FIXTURE_IMDB_BASE = 99000000
+
+# play_dates per calendar for benchmark, smallest to largest
+BENCHMARK_SIZES = [10, 100, 1000, 10000, 100000]
+
+TITLE_WORDS_1 = [
+    "Midnight",
+    "Silent",
+    "Golden",
+    "Crimson",
+    "Lonely",
+    "Broken",
+    "Hidden",
+    "Distant",
+    "Wicked",
+    "Shadow",
+    "Scarlet",
+    "Restless",
+]
+TITLE_WORDS_2 = [
+    "Harbor",
+    "Express",
+    "Waltz",
+    "Canyon",
+    "Affair",
+    "Frontier",
+    "Melody",
+    "Verdict",
+    "Passage",
+    "Orchid",
+    "Lagoon",
+    "Masquerade",
+]
+PERSON_NAMES = [
+    "Ada Wells",
+    "Ben Marlow",
+    "Cora Finch",
+    "Dex Hollis",
+    "Edna Price",
+    "Finn Carver",
+    "Gail Norton",
+    "Hal Brooks",
+    "Iris Vane",
+    "Jack Dorsey",
+    "Kay Lund",
+    "Lou Avery",
+]
+
+
+def fixture_imdb_records(num_movies, rng):
+    """Make imdb info records for synthetic movies
+
+    Returns:
+        dict: imdb movie number (str) to record, in imdb cache format
+    """
+    records = {}
+    for i in range(num_movies):
+        title = "%s %s" % (
+            TITLE_WORDS_1[i % len(TITLE_WORDS_1)],
+            TITLE_WORDS_2[(i // len(TITLE_WORDS_1)) % len(TITLE_WORDS_2)],
+        )
+        if i >= len(TITLE_WORDS_1) * len(TITLE_WORDS_2):
+            title += " %d" % (i // (len(TITLE_WORDS_1) * len(TITLE_WORDS_2)) + 1)
+        records[str(FIXTURE_IMDB_BASE + i)] = {
+            "title": title,
+            "director": rng.sample(PERSON_NAMES, rng.randint(1, 2)),
+            "writer": rng.sample(PERSON_NAMES, rng.randint(1, 3)),
+            "cast": rng.sample(PERSON_NAMES, rng.randint(3, 10)),
+            "runtimes": [str(rng.randint(65, 140))],
+            "plot": [
+                "A synthetic movie about %s %s.::Generator"
+                % (title.lower(), rng.choice(["at night", "in the rain", "abroad"]))
+            ],
+            "year": rng.randint(1925, 1965),
+            "rating": round(rng.uniform(4.0, 9.0), 1),
+        }
+    return records
+
+
+def _date_str(first_day, last_day, rng):
+    """Human-readable date range, in one of the styles of the real calendars
+    """
+
+    def month_name(day):
+        if day.month == 9 and rng.random() < 0.2:
+            return "Sept"
+        if rng.random() < 0.2:
+            # abbreviated month
+            return MONTHS[day.month + 11]
+        return MONTHS[day.month - 1]
+
+    dash = rng.choice(["-", "-", "-", "&ndash;", " - "])
+    if first_day == last_day:
+        return "%s %d" % (month_name(first_day), first_day.day)
+    if first_day.month != last_day.month:
+        # multi-month range
+        return "%s %d%s%s %d" % (
+            month_name(first_day),
+            first_day.day,
+            dash,
+            month_name(last_day),
+            last_day.day,
+        )
+    if rng.random() < 0.1:
+        # weekday names, e.g. Friday July 1 - Friday July 8
+        return "%s %s %d - %s %s %d" % (
+            first_day.strftime("%A"),
+            month_name(first_day),
+            first_day.day,
+            last_day.strftime("%A"),
+            month_name(last_day),
+            last_day.day,
+        )
+    return "%s %d%s%d" % (month_name(first_day), first_day.day, dash, last_day.day)
+
+
+def _time_str(rng):
+    """Show times of one movie, maybe with extra weekend show time
+    """
+    times = sorted(rng.sample(range(1, 11), rng.randint(1, 2)))
+    time_str = ", ".join("%d:%02d" % (x, rng.choice([0, 15, 30, 45])) for x in times)
+    extra = rng.random()
+    if extra < 0.3:
+        time_str += " (plus %d:%02d Sat/Sun)" % (rng.randint(1, 4), rng.choice([0, 30]))
+    elif extra < 0.4:
+        time_str += " (plus %d:%02d %s)" % (
+            rng.randint(1, 4),
+            rng.choice([0, 30]),
+            rng.choice(["Sat", "Sun", "Sat only", "Sunday"]),
+        )
+    return time_str
+
+
+def generate_calendar_html(num_play_dates, imdb_records, year, rng):
+    """Make html of a Stanford-Theatre-style calendar
+
+    Play dates follow one another through the year, wrapping around to
+    January if there are too many for one year (so big calendars have many
+    movies on the same days, and many time conflicts).  Each pass through
+    the year is like one season's calendar (see seasons()).
+
+    Args:
+        num_play_dates (int): number of (movie, date range) play_dates
+        imdb_records (dict): from fixture_imdb_records()
+        year (int): year of calendar
+        rng (random.Random): random number generator
+
+    Returns:
+        str: html of calendar
+    """
+    imdb_nums = sorted(imdb_records)
+    day = datetime.date(year, 1, 1)
+    rows = []
+    cells = []
+    play_dates_left = num_play_dates
+    while play_dates_left > 0:
+        num_days = rng.choice([1, 2, 2, 3, 3, 4, 7])
+        last_day = day + datetime.timedelta(days=num_days - 1)
+        if last_day.year != year:
+            day = datetime.date(year, 1, 1)
+            continue
+
+        movies = []
+        for _ in range(min(rng.randint(1, 3), play_dates_left)):
+            imdb_num = rng.choice(imdb_nums)
+            record = imdb_records[imdb_num]
+            movies.append(
+                '      <p><a href="http://www.imdb.com/title/tt%s">%s (%d)</a>\n'
+                "      %s</p>\n"
+                % (imdb_num, record["title"], record["year"], _time_str(rng))
+            )
+        play_dates_left -= len(movies)
+
+        # sometimes no </td>, like real calendars
+        cells.append(
+            '    <td class="playdate" colspan="%d">\n'
+            '      <p class="date">%s</p>\n'
+            "%s"
+            "    %s\n"
+            % (
+                min(num_days, 3),
+                _date_str(day, last_day, rng),
+                "".join(movies),
+                "" if rng.random() < 0.05 else "</td>",
+            )
+        )
+        if len(cells) == 2 or play_dates_left == 0:
+            # sometimes </tr> with no <tr>, like real calendars
+            rows.append(
+                "%s%s  </tr>\n"
+                % ("" if rng.random() < 0.05 else "  <tr>\n", "".join(cells))
+            )
+            cells = []
+        day = last_day + datetime.timedelta(days=1)
+
+    return (
+        "<html>\n<head>\n"
+        '<meta charset="utf-8">\n'
+        "<title>Synthetic Calendar</title>\n"
+        "</head>\n<body>\n"
+        '<table class="calendar" border="1" cellspacing="0" cellpadding="4">\n'
+        '  <tr>\n    <td class="day">Wednesday</td>\n    <td class="day">Thursday'
+        "</td>\n  </tr>\n"
+        "%s</table>\n</body>\n</html>\n" % "".join(rows)
+    )
+
+
+def calendar_filename(num_play_dates, year):
+    # year in filename tells parser which year calendar is
+    return "Synthetic%d_%d.html" % (num_play_dates, year)
+
+
+def write_synthetic(out_dir, num_play_dates, num_movies=None, year=2019, seed=None):
+    """Write a synthetic calendar html file, and its imdb fixture records as
+    imdb cache json files in out_dir/imdb_cache
+
+    Returns:
+        Path: calendar html file
+    """
+    rng = random.Random(seed)
+    if num_movies is None:
+        num_movies = max(1, min(num_play_dates // 2, 2000))
+    imdb_records = fixture_imdb_records(num_movies, rng)
+
+    out_dir = Path(out_dir)
+    imdb_dir = out_dir / "imdb_cache"
+    imdb_dir.mkdir(exist_ok=True, parents=True)
+    for (imdb_num, record) in imdb_records.items():
+        with open(imdb_dir / (imdb_num + ".json"), "w") as imdb_fh:
+            json.dump(record, imdb_fh)
+
+    html_filename = out_dir / calendar_filename(num_play_dates, year)
+    with open(html_filename, "w", encoding="utf-8") as html_fh:
+        html_fh.write(generate_calendar_html(num_play_dates, imdb_records, year, rng))
+
+    logger.info(
+        "Wrote: %s (%d play dates, %d imdb fixture records in %s)",
+        html_filename,
+        num_play_dates,
+        num_movies,
+        imdb_dir,
+    )
+    return html_filename
+
+
+def attach_fixture_imdb_info(play_dates, imdb_records):
+    """Add imdb info to play_dates from fixture records instead of the cache
+    """
+    for play_date in play_dates:
+        imdb_num = play_date["imdb_url"].rsplit("/tt", 1)[-1].strip("/")
+        play_date["imdb_info"] = dict(imdb_records[imdb_num])
+
+
+def seasons(play_dates):
+    """Split play_dates of a synthetic calendar into its passes through the
+    year (see generate_calendar_html()), each like one real season's calendar
+
+    Returns:
+        list: list of play_dates of each pass
+    """
+    passes = []
+    last_startdate = None
+    for play_date in play_dates:
+        if last_startdate is None or play_date["show_startdate"] < last_startdate:
+            passes.append([])
+        passes[-1].append(play_date)
+        last_startdate = play_date["show_startdate"]
+    return passes
+
+
+def check_seasons(play_dates):
+    """Check each season of play_dates for problems, like separate calendars
+
+    Returns:
+        int: number of overlapping pairs of occurrences
+    """
+    return sum(check_for_problems(x) for x in seasons(play_dates))
+
+
+def benchmark_size(num_play_dates, work_dir, seed=None):
+    """Time each stage on one synthetic calendar of num_play_dates
+
+    Returns:
+        dict: stage name to seconds, plus "num_play_dates" and
+            "num_occurrences" parsed and expanded
+    """
+    rng = random.Random(seed)
+    imdb_records = fixture_imdb_records(max(1, min(num_play_dates // 2, 2000)), rng)
+    html_filename = Path(work_dir) / calendar_filename(num_play_dates, 2019)
+    with open(html_filename, "w", encoding="utf-8") as html_fh:
+        html_fh.write(generate_calendar_html(num_play_dates, imdb_records, 2019, rng))
+
+    timings = {}
+
+    def timed(stage, func, *args, **kwargs):
+        start_time = time.perf_counter()
+        result = func(*args, **kwargs)
+        timings[stage] = time.perf_counter() - start_time
+        return result
+
+    play_dates = timed("parse", parse_html_calendar, html_filename)
+    timed("imdb", attach_fixture_imdb_info, play_dates, imdb_records)
+    timed("datetimes", compute_datetimes, play_dates)
+    occurrences = timed("occurrences", expand_occurrences, play_dates)
+    # a big calendar stacks many movies on each day, all conflicting with
+    #   each other, so checking it whole would find quadratically many
+    #   conflicts
+    num_overlaps = timed("verify", check_seasons, play_dates)
+    timed("ical", gen_ical, play_dates, Path(work_dir) / "synthetic.ics")
+    # again, with all events already in fragment cache
+    fragment_cache_file = Path(work_dir) / (
+        "vevent_cache_%d.sqlite3" % num_play_dates
+    )
+    with FragmentCache(fragment_cache_file) as fragment_cache:
+        gen_ical(
+            play_dates,
+            Path(work_dir) / "synthetic.ics",
+            fragment_cache=fragment_cache,
+        )
+    with FragmentCache(fragment_cache_file) as fragment_cache:
+        timed(
+            "ical_cached",
+            gen_ical,
+            play_dates,
+            Path(work_dir) / "synthetic.ics",
+            fragment_cache=fragment_cache,
+        )
+    timed(
+        "ndjson",
+        gen_ndjson,
+        play_dates,
+        io.StringIO(),
+        calendar=html_filename.name,
+        occurrences=occurrences,
+    )
+
+    timings["num_play_dates"] = len(play_dates)
+    timings["num_occurrences"] = len(occurrences)
+    timings["num_overlaps"] = num_overlaps
+    return timings
+
+
+BENCHMARK_STAGES = [
+    "parse",
+    "imdb",
+    "datetimes",
+    "occurrences",
+    "verify",
+    "ical",
+    "ical_cached",
+    "ndjson",
+]
+
+
+def growth_exponents(timings1, timings2):
+    """Growth exponent k of each stage from one benchmark_size() to a bigger
+    one, where time ~ num_play_dates**k: about 1 for stages that scale
+    linearly, 2 for quadratic
+
+    Returns:
+        dict: stage name to k (nan if it can't be computed)
+    """
+    if min(timings1["num_play_dates"], timings2["num_play_dates"]) == 0:
+        return {x: float("nan") for x in BENCHMARK_STAGES}
+    size_ratio = timings2["num_play_dates"] / timings1["num_play_dates"]
+    growths = {}
+    for stage in BENCHMARK_STAGES:
+        if timings1[stage] > 0 and timings2[stage] > 0 and size_ratio != 1:
+            growths[stage] = math.log(timings2[stage] / timings1[stage]) / math.log(
+                size_ratio
+            )
+        else:
+            growths[stage] = float("nan")
+    return growths
+
+
+def run_benchmark(sizes=BENCHMARK_SIZES, seed=0):
+    """Time every stage for synthetic calendars of each size, and report
+    seconds per stage and how fast each grows from one size to the next
+
+    Growth is the exponent k in time ~ size**k: about 1 for stages that
+    scale linearly, 2 for quadratic.
+
+    Returns:
+        list: (size, timings) for each size
+    """
+    # synthetic calendars are full of deliberate time conflicts and odd
+    #   markup, don't log a warning for each one
+    quiet_loggers = [
+        logging.getLogger(x)
+        for x in (
+            "movies2ical.parse_schedule",
+            "movies2ical.verify",
+            "movies2ical.outputs",
+        )
+    ]
+    old_levels = [x.level for x in quiet_loggers]
+    for quiet_logger in quiet_loggers:
+        quiet_logger.setLevel(logging.ERROR)
+
+    results = []
+    try:
+        with tempfile.TemporaryDirectory() as work_dir:
+            logger.info(
+                "%8s %8s %9s " + " ".join(["%11s"] * len(BENCHMARK_STAGES)),
+                "size",
+                "parsed",
+                "occurs",
+                *BENCHMARK_STAGES
+            )
+            for size in sizes:
+                timings = benchmark_size(size, work_dir, seed=seed)
+                results.append((size, timings))
+                logger.info(
+                    "%8d %8d %9d " + " ".join(["%10.3fs"] * len(BENCHMARK_STAGES)),
+                    size,
+                    timings["num_play_dates"],
+                    timings["num_occurrences"],
+                    *[timings[x] for x in BENCHMARK_STAGES],
+                    extra={"stage": "benchmark"},
+                )
+    finally:
+        for (quiet_logger, old_level) in zip(quiet_loggers, old_levels):
+            quiet_logger.setLevel(old_level)
+
+    # growth exponent of each stage between consecutive sizes
+    for ((size1, timings1), (size2, timings2)) in zip(results, results[1:]):
+        growths = growth_exponents(timings1, timings2)
+        logger.info(
+            "%8s %18s " + " ".join(["%11.2f"] * len(BENCHMARK_STAGES)),
+            "growth",
+            "%d->%d" % (size1, size2),
+            *[growths[x] for x in BENCHMARK_STAGES]
+        )
+
+    return results
@@ -0,0 +1,177 @@
+"""Index of cached IMDb records by normalized title and year
+
+Lets movies listed without an IMDb link be matched to a cached record with a
+dict lookup, instead of an IMDb search over the network.  The index is kept
+in IMDB_TITLE_INDEX_FILE, and on loading only records added to the IMDb
+cache since it was saved are read.
+
+Titles are normalized the same way for matching and for checking that a
+calendar's title and year agree with IMDb's (see verify.py).
+"""
+import json
+import logging
+import os
+import re
+import threading
+
+from .cache_io import atomic_write
+from .constants import IMDB_CACHE_DIR, IMDB_TITLE_INDEX_FILE
+
+logger = logging.getLogger(__name__)
+
+# change whenever normalization changes, to rebuild saved index
+TITLE_INDEX_VERSION = 2
+
+# year in last parenthesized string of calendar movie name, e.g.
+#   "Ninotchka (1939)", "Helpmates (1932) (short subject)"
+NAME_YEAR_RE = re.compile(r"\(.*(19\d\d).*\)")
+# trailing parenthesized string of calendar movie name
+NAME_PARENS_RE = re.compile(r"\s*\([^)]*\)\s*$")
+
+
+def split_name_year(name):
+    """Split calendar movie name into title and year
+
+    Returns:
+        tuple: (title without trailing parentheses, year or -1 if none)
+    """
+    year_re = NAME_YEAR_RE.search(name)
+    if year_re:
+        year = int(year_re.group(1))
+    else:
+        year = -1
+    return (NAME_PARENS_RE.sub("", name), year)
+
+
+def normalize_title(title):
+    """Returns (str): title reduced to the part that must match to be the
+        same movie
+    """
+    # lower-case compared strings
+    title = title.lower()
+    # ignore all double-quotes
+    title = re.sub(r'"', "", title)
+    # ignore "the" (as a whole word)
+    title = re.sub(r"\bthe\s+", "", title, flags=re.I)
+    return title
+
+
+class TitleIndex:
+    """Cached IMDb movie numbers by normalized title and year
+    """
+
+    def __init__(
+        self, imdb_cache_dir=IMDB_CACHE_DIR, index_filename=IMDB_TITLE_INDEX_FILE
+    ):
+        self.imdb_cache_dir = imdb_cache_dir
+        self.index_filename = index_filename
+        # movie number to (normalized title, year)
+        self.movies = {}
+        # (normalized title, year) to set of movie numbers
+        self.by_title_year = {}
+        # normalized title to set of movie numbers
+        self.by_title = {}
+        self.lock = threading.Lock()
+
+    def load(self):
+        """Load saved index, then add records cached since it was saved
+        """
+        try:
+            with open(self.index_filename, "r", encoding="utf-8") as index_fh:
+                saved = json.load(index_fh)
+        except (FileNotFoundError, PermissionError, ValueError):
+            saved = {}
+        if saved.get("version") == TITLE_INDEX_VERSION:
+            saved_movies = saved["movies"]
+        else:
+            saved_movies = {}
+
+        try:
+            cached_nums = [
+                x.name[: -len(".json")]
+                for x in os.scandir(str(self.imdb_cache_dir))
+                if x.name.endswith(".json")
+            ]
+        except FileNotFoundError:
+            cached_nums = []
+
+        changed = len(cached_nums) != len(saved_movies)
+        for movie_num in cached_nums:
+            if movie_num in saved_movies:
+                (title_cmp, year) = saved_movies[movie_num]
+                self._add(movie_num, title_cmp, year)
+                continue
+            try:
+                with open(
+                    self.imdb_cache_dir / (movie_num + ".json"), "r"
+                ) as imdb_cache_fh:
+                    imdb_movie = json.load(imdb_cache_fh)
+            except (OSError, ValueError):
+                continue
+            self.add(movie_num, imdb_movie)
+            changed = True
+
+        if changed:
+            self.save()
+        return self
+
+    def save(self):
+        with self.lock:
+            index_str = json.dumps(
+                {"version": TITLE_INDEX_VERSION, "movies": self.movies}
+            )
+        try:
+            self.index_filename.parent.mkdir(exist_ok=True, parents=True)
+            atomic_write(self.index_filename, index_str)
+        except OSError as err:
+            logger.error("Can't save IMDb title index: %s", err)
+
+    def add(self, movie_num, imdb_movie):
+        """Add movie_num with its IMDb info dict to index
+        """
+        try:
+            # some cached titles end with their year, e.g. "Ninotchka (1939)"
+            title_cmp = normalize_title(split_name_year(imdb_movie["title"])[0])
+            year = int(imdb_movie["year"])
+        except (KeyError, TypeError, ValueError):
+            return
+        self._add(movie_num, title_cmp, year)
+
+    def _add(self, movie_num, title_cmp, year):
+        with self.lock:
+            self.movies[movie_num] = (title_cmp, year)
+            self.by_title_year.setdefault((title_cmp, year), set()).add(movie_num)
+            self.by_title.setdefault(title_cmp, set()).add(movie_num)
+
+    def lookup(self, name):
+        """Find the one cached movie matching calendar movie name
+
+        Args:
+            name (str): calendar movie name, e.g. "Ninotchka (1939)"
+
+        Returns:
+            str: IMDb movie number, or None if no or more than one match
+        """
+        (title, year) = split_name_year(name)
+        title_cmp = normalize_title(title)
+        if year == -1:
+            movie_nums = self.by_title.get(title_cmp, ())
+        else:
+            movie_nums = self.by_title_year.get((title_cmp, year), ())
+        if len(movie_nums) == 1:
+            return next(iter(movie_nums))
+        return None
+
+
+_title_index = None
+_title_index_lock = threading.Lock()
+
+
+def get_title_index():
+    """Returns (TitleIndex): index of this process, loaded on first use
+    """
+    global _title_index
+    with _title_index_lock:
+        if _title_index is None:
+            _title_index = TitleIndex().load()
+        return _title_index
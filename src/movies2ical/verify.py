@@ -1,112 +1,160 @@
 import datetime
-import re
+import logging
 
 from .constants import THEATER_TZ, MONTHS
+from .occurrences import expand_occurrences
+from .title_index import normalize_title, split_name_year
+
+logger = logging.getLogger(__name__)
 
 
 def check_name_year_consistency(play_dates):
     # check if stanford theatre name & year doesn't match imdb name & year
     for play_date in play_dates:
-        stan_name = play_date["name"]
         imdb_name = play_date["imdb_info"]["title"]
         imdb_year = play_date["imdb_info"]["year"]
-
-        stan_year_re = re.search(r"\(.*(19\d\d).*\)", stan_name)
-        if stan_year_re:
-            stan_year = int(stan_year_re.group(1))
-        else:
-            stan_year = -1
-        stan_name = re.sub(r"\s*\([^)]*\)\s*$", "", stan_name)
-
-        # lower-case compared strings
-        stan_name_cmp = stan_name.lower()
-        imdb_name_cmp = imdb_name.lower()
-        # ignore all double-quotes
-        stan_name_cmp = re.sub(r'"', "", stan_name_cmp)
-        imdb_name_cmp = re.sub(r'"', "", imdb_name_cmp)
-        # ignore beginning "the"
-        stan_name_cmp = re.sub(r"the\s+", "", stan_name_cmp, re.I)
-        imdb_name_cmp = re.sub(r"the\s+", "", imdb_name_cmp, re.I)
+        (stan_name, stan_year) = split_name_year(play_date["name"])
 
         show_date_str = (
             MONTHS[play_date["showings"][0]["datetime_start"].month - 1]
             + " %d" % play_date["showings"][0]["datetime_start"].day
         )
-        if stan_name_cmp != imdb_name_cmp:
-            print("%s, Warning, inconsistent title:" % show_date_str)
-            print("    Stanford Theatre: " + stan_name)
-            print("                IMDb: " + imdb_name)
+        if normalize_title(stan_name) != normalize_title(imdb_name):
+            logger.warning(
+                "%s, Warning, inconsistent title:\n"
+                "    Stanford Theatre: %s\n"
+                "                IMDb: %s",
+                show_date_str,
+                stan_name,
+                imdb_name,
+                extra={"stage": "verify", "warning_type": "inconsistent_title"},
+            )
         if stan_year != imdb_year:
-            print("%s, Warning, inconsistent year:" % show_date_str)
-            print("    Stanford Theatre: %s (%d)" % (stan_name, stan_year))
-            print("                IMDb: %s (%d)" % (imdb_name, imdb_year))
-
-
-def check_schedule_overlap(play_dates, correct_endtimes=False):
-    # check for schedule overlaps (movie 1 ends after movie 2 begins, and
-    #   before movie 2 ends)
-    # O(n!)
-    for (i, play_date1) in enumerate(play_dates):
-        for play_date2 in play_dates[i + 1 :]:
-            for showing1 in play_date1["showings"]:
-                for showing2 in play_date2["showings"]:
-                    show_start_name = None
-
-                    if (
-                        showing1["datetime_start"]
-                        < showing2["datetime_start"]
-                        < showing1["datetime_end"]
-                    ):
-                        show_end_name = play_date1["name"]
-                        show_end_time = showing1["datetime_end"]
-                        show_start_name = play_date2["name"]
-                        show_start_time = showing2["datetime_start"]
-                        if correct_endtimes:
-                            showing1["datetime_end"] = showing2[
-                                "datetime_start"
-                            ] - datetime.timedelta(minutes=1)
-                    if (
-                        showing2["datetime_start"]
-                        < showing1["datetime_start"]
-                        < showing2["datetime_end"]
-                    ):
-                        show_end_name = play_date2["name"]
-                        show_end_time = showing2["datetime_end"]
-                        show_start_name = play_date1["name"]
-                        show_start_time = showing1["datetime_start"]
-                        if correct_endtimes:
-                            showing2["datetime_end"] = showing1[
-                                "datetime_start"
-                            ] - datetime.timedelta(minutes=1)
-
-                    if show_start_name:
-                        show_end_time = show_end_time.astimezone(THEATER_TZ)
-                        show_end_time_str = show_end_time.strftime("%I:%M%p %Z")
-                        show_start_time = show_start_time.astimezone(THEATER_TZ)
-                        show_start_time_str = show_start_time.strftime("%I:%M%p %Z")
-                        show_date_str = (
-                            MONTHS[show_start_time.month - 1]
-                            + " %d" % show_start_time.day
-                        )
-                        if correct_endtimes:
-                            print("AUTOCORRECTING TO FIX:")
-                        print("%s, Movie time conflict between:" % show_date_str)
-                        print(
-                            "    " + show_end_name + " (Ends at %s)" % show_end_time_str
-                        )
-                        print(
-                            "    "
-                            + show_start_name
-                            + " (Starts at %s)" % show_start_time_str
-                        )
+            logger.warning(
+                "%s, Warning, inconsistent year:\n"
+                "    Stanford Theatre: %s (%d)\n"
+                "                IMDb: %s (%d)",
+                show_date_str,
+                stan_name,
+                stan_year,
+                imdb_name,
+                imdb_year,
+                extra={"stage": "verify", "warning_type": "inconsistent_year"},
+            )
+
+
+class LocalTime:
+    """Timestamp in timezone tz, formatted for messages only when printed
+    """
+
+    __slots__ = ("timestamp", "tz", "date_only")
+
+    def __init__(self, timestamp, tz, date_only=False):
+        self.timestamp = timestamp
+        self.tz = tz
+        self.date_only = date_only
+
+    def __str__(self):
+        local_time = datetime.datetime.fromtimestamp(self.timestamp, self.tz)
+        if self.date_only:
+            return MONTHS[local_time.month - 1] + " %d" % local_time.day
+        return local_time.strftime("%I:%M%p %Z")
+
+
+def check_schedule_overlap(
+    play_dates, correct_endtimes=False, tz=THEATER_TZ, occurrences=None
+):
+    """Warn about schedule overlaps (movie 1 ends after movie 2 begins, and
+    before movie 2 ends), on any day of their runs
+
+    Each occurrence is only compared to the ones that start after it and
+    before it ends, so this takes time linear in the number of occurrences
+    (after expand_occurrences() sorts them) plus the number of overlapping
+    pairs of occurrences.
+
+    Args:
+        play_dates (list): play_dates with showings computed
+        correct_endtimes (bool): end movie 1 a minute before movie 2 begins
+        tz (pytz.timezone): timezone of venue, for messages
+        occurrences (Occurrences): from expand_occurrences(play_dates), if
+            already computed
+
+    Returns:
+        int: number of overlapping pairs of occurrences
+    """
+    if occurrences is None:
+        occurrences = expand_occurrences(play_dates)
+    starts = occurrences.starts
+    ends = occurrences.ends
+    showing_ids = occurrences.showing_ids
+
+    # next occurrence that starts later than each one
+    next_later = [len(starts)] * len(starts)
+    for i in range(len(starts) - 2, -1, -1):
+        next_later[i] = i + 1 if starts[i + 1] > starts[i] else next_later[i + 1]
+
+    # sweep through occurrences in order of start, comparing each one to
+    #   every later one that starts before it ends (e.g. both of two short
+    #   movies shown during a long one)
+    warned = set()
+    num_overlaps = 0
+    for i in range(len(starts)):
+        j = next_later[i]
+        # ends[i] is shortened if correct_endtimes, ending the walk
+        while j < len(starts) and starts[j] < ends[i]:
+            num_overlaps += 1
+            # warn once for each pair of showings, like it was at the first
+            #   occurrence where they overlap
+            pair = (showing_ids[i], showing_ids[j])
+            if pair not in warned:
+                warned.add(pair)
+                _warn_overlap(occurrences, i, j, correct_endtimes, tz)
+            j += 1
+    return num_overlaps
+
+
+def _warn_overlap(occurrences, i, j, correct_endtimes, tz):
+    """Warn that occurrence i ends after occurrence j starts, unless both
+    are of the same movie
+    """
+    starts = occurrences.starts
+    showing_ids = occurrences.showing_ids
+    (play_date1, _) = occurrences.showings[showing_ids[i]]
+    (play_date2, _) = occurrences.showings[showing_ids[j]]
+    if play_date1 is play_date2:
+        return
+    end = occurrences.ends[i]
+    if correct_endtimes:
+        occurrences.set_duration(showing_ids[i], starts[j] - starts[i] - 60)
+    # times are only formatted if warning is logged
+    logger.warning(
+        "%s%s, Movie time conflict between:\n"
+        "    %s (Ends at %s)\n"
+        "    %s (Starts at %s)",
+        "AUTOCORRECTING TO FIX:\n" if correct_endtimes else "",
+        LocalTime(starts[j], tz, date_only=True),
+        play_date1["name"],
+        LocalTime(end, tz),
+        play_date2["name"],
+        LocalTime(starts[j], tz),
+        extra={"stage": "verify", "warning_type": "time_conflict"},
+    )
 
 
 def check_empty_schedule(play_dates):
     if not play_dates:
-        print("Warning, no movies or showtimes found")
+        logger.warning(
+            "Warning, no movies or showtimes found",
+            extra={"stage": "verify", "warning_type": "empty_schedule"},
+        )
 
 
-def check_for_problems(play_dates, correct_endtimes=False):
+def check_for_problems(
+    play_dates, correct_endtimes=False, tz=THEATER_TZ, occurrences=None
+):
+    """Returns (int): number of overlapping pairs of occurrences, see
+        check_schedule_overlap()
+    """
     # check if empty schedule
     check_empty_schedule(play_dates)
 
@@ -115,4 +163,6 @@ def check_for_problems(play_dates, correct_endtimes=False):
 
     # check for schedule overlaps (movie 1 ends after movie 2 begins, and
     #   before movie 2 ends)
-    check_schedule_overlap(play_dates, correct_endtimes=correct_endtimes)
+    return check_schedule_overlap(
+        play_dates, correct_endtimes=correct_endtimes, tz=tz, occurrences=occurrences
+    )
@@ -0,0 +1,294 @@
+"""Durable queue of calendar jobs in a sqlite3 database, shared by workers on
+any number of machines
+
+Each job is one stage (see worker.py) of one calendar of one run.  A worker
+leases a job for a while, renewing the lease as long as it works on it.  If
+the worker dies, the lease runs out and another worker takes the job over.
+A job that fails is retried later, with growing delays, until it has been
+attempted max_attempts times.
+
+Jobs are unique per (run, kind, key), and finishing a job adds the jobs that
+follow from it in the same transaction, so a job done twice (by a worker
+whose lease ran out) changes nothing.
+"""
+import contextlib
+import json
+import sqlite3
+import time
+
+from .constants import WORK_MAX_ATTEMPTS, WORK_QUEUE_FILE, WORK_RETRY_DELAY
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id INTEGER PRIMARY KEY,
+    options TEXT NOT NULL,
+    created REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id INTEGER PRIMARY KEY,
+    run_id INTEGER NOT NULL,
+    kind TEXT NOT NULL,
+    key TEXT NOT NULL,
+    payload TEXT,
+    state TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    available_at REAL NOT NULL,
+    lease_owner TEXT,
+    lease_expires REAL,
+    finished REAL,
+    result TEXT,
+    error TEXT,
+    UNIQUE (run_id, kind, key)
+);
+CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, available_at);
+CREATE INDEX IF NOT EXISTS jobs_finished ON jobs (finished);
+"""
+
+# job states
+PENDING = "pending"
+LEASED = "leased"
+DONE = "done"
+FAILED = "failed"
+
+
+class WorkQueue:
+    """Jobs in a sqlite3 database, safe to share between processes and
+    machines
+
+    Use as a context manager.  Each thread needs its own WorkQueue.
+    """
+
+    def __init__(
+        self,
+        db_filename=WORK_QUEUE_FILE,
+        max_attempts=WORK_MAX_ATTEMPTS,
+        retry_delay=WORK_RETRY_DELAY,
+    ):
+        self.db_filename = db_filename
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.conn = None
+
+    def __enter__(self):
+        self.db_filename.parent.mkdir(exist_ok=True, parents=True)
+        # generous timeout so many workers can share queue; transactions are
+        #   explicit (see _transaction())
+        self.conn = sqlite3.connect(
+            str(self.db_filename), timeout=60, isolation_level=None
+        )
+        self.conn.executescript(SCHEMA)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.conn.close()
+        self.conn = None
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        # take write lock up front, so two workers can't lease the same job
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
+        self.conn.execute("COMMIT")
+
+    def add_run(self, options, jobs):
+        """Add a run and its first jobs
+
+        Args:
+            options (dict): json-serializable options of run
+            jobs (list): (kind, key, payload) of each first job
+
+        Returns:
+            int: run_id
+        """
+        with self._transaction():
+            run_id = self.conn.execute(
+                "INSERT INTO runs (options, created) VALUES (?, ?)",
+                (json.dumps(options), time.time()),
+            ).lastrowid
+            self._add_jobs(run_id, jobs)
+        return run_id
+
+    def run_options(self, run_id):
+        (options,) = self.conn.execute(
+            "SELECT options FROM runs WHERE run_id = ?", (run_id,)
+        ).fetchone()
+        return json.loads(options)
+
+    def _add_jobs(self, run_id, jobs):
+        now = time.time()
+        self.conn.executemany(
+            "INSERT OR IGNORE INTO jobs (run_id, kind, key, payload, available_at) "
+            "VALUES (?, ?, ?, ?, ?)",
+            [
+                (run_id, kind, key, json.dumps(payload), now)
+                for (kind, key, payload) in jobs
+            ],
+        )
+
+    def lease(self, worker_id, lease_seconds):
+        """Take the next job that is ready, or whose last worker's lease ran
+        out
+
+        Jobs of later stages go first, so calendars are finished before
+        new ones are started.
+
+        Returns:
+            dict: job (job_id, run_id, kind, key, payload, attempts), or None
+                if no job is ready
+        """
+        now = time.time()
+        with self._transaction():
+            # a job whose lease ran out on its last attempt has failed
+            self.conn.execute(
+                "UPDATE jobs SET state = ?, error = 'lease expired', "
+                "lease_owner = NULL "
+                "WHERE state = ? AND lease_expires < ? AND attempts >= ?",
+                (FAILED, LEASED, now, self.max_attempts),
+            )
+            row = self.conn.execute(
+                "SELECT job_id, run_id, kind, key, payload, attempts FROM jobs "
+                "WHERE (state = ? AND available_at <= ?) "
+                "OR (state = ? AND lease_expires < ?) "
+                "ORDER BY CASE kind "
+                "WHEN 'write' THEN 0 WHEN 'enrich' THEN 1 WHEN 'parse' THEN 2 "
+                "ELSE 3 END, job_id LIMIT 1",
+                (PENDING, now, LEASED, now),
+            ).fetchone()
+            if row is None:
+                return None
+            (job_id, run_id, kind, key, payload, attempts) = row
+            self.conn.execute(
+                "UPDATE jobs SET state = ?, attempts = ?, lease_owner = ?, "
+                "lease_expires = ? WHERE job_id = ?",
+                (LEASED, attempts + 1, worker_id, now + lease_seconds, job_id),
+            )
+        return {
+            "job_id": job_id,
+            "run_id": run_id,
+            "kind": kind,
+            "key": key,
+            "payload": json.loads(payload),
+            "attempts": attempts + 1,
+        }
+
+    def renew(self, job, worker_id, lease_seconds):
+        """Extend lease of job
+
+        Returns:
+            bool: False if worker no longer holds the lease
+        """
+        with self._transaction():
+            cursor = self.conn.execute(
+                "UPDATE jobs SET lease_expires = ? "
+                "WHERE job_id = ? AND state = ? AND lease_owner = ?",
+                (time.time() + lease_seconds, job["job_id"], LEASED, worker_id),
+            )
+        return cursor.rowcount == 1
+
+    def finish(self, job, worker_id, result=None, next_jobs=()):
+        """Mark job done, and add the jobs that follow from it
+
+        Args:
+            job (dict): from lease()
+            worker_id (str): worker that did the job
+            result (dict): json-serializable summary of what job did
+            next_jobs (list): (kind, key, payload) of each following job
+
+        Returns:
+            bool: False if job was already finished by another worker
+        """
+        with self._transaction():
+            cursor = self.conn.execute(
+                "UPDATE jobs SET state = ?, finished = ?, lease_owner = ?, "
+                "result = ?, payload = NULL, error = NULL "
+                "WHERE job_id = ? AND state != ?",
+                (
+                    DONE,
+                    time.time(),
+                    worker_id,
+                    json.dumps(result),
+                    job["job_id"],
+                    DONE,
+                ),
+            )
+            if cursor.rowcount != 1:
+                return False
+            self._add_jobs(job["run_id"], next_jobs)
+        return True
+
+    def fail(self, job, worker_id, error):
+        """Record failed attempt at job, to retry later unless it has had
+        max_attempts
+
+        Returns:
+            bool: True if job will be retried
+        """
+        retry = job["attempts"] < self.max_attempts
+        with self._transaction():
+            self.conn.execute(
+                "UPDATE jobs SET state = ?, available_at = ?, lease_owner = NULL, "
+                "lease_expires = NULL, error = ?, finished = ? "
+                "WHERE job_id = ? AND state = ? AND lease_owner = ?",
+                (
+                    PENDING if retry else FAILED,
+                    time.time() + self.retry_delay * 2 ** (job["attempts"] - 1),
+                    error,
+                    None if retry else time.time(),
+                    job["job_id"],
+                    LEASED,
+                    worker_id,
+                ),
+            )
+        return retry
+
+    def is_idle(self):
+        """Returns (bool): True if no job is pending or being worked on
+        """
+        (num_open,) = self.conn.execute(
+            "SELECT COUNT(*) FROM jobs WHERE state IN (?, ?)", (PENDING, LEASED)
+        ).fetchone()
+        return num_open == 0
+
+    def job_counts(self):
+        """Returns (dict): kind to dict of state to number of jobs
+        """
+        counts = {}
+        for (kind, state, num_jobs) in self.conn.execute(
+            "SELECT kind, state, COUNT(*) FROM jobs GROUP BY kind, state"
+        ):
+            counts.setdefault(kind, {})[state] = num_jobs
+        return counts
+
+    def finished_since(self, since):
+        """Returns (list): (worker, number of jobs, time of first one) done
+            since time since
+        """
+        return self.conn.execute(
+            "SELECT lease_owner, COUNT(*), MIN(finished) FROM jobs "
+            "WHERE state = ? AND finished >= ? GROUP BY lease_owner "
+            "ORDER BY lease_owner",
+            (DONE, since),
+        ).fetchall()
+
+    def leased_jobs(self):
+        """Returns (list): (worker, kind, key, lease_expires) of jobs being
+            worked on
+        """
+        return self.conn.execute(
+            "SELECT lease_owner, kind, key, lease_expires FROM jobs "
+            "WHERE state = ? ORDER BY lease_owner",
+            (LEASED,),
+        ).fetchall()
+
+    def failed_jobs(self):
+        """Returns (list): (kind, key, attempts, error) of failed jobs
+        """
+        return self.conn.execute(
+            "SELECT kind, key, attempts, error FROM jobs WHERE state = ? "
+            "ORDER BY job_id",
+            (FAILED,),
+        ).fetchall()
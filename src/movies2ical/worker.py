@@ -0,0 +1,419 @@
+"""Runs split into per-calendar jobs in a WorkQueue, so any number of
+'movies2ical worker' processes, on any machines sharing the queue, can
+process them together
+
+Each calendar goes through one job per stage, each passing its result on to
+the next in its payload, so any worker can do any job.  All of a calendar's
+jobs have the key of its fetch job (its link, or file path with -f):
+    "links": fetch links to all calendars of a venue
+    "fetch": fetch (or read) one calendar's html
+    "parse": parse html into play_dates
+    "enrich": add imdb info to play_dates
+    "write": compute showings, check them, and write output
+
+Every job can safely be done more than once: fetched calendars and imdb info
+go into the worker's own caches, and output files are overwritten.
+"""
+import argparse
+import base64
+import datetime
+import logging
+import os
+from pathlib import Path
+import socket
+import tempfile
+import threading
+import time
+
+from .constants import DEFAULT_IMDB_INFO, WORK_LEASE_SECONDS, WORK_POLL_SECONDS
+from .log import stage_context
+from .pipeline import (
+    add_datetimes,
+    add_imdb_info,
+    new_calendar,
+    parse_calendar,
+    write_calendar,
+)
+from .schedule_acquire import find_calendar_files
+from .sources import load_sources
+from .work_queue import DONE, FAILED, LEASED, PENDING
+
+logger = logging.getLogger(__name__)
+
+JOB_KINDS = ["links", "fetch", "parse", "enrich", "write"]
+
+
+def source_options(source):
+    """Returns (dict): source's config, so workers can recreate it
+    """
+    return {
+        "plugin": source.plugin,
+        "name": source.name,
+        "base_url": source.base_url,
+        "timezone": source.tz.zone,
+        "location": source.location,
+    }
+
+
+def submit_run(work_queue, args, sources):
+    """Add a run to work_queue, with its first jobs
+
+    Args:
+        work_queue (WorkQueue): opened queue
+        args (Namespace): command-line arguments of run
+        sources (list): VenueSource of each venue to fetch calendars from
+
+    Returns:
+        int: run_id
+    """
+    options = {
+        "sources": [source_options(x) for x in sources],
+        "format": args.format,
+        "correct_times": args.correct_times,
+        "imdb_info": args.imdb_info,
+        "db": None if args.db is None else str(args.db.resolve()),
+        "out_dir": str(args.out_dir.resolve()),
+        "verbose": args.verbose,
+    }
+    if args.file:
+        # files are read by workers, so must be on shared storage too
+        jobs = [
+            (
+                "fetch",
+                str(srcfile.resolve()),
+                {
+                    "key": str(srcfile.resolve()),
+                    "source": sources[0].name,
+                    "srcfile": str(srcfile.resolve()),
+                    "relpath": str(relpath),
+                },
+            )
+            for (srcfile, relpath) in find_calendar_files(args.srcfile)
+        ]
+    else:
+        jobs = [
+            (
+                "links",
+                x.name,
+                {
+                    "source": x.name,
+                    # keep calendars of each venue in their own output directory
+                    "out_subdir": x.name if len(sources) > 1 else "",
+                },
+            )
+            for x in sources
+        ]
+    run_id = work_queue.add_run(options, jobs)
+    logger.info("Submitted run %d with %d jobs", run_id, len(jobs))
+    return run_id
+
+
+def do_links_job(payload, run):
+    source = run["sources"][payload["source"]]
+    return (
+        None,
+        [
+            (
+                "fetch",
+                "%s/%s" % (source.name, cal_link),
+                {
+                    "key": "%s/%s" % (source.name, cal_link),
+                    "source": source.name,
+                    "cal_link": cal_link,
+                    "out_subdir": payload["out_subdir"],
+                },
+            )
+            for cal_link in source.fetch_calendar_links()
+        ],
+    )
+
+
+def do_fetch_job(payload, run):
+    source = run["sources"][payload["source"]]
+    if "srcfile" in payload:
+        srcfile = Path(payload["srcfile"])
+        relpath = Path(payload["relpath"])
+        is_new = False
+    else:
+        (srcfile, is_new) = source.fetch_calendar(payload["cal_link"])
+        if not srcfile:
+            return ({"fetched": False}, [])
+        relpath = Path(payload["out_subdir"]) / srcfile.name
+    with open(srcfile, "rb") as html_fh:
+        html = base64.b64encode(html_fh.read()).decode("ascii")
+    return (
+        {"fetched": True, "is_new": is_new},
+        [
+            (
+                "parse",
+                payload["key"],
+                {
+                    "key": payload["key"],
+                    "source": source.name,
+                    "srcname": srcfile.name,
+                    "relpath": str(relpath),
+                    "is_new": is_new,
+                    "html": html,
+                },
+            )
+        ],
+    )
+
+
+def do_parse_job(payload, run):
+    source = run["sources"][payload["source"]]
+    logger.info(
+        "Parsing",
+        extra={"calendar": payload["srcname"], "stage": "parse"},
+    )
+    # parsers find calendar year in filename, so parse a copy of the same name
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        srcfile = Path(tmp_dir) / payload["srcname"]
+        with open(srcfile, "wb") as html_fh:
+            html_fh.write(base64.b64decode(payload["html"]))
+        play_dates = parse_calendar(source, srcfile, run["options"]["verbose"])
+    next_payload = dict(payload, play_dates=play_dates)
+    del next_payload["html"]
+    return (
+        {"play_dates": len(play_dates)},
+        [("enrich", payload["key"], next_payload)],
+    )
+
+
+def payload_calendar(payload, run):
+    """Returns (dict): calendar dict (see pipeline.py) of job payload
+    """
+    calendar = new_calendar(
+        payload["key"],
+        run["sources"][payload["source"]],
+        Path(payload["srcname"]),
+        Path(payload["relpath"]),
+        payload["is_new"],
+        out_dir=Path(run["options"]["out_dir"]),
+    )
+    calendar["play_dates"] = payload["play_dates"]
+    return calendar
+
+
+def do_enrich_job(payload, run):
+    calendar = payload_calendar(payload, run)
+    with stage_context(calendar["srcfile"].name, "enrich"):
+        add_imdb_info(
+            calendar, info=run["options"].get("imdb_info", DEFAULT_IMDB_INFO)
+        )
+    return (
+        None,
+        [
+            (
+                "write",
+                payload["key"],
+                dict(payload, play_dates=calendar["play_dates"]),
+            )
+        ],
+    )
+
+
+def do_write_job(payload, run):
+    calendar = payload_calendar(payload, run)
+    with stage_context(calendar["srcfile"].name, "enrich"):
+        add_datetimes(calendar, run["args"])
+    write_calendar(calendar, run["args"])
+    return (
+        {
+            "wrote": calendar["wrote"],
+            "is_new": calendar["is_new"],
+            "output": str(calendar["ics_filename"]),
+        },
+        [],
+    )
+
+
+# job kind to function(payload, run) returning (result, next_jobs)
+JOB_HANDLERS = {
+    "links": do_links_job,
+    "fetch": do_fetch_job,
+    "parse": do_parse_job,
+    "enrich": do_enrich_job,
+    "write": do_write_job,
+}
+
+
+def load_run(work_queue, run_id):
+    """Returns (dict): options of run, with its VenueSources and the args
+        namespace stages expect
+    """
+    options = work_queue.run_options(run_id)
+    sources = load_sources({"sources": options["sources"]})
+    options["db"] = None if options["db"] is None else Path(options["db"])
+    return {
+        "options": options,
+        "sources": {x.name: x for x in sources},
+        "args": argparse.Namespace(**options),
+    }
+
+
+def default_worker_id():
+    return "%s:%d" % (socket.gethostname(), os.getpid())
+
+
+class LeaseKeeper:
+    """Renew lease of job from a background thread while it is worked on
+    """
+
+    def __init__(self, work_queue_factory, job, worker_id, lease_seconds):
+        self.work_queue_factory = work_queue_factory
+        self.job = job
+        self.worker_id = worker_id
+        self.lease_seconds = lease_seconds
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._renew, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stopped.set()
+        self.thread.join()
+
+    def _renew(self):
+        # sqlite connections can't be shared between threads
+        with self.work_queue_factory() as work_queue:
+            while not self.stopped.wait(self.lease_seconds / 3):
+                if not work_queue.renew(self.job, self.worker_id, self.lease_seconds):
+                    logger.warning(
+                        "Lost lease on %s job: %s",
+                        self.job["kind"],
+                        self.job["key"],
+                        extra={"warning_type": "lease_lost"},
+                    )
+                    return
+
+
+def run_worker(
+    work_queue_factory,
+    worker_id=None,
+    lease_seconds=WORK_LEASE_SECONDS,
+    poll_seconds=WORK_POLL_SECONDS,
+    exit_when_idle=False,
+    max_jobs=None,
+):
+    """Do jobs from queue until stopped (or idle, if exit_when_idle)
+
+    Args:
+        work_queue_factory (callable): returns new (unopened) WorkQueue
+        worker_id (str): name of worker in queue (Default: host:pid)
+        lease_seconds (float): how long a job's lease lasts unless renewed
+        poll_seconds (float): wait between looking for jobs when idle
+        exit_when_idle (bool): return when no jobs are pending or leased
+        max_jobs (int): if given, return after this many jobs
+
+    Returns:
+        int: number of jobs done
+    """
+    worker_id = worker_id or default_worker_id()
+    runs = {}
+    num_done = 0
+    logger.info("Worker %s started", worker_id)
+    with work_queue_factory() as work_queue:
+        while max_jobs is None or num_done < max_jobs:
+            job = work_queue.lease(worker_id, lease_seconds)
+            if job is None:
+                if exit_when_idle and work_queue.is_idle():
+                    break
+                time.sleep(poll_seconds)
+                continue
+
+            try:
+                if job["run_id"] not in runs:
+                    runs[job["run_id"]] = load_run(work_queue, job["run_id"])
+                with LeaseKeeper(work_queue_factory, job, worker_id, lease_seconds):
+                    start_time = time.monotonic()
+                    (result, next_jobs) = JOB_HANDLERS[job["kind"]](
+                        job["payload"], runs[job["run_id"]]
+                    )
+            except Exception as err:
+                retry = work_queue.fail(job, worker_id, "%s: %s" % (type(err), err))
+                logger.error(
+                    "%s job failed (attempt %d%s): %s: %s",
+                    job["kind"],
+                    job["attempts"],
+                    ", will retry" if retry else "",
+                    job["key"],
+                    err,
+                    extra={"stage": job["kind"]},
+                )
+                continue
+
+            if not work_queue.finish(job, worker_id, result, next_jobs):
+                logger.debug(
+                    "%s job already finished by another worker: %s",
+                    job["kind"],
+                    job["key"],
+                )
+            logger.debug(
+                "Did %s job: %s",
+                job["kind"],
+                job["key"],
+                extra={"stage": job["kind"], "duration": time.monotonic() - start_time},
+            )
+            num_done += 1
+    logger.info("Worker %s stopped after %d jobs", worker_id, num_done)
+    return num_done
+
+
+def report_queue_status(work_queue, window_minutes=10):
+    """Print progress of all jobs, and recent throughput of each worker
+    """
+    counts = work_queue.job_counts()
+    states = [PENDING, LEASED, DONE, FAILED]
+    print("%-8s" % "job" + "".join("%10s" % x for x in states))
+    for kind in JOB_KINDS:
+        if kind in counts:
+            print(
+                "%-8s" % kind
+                + "".join("%10d" % counts[kind].get(x, 0) for x in states)
+            )
+    print(
+        "%-8s" % "total"
+        + "".join(
+            "%10d" % sum(x.get(state, 0) for x in counts.values()) for state in states
+        )
+    )
+
+    now = time.time()
+    finished = work_queue.finished_since(now - window_minutes * 60)
+    num_recent = sum(x[1] for x in finished)
+    # rate over the part of window that workers were busy in
+    busy_minutes = (now - min([x[2] for x in finished], default=now)) / 60
+    rate = num_recent / max(busy_minutes, 1)
+    print()
+    print(
+        "Last %d minutes: %d jobs done (%.1f jobs/min)"
+        % (window_minutes, num_recent, rate)
+    )
+    for (worker_id, num_jobs, _) in finished:
+        print("    %s: %d jobs" % (worker_id, num_jobs))
+
+    num_open = sum(x.get(PENDING, 0) + x.get(LEASED, 0) for x in counts.values())
+    if num_open and num_recent:
+        print(
+            "At that rate, %d open jobs (and the jobs they lead to) need at "
+            "least %s"
+            % (num_open, datetime.timedelta(seconds=round(num_open / rate * 60)))
+        )
+
+    leased = work_queue.leased_jobs()
+    if leased:
+        print()
+        print("Being worked on:")
+        for (worker_id, kind, key, lease_expires) in leased:
+            expired = " (lease expired)" if lease_expires < time.time() else ""
+            print("    %s: %s %s%s" % (worker_id, kind, key, expired))
+
+    failed = work_queue.failed_jobs()
+    if failed:
+        print()
+        print("Failed:")
+        for (kind, key, attempts, error) in failed:
+            print("    %s %s (%d attempts): %s" % (kind, key, attempts, error))
@@ -0,0 +1,44 @@
+"""Microbenchmark of date and showtime parsing, over every date and showtime
+string in the test/ calendar corpus (from the golden test's data)
+
+Run with:
+    python tests/bench_parse_schedule.py [repeats]
+"""
+import json
+from pathlib import Path
+import sys
+import timeit
+
+from movies2ical.parse_schedule import parse_datestr, process_movie_time_str
+
+GOLDEN_FILE = Path(__file__).resolve().parent / "data" / "parse_strings.json"
+
+
+def main(repeats=200):
+    with open(GOLDEN_FILE, "r", encoding="utf-8") as golden_fh:
+        golden = json.load(golden_fh)
+    dates = [(x["str"], x["year"]) for x in golden["dates"]]
+    times = [x["str"] for x in golden["times"]]
+
+    def parse_dates():
+        for (content_str, calendar_year) in dates:
+            parse_datestr(content_str, calendar_year)
+
+    def parse_times():
+        for movie_time in times:
+            process_movie_time_str(movie_time)
+
+    for (name, func, num_strs) in [
+        ("parse_datestr", parse_dates, len(dates)),
+        ("process_movie_time_str", parse_times, len(times)),
+    ]:
+        # best of 5, to leave out other load on machine
+        best = min(timeit.repeat(func, number=repeats, repeat=5))
+        print(
+            "%-24s %4d strings: %6.2f us/string"
+            % (name, num_strs, best / repeats / num_strs * 1e6)
+        )
+
+
+if __name__ == "__main__":
+    main(*[int(x) for x in sys.argv[1:2]])
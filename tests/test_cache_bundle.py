@@ -0,0 +1,101 @@
+"""Cache bundles: exporting consistent databases, merging imdb info on import
+"""
+import json
+import os
+import sqlite3
+
+import pytest
+
+from movies2ical import cache_bundle, cache_io
+from movies2ical.imdb import merge_imdb_info
+
+MAIN_INFO = {
+    "title": "Rebecca",
+    "director": ["Alfred Hitchcock"],
+    "writer": ["Some One"],
+    "cast": ["Some One"],
+    "runtimes": ["130"],
+    "year": 1940,
+    "rating": 8.1,
+}
+
+
+@pytest.fixture
+def cache_root(tmp_path, monkeypatch):
+    """Point cache bundle paths at an empty cache in tmp_path
+    """
+    cache_root = tmp_path / "cache"
+    imdb_cache_dir = cache_root / "imdb_cache"
+    showings_db_file = cache_root / "showings.sqlite3"
+    imdb_cache_dir.mkdir(parents=True)
+    monkeypatch.setattr(cache_bundle, "CACHE_ROOT_DIR", cache_root)
+    monkeypatch.setattr(cache_bundle, "IMDB_CACHE_DIR", imdb_cache_dir)
+    monkeypatch.setattr(cache_bundle, "SHOWINGS_DB_FILE", showings_db_file)
+    monkeypatch.setattr(
+        cache_bundle, "CACHE_BUNDLE_PATHS", [imdb_cache_dir, showings_db_file]
+    )
+    monkeypatch.setattr(cache_bundle, "BUNDLE_DB_FILES", [showings_db_file])
+    monkeypatch.setattr(cache_io, "LOCK_DIR", cache_root / "locks")
+    return cache_root
+
+
+def write_imdb_info(cache_root, imdb_movie, mtime):
+    filename = cache_root / "imdb_cache" / "0032976.json"
+    filename.write_text(json.dumps(imdb_movie))
+    os.utime(filename, (mtime, mtime))
+    return filename
+
+
+def test_merge_imdb_info():
+    plot_only = {"plot": ["Old plot"], "_info": ["plot"]}
+    main_only = dict(MAIN_INFO, _info=["main"])
+
+    merged = merge_imdb_info(main_only, plot_only)
+    assert merged == dict(MAIN_INFO, plot=["Old plot"], _info=["main", "plot"])
+
+    # of info sets both hold, first one's win
+    both = dict(MAIN_INFO, plot=["New plot"], _info=["main", "plot"])
+    assert merge_imdb_info(both, plot_only)["plot"] == ["New plot"]
+    assert merge_imdb_info(plot_only, both)["plot"] == ["Old plot"]
+
+
+def test_import_keeps_older_plot(cache_root, tmp_path):
+    bundle_filename = tmp_path / "bundle.tar.gz"
+    write_imdb_info(cache_root, dict(MAIN_INFO, _info=["main"]), 2000000000)
+    cache_bundle.export_cache(bundle_filename)
+
+    # local cache is older, but holds plot the bundle doesn't
+    local_filename = write_imdb_info(
+        cache_root,
+        dict(MAIN_INFO, rating=7.0, plot=["Old plot"], _info=["main", "plot"]),
+        1000000000,
+    )
+    assert cache_bundle.import_cache(bundle_filename) == (0, 1, 0)
+    merged = json.loads(local_filename.read_text())
+    assert merged["rating"] == 8.1
+    assert merged["plot"] == ["Old plot"]
+    assert merged["_info"] == ["main", "plot"]
+
+    # nothing left to merge
+    assert cache_bundle.import_cache(bundle_filename) == (0, 0, 1)
+
+
+def test_export_copies_database_in_use(cache_root, tmp_path):
+    bundle_filename = tmp_path / "bundle.tar.gz"
+    conn = sqlite3.connect(str(cache_root / "showings.sqlite3"))
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("CREATE TABLE showings (title TEXT)")
+    conn.execute("INSERT INTO showings VALUES ('Rebecca')")
+    conn.commit()
+    try:
+        # rows are still only in write-ahead log, not in database file itself
+        cache_bundle.export_cache(bundle_filename)
+    finally:
+        conn.close()
+
+    (cache_root / "showings.sqlite3").unlink()
+    assert cache_bundle.import_cache(bundle_filename) == (1, 0, 0)
+    with sqlite3.connect(str(cache_root / "showings.sqlite3")) as imported:
+        assert imported.execute("SELECT title FROM showings").fetchall() == [
+            ("Rebecca",)
+        ]
@@ -0,0 +1,182 @@
+"""Showings database: storing, querying, merging and upgrading
+"""
+import datetime
+import sqlite3
+
+import pytz
+
+from movies2ical.database import (
+    director_name_keys,
+    merge_db,
+    open_db,
+    query_showings,
+    store_play_dates,
+)
+
+TZ = pytz.timezone("America/Los_Angeles")
+
+
+def play_date(imdb_id, name, start, days=1, director="Alfred Hitchcock", plot=True):
+    datetime_start = TZ.localize(start)
+    imdb_info = {
+        "title": name,
+        "director": [director],
+        "writer": ["Some One"],
+        "cast": ["Some One"],
+        "runtimes": ["100"],
+        "year": 1940,
+        "rating": 8.0,
+    }
+    if plot:
+        imdb_info["plot"] = ["Plot of %s" % name]
+    return {
+        "name": "%s (1940)" % name,
+        "imdb_url": "https://www.imdb.com/title/tt%s/" % imdb_id,
+        "imdb_info": imdb_info,
+        "showings": [
+            {
+                "datetime_start": datetime_start,
+                "datetime_end": datetime_start + datetime.timedelta(hours=2),
+                "rrule_count": days,
+            }
+        ],
+    }
+
+
+REBECCA = play_date("0032976", "Rebecca", datetime.datetime(2019, 1, 11, 19, 30), 2)
+NINOTCHKA = play_date(
+    "0031725",
+    "Ninotchka",
+    datetime.datetime(2019, 1, 12, 21, 30),
+    director="Ernst Lubitsch",
+)
+
+
+def test_store_and_query(tmp_path):
+    db_filename = tmp_path / "showings.sqlite3"
+    store_play_dates(db_filename, [REBECCA, NINOTCHKA], "stanford", TZ, "Jan.html")
+
+    showings = query_showings(db_filename)
+    assert [x["title"] for x in showings] == ["Rebecca", "Ninotchka"]
+    assert showings[0]["first_date"] == "2019-01-11"
+    assert showings[0]["last_date"] == "2019-01-12"
+    assert showings[0]["venue"] == "stanford"
+    assert showings[0]["timezone"] == "America/Los_Angeles"
+
+    assert [x["title"] for x in query_showings(db_filename, imdb_id="0031725")] == [
+        "Ninotchka"
+    ]
+    for director in ("hitchcock", "HITCH", "Alfred Hitchcock", "alfred  hitch"):
+        assert [x["title"] for x in query_showings(db_filename, director=director)] == [
+            "Rebecca"
+        ]
+    assert query_showings(db_filename, director="itchcock") == []
+    assert [
+        x["title"]
+        for x in query_showings(db_filename, on_date=datetime.date(2019, 1, 12))
+    ] == ["Rebecca", "Ninotchka"]
+    assert [
+        x["title"] for x in query_showings(db_filename, since=datetime.date(2019, 1, 13))
+    ] == []
+    assert query_showings(db_filename, venue="other") == []
+
+
+def test_same_showing_at_two_venues(tmp_path):
+    db_filename = tmp_path / "showings.sqlite3"
+    store_play_dates(db_filename, [REBECCA], "stanford", TZ)
+    store_play_dates(
+        db_filename, [REBECCA], "other", pytz.timezone("America/New_York")
+    )
+    assert [x["venue"] for x in query_showings(db_filename)] == ["other", "stanford"]
+
+
+def test_plot_kept_when_not_fetched(tmp_path):
+    db_filename = tmp_path / "showings.sqlite3"
+    store_play_dates(db_filename, [REBECCA], "stanford", TZ)
+    main_only = play_date(
+        "0032976", "Rebecca", datetime.datetime(2019, 1, 11, 19, 30), 2, plot=False
+    )
+    store_play_dates(db_filename, [main_only], "stanford", TZ)
+    conn = open_db(db_filename)
+    (plot,) = conn.execute("SELECT plot FROM movies").fetchone()
+    conn.close()
+    assert plot == '["Plot of Rebecca"]'
+
+
+def test_lookups_use_indexes(tmp_path):
+    db_filename = tmp_path / "showings.sqlite3"
+    store_play_dates(db_filename, [REBECCA, NINOTCHKA], "stanford", TZ)
+    conn = open_db(db_filename)
+    for (sql, params) in [
+        ("SELECT * FROM showings WHERE imdb_id = ?", ("0032976",)),
+        (
+            "SELECT imdb_id FROM director_keys WHERE name_key >= ? AND name_key < ?",
+            ("hitch", "hitch\U0010ffff"),
+        ),
+    ]:
+        plan = " ".join(
+            x[-1] for x in conn.execute("EXPLAIN QUERY PLAN " + sql, params)
+        )
+        assert "SCAN" not in plan, plan
+    conn.close()
+
+
+def test_director_name_keys():
+    assert director_name_keys("Alfred Hitchcock") == ["alfred hitchcock", "hitchcock"]
+    assert director_name_keys("W.S. Van Dyke") == [
+        "w s van dyke",
+        "s van dyke",
+        "van dyke",
+        "dyke",
+    ]
+
+
+def test_merge_keeps_newer_rows(tmp_path):
+    local_db = tmp_path / "local.sqlite3"
+    bundle_db = tmp_path / "bundle.sqlite3"
+    store_play_dates(bundle_db, [REBECCA, NINOTCHKA], "stanford", TZ)
+    store_play_dates(local_db, [REBECCA], "stanford", TZ)
+    conn = open_db(local_db)
+    with conn:
+        conn.execute("UPDATE showings SET name = 'Local', updated = updated + 100")
+    conn.close()
+
+    merge_db(bundle_db, local_db)
+    showings = query_showings(local_db)
+    assert [x["name"] for x in showings] == ["Local", "Ninotchka (1940)"]
+    assert [x["title"] for x in query_showings(local_db, director="lubitsch")] == [
+        "Ninotchka"
+    ]
+
+
+def test_upgrade_first_schema(tmp_path):
+    db_filename = tmp_path / "showings.sqlite3"
+    conn = sqlite3.connect(str(db_filename))
+    conn.executescript(
+        """
+        CREATE TABLE movies (imdb_id TEXT PRIMARY KEY, title TEXT, year INTEGER,
+            rating REAL, runtimes TEXT, writer TEXT, "cast" TEXT, plot TEXT);
+        CREATE TABLE movie_directors (imdb_id TEXT NOT NULL,
+            director TEXT NOT NULL COLLATE NOCASE, PRIMARY KEY (imdb_id, director));
+        CREATE TABLE showings (imdb_id TEXT NOT NULL, start_utc TEXT NOT NULL,
+            end_utc TEXT NOT NULL, rrule_count INTEGER NOT NULL,
+            first_date TEXT NOT NULL, last_date TEXT NOT NULL, name TEXT NOT NULL,
+            imdb_url TEXT NOT NULL, calendar TEXT, PRIMARY KEY (imdb_id, start_utc));
+        INSERT INTO movies (imdb_id, title, plot)
+            VALUES ('0032976', 'Rebecca', 'null');
+        INSERT INTO movie_directors VALUES ('0032976', 'Alfred Hitchcock');
+        INSERT INTO showings VALUES ('0032976', '2019-01-12T03:30:00+00:00',
+            '2019-01-12T05:30:00+00:00', 1, '2019-01-11', '2019-01-11',
+            'Rebecca (1940)', 'u', 'Jan.html');
+        """
+    )
+    conn.close()
+
+    (showing,) = query_showings(db_filename, director="hitchcock")
+    assert (showing["venue"], showing["timezone"]) == (
+        "stanford",
+        "America/Los_Angeles",
+    )
+    conn = open_db(db_filename)
+    assert conn.execute("SELECT plot FROM movies").fetchone() == (None,)
+    conn.close()
@@ -0,0 +1,92 @@
+"""Freezing of calendars whose showings are all over
+"""
+import datetime
+from pathlib import Path
+import shutil
+
+from movies2ical.lifecycle import CalendarLifecycle, next_year
+from movies2ical.parse_schedule import parse_html_calendar
+from movies2ical.schedule_acquire import cachefile_date
+
+CORPUS_DIR = Path(__file__).resolve().parent.parent / "test"
+
+
+def fetched_as(tmp_path, corpus_name, cache_name):
+    """Returns (tuple): (play_dates, fetch date) of corpus calendar, as if
+        it had been fetched into cache file cache_name
+    """
+    cache_filename = tmp_path / cache_name
+    shutil.copyfile(CORPUS_DIR / corpus_name, cache_filename)
+    return (parse_html_calendar(cache_filename), cachefile_date(cache_filename))
+
+
+def test_ended_calendar_freezes(tmp_path):
+    (play_dates, fetch_date) = fetched_as(
+        tmp_path, "Ray2018_20190108.html", "Ray2018_20190108.html"
+    )
+    lifecycle = CalendarLifecycle(tmp_path / "lifecycle.json")
+    # shows end January 13
+    assert not lifecycle.record(
+        "stanford/Ray2018.html",
+        play_dates,
+        fetch_date=fetch_date,
+        today=datetime.date(2019, 1, 20),
+    )
+    assert lifecycle.record(
+        "stanford/Ray2018.html",
+        play_dates,
+        fetch_date=fetch_date,
+        today=datetime.date(2019, 3, 1),
+    )
+
+
+def test_calendar_fetched_after_it_ended_freezes(tmp_path):
+    # past season fetched a week after its last show
+    (play_dates, fetch_date) = fetched_as(
+        tmp_path, "Ray2018_20190108.html", "Ray2018_20190120.html"
+    )
+    lifecycle = CalendarLifecycle(tmp_path / "lifecycle.json")
+    assert not lifecycle.record(
+        "stanford/Ray2018.html",
+        play_dates,
+        fetch_date=fetch_date,
+        today=datetime.date(2019, 1, 20),
+    )
+    assert lifecycle.record(
+        "stanford/Ray2018.html",
+        play_dates,
+        fetch_date=fetch_date,
+        today=datetime.date(2019, 3, 1),
+    )
+    lifecycle.save()
+    assert CalendarLifecycle(tmp_path / "lifecycle.json").is_frozen(
+        "stanford/Ray2018.html"
+    )
+
+
+def test_year_boundary_calendar_judged_a_year_later(tmp_path):
+    # January calendar fetched in December parses as January of fetch year
+    (play_dates, fetch_date) = fetched_as(
+        tmp_path, "Ray2018_20190108.html", "Ray2018_20181228.html"
+    )
+    assert max(datetime.date(*x["show_enddate"]) for x in play_dates) == (
+        datetime.date(2018, 1, 13)
+    )
+    lifecycle = CalendarLifecycle(tmp_path / "lifecycle.json")
+    for today in (datetime.date(2018, 12, 28), datetime.date(2019, 1, 20)):
+        assert not lifecycle.record(
+            "stanford/Ray2018.html", play_dates, fetch_date=fetch_date, today=today
+        )
+    assert lifecycle.updated["stanford/Ray2018.html"]["last_date"] == "2019-01-13"
+    # and freezes once those dates are over
+    assert lifecycle.record(
+        "stanford/Ray2018.html",
+        play_dates,
+        fetch_date=fetch_date,
+        today=datetime.date(2019, 6, 1),
+    )
+
+
+def test_next_year():
+    assert next_year(datetime.date(2019, 1, 13)) == datetime.date(2020, 1, 13)
+    assert next_year(datetime.date(2020, 2, 29)) == datetime.date(2021, 2, 28)
@@ -0,0 +1,110 @@
+"""Notify17 delivery, and its on-disk retry queue
+"""
+import json
+import threading
+
+import pytest
+import requests
+
+from movies2ical import cache_io
+from movies2ical.notify import NotifyDispatcher, load_notify_queue
+
+
+class FakeSession:
+    """Stands in for requests.Session, failing every POST or waiting for
+    release before replying to each
+    """
+
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.release = threading.Event()
+        self.posted = []
+
+    def post(self, url, data, timeout):
+        if self.fail:
+            raise requests.ConnectionError("unreachable")
+        self.release.wait(5)
+        self.posted.append(data)
+        response = requests.Response()
+        response.status_code = 200
+        return response
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def queue_filename(tmp_path, monkeypatch):
+    monkeypatch.setattr(cache_io, "LOCK_DIR", tmp_path / "locks")
+    return tmp_path / "notify_queue.json"
+
+
+def dispatcher(queue_filename, session):
+    notifier = NotifyDispatcher(queue_filename=queue_filename)
+    notifier.session = session
+    return notifier
+
+
+def test_retries_stay_queued_until_delivered(queue_filename):
+    # queued by an earlier version, without ids
+    retry = {"url": "https://x/", "data": {"title": "a"}, "batch": None}
+    queue_filename.write_text(json.dumps([dict(retry, attempts=1)]))
+    session = FakeSession()
+    notifier = dispatcher(queue_filename, session)
+
+    notifier.start()
+    # while being sent, a killed run would leave it queued
+    assert [x["data"] for x in load_notify_queue(queue_filename)] == [retry["data"]]
+
+    session.release.set()
+    notifier.close(wait=5)
+    assert session.posted == [retry["data"]]
+    assert load_notify_queue(queue_filename) == []
+
+
+def test_failed_retry_saved_once(queue_filename):
+    queue_filename.write_text(
+        json.dumps(
+            [
+                {
+                    "id": "1",
+                    "url": "https://x/",
+                    "data": {"title": "a"},
+                    "batch": None,
+                    "attempts": 1,
+                }
+            ]
+        )
+    )
+    notifier = dispatcher(queue_filename, FakeSession(fail=True))
+
+    notifier.start()
+    notifier.notify("https://x/", {"title": "b"})
+    notifier.close(wait=5)
+    saved = load_notify_queue(queue_filename)
+    assert [(x["data"]["title"], x["attempts"]) for x in saved] == [
+        ("a", 2),
+        ("b", 1),
+    ]
+
+
+def test_batch_delivery_removes_all_queued(queue_filename):
+    queued = [
+        {
+            "id": str(x),
+            "url": "https://x/",
+            "data": {"calendar_list": ["cal%d" % x]},
+            "batch": "new",
+            "attempts": 1,
+        }
+        for x in range(2)
+    ]
+    queue_filename.write_text(json.dumps(queued))
+    session = FakeSession()
+    session.release.set()
+    notifier = dispatcher(queue_filename, session)
+
+    notifier.start()
+    notifier.close(wait=5)
+    assert session.posted == [{"calendar_list": ["cal0", "cal1"]}]
+    assert load_notify_queue(queue_filename) == []
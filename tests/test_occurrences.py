@@ -0,0 +1,34 @@
+"""Expansion of showings into occurrences, across DST transitions
+"""
+import datetime
+
+import pytz
+
+from movies2ical.occurrences import UtcOffsets, expand_occurrences, local_run_showings
+
+TZ = pytz.timezone("America/Los_Angeles")
+
+
+def test_run_across_dst_keeps_local_time():
+    # DST starts Sunday March 10, 2019
+    offsets = UtcOffsets(TZ)
+    showings = local_run_showings(
+        datetime.date(2019, 3, 8),
+        datetime.date(2019, 3, 12),
+        datetime.time(19, 30),
+        datetime.timedelta(hours=2),
+        offsets,
+    )
+    assert [x["rrule_count"] for x in showings] == [2, 3]
+    assert [x["datetime_start"].hour for x in showings] == [3, 2]
+    assert offsets[datetime.date(2019, 3, 9)] == datetime.timedelta(hours=-8)
+    assert offsets[datetime.date(2019, 3, 10)] == datetime.timedelta(hours=-7)
+
+    occurrences = expand_occurrences([{"name": "Rebecca", "showings": showings}])
+    local_starts = [
+        datetime.datetime.fromtimestamp(x, TZ) for x in occurrences.starts
+    ]
+    assert [x.day for x in local_starts] == [8, 9, 10, 11, 12]
+    assert {(x.hour, x.minute) for x in local_starts} == {(19, 30)}
+    durations = {y - x for (x, y) in zip(occurrences.starts, occurrences.ends)}
+    assert durations == {2 * 60 * 60}
@@ -0,0 +1,133 @@
+"""Golden test of date and showtime parsing over every string in the test/
+calendar corpus
+
+Expected results are in data/parse_strings.json.  After a deliberate change
+to parse_datestr() or process_movie_time_str(), check the differences this
+test reports, then record new results with:
+
+    python tests/test_parse_schedule.py --record
+"""
+import json
+from pathlib import Path
+import sys
+
+import pytest
+
+import movies2ical.parse_schedule as parse_schedule
+
+TESTS_DIR = Path(__file__).resolve().parent
+CORPUS_DIR = TESTS_DIR.parent / "test"
+GOLDEN_FILE = TESTS_DIR / "data" / "parse_strings.json"
+
+
+def corpus_strings():
+    """Returns (tuple): (dates, times), every (date string, calendar year) and
+        showtime string the parser sees in corpus, each in order found
+    """
+    dates = {}
+    times = {}
+    (parse_datestr, process_movie_time_str) = (
+        parse_schedule.parse_datestr,
+        parse_schedule.process_movie_time_str,
+    )
+
+    def record_datestr(content_str, calendar_year):
+        dates[(content_str, calendar_year)] = None
+        return parse_datestr(content_str, calendar_year)
+
+    def record_movie_time_str(movie_time):
+        times[movie_time] = None
+        return process_movie_time_str(movie_time)
+
+    parse_schedule.parse_datestr = record_datestr
+    parse_schedule.process_movie_time_str = record_movie_time_str
+    try:
+        for html_file in sorted(CORPUS_DIR.glob("*.html")):
+            parse_schedule.parse_html_calendar(html_file)
+    finally:
+        parse_schedule.parse_datestr = parse_datestr
+        parse_schedule.process_movie_time_str = process_movie_time_str
+    return (list(dates), list(times))
+
+
+def as_json(value):
+    # tuples become lists, as in golden file
+    return json.loads(json.dumps(value))
+
+
+def load_golden():
+    try:
+        with open(GOLDEN_FILE, "r", encoding="utf-8") as golden_fh:
+            golden = json.load(golden_fh)
+    except FileNotFoundError:
+        # not recorded yet
+        golden = {"dates": [], "times": []}
+    return (
+        {(x["str"], x["year"]): x["parsed"] for x in golden["dates"]},
+        {x["str"]: x["parsed"] for x in golden["times"]},
+    )
+
+
+def record_golden():
+    (dates, times) = corpus_strings()
+    golden = {
+        "dates": [
+            {"str": x, "year": year, "parsed": parse_schedule.parse_datestr(x, year)}
+            for (x, year) in dates
+        ],
+        "times": [
+            {"str": x, "parsed": parse_schedule.process_movie_time_str(x)}
+            for x in times
+        ],
+    }
+    with open(GOLDEN_FILE, "w", encoding="utf-8") as golden_fh:
+        json.dump(golden, golden_fh, indent=1, ensure_ascii=False)
+        golden_fh.write("\n")
+    print("Recorded %d dates and %d times" % (len(dates), len(times)))
+
+
+GOLDEN_DATES, GOLDEN_TIMES = load_golden()
+
+
+def test_golden_covers_corpus():
+    (dates, times) = corpus_strings()
+    assert set(dates) <= set(GOLDEN_DATES)
+    assert set(times) <= set(GOLDEN_TIMES)
+
+
+@pytest.mark.parametrize("content_str,calendar_year", list(GOLDEN_DATES))
+def test_parse_datestr_golden(content_str, calendar_year):
+    assert (
+        as_json(parse_schedule.parse_datestr(content_str, calendar_year))
+        == GOLDEN_DATES[(content_str, calendar_year)]
+    )
+
+
+@pytest.mark.parametrize("movie_time", list(GOLDEN_TIMES))
+def test_process_movie_time_str_golden(movie_time):
+    assert (
+        as_json(parse_schedule.process_movie_time_str(movie_time))
+        == GOLDEN_TIMES[movie_time]
+    )
+
+
+@pytest.mark.parametrize(
+    "content_str,calendar_year,expected",
+    [
+        # en-dash ranges across months (Dec2018, Lewton)
+        ("November 30 – December 2", 2018, ((2018, 11, 30), (2018, 12, 2))),
+        ("March 31 – April 2", 2017, ((2017, 3, 31), (2017, 4, 2))),
+        # weekday on both ends of range (Olivia)
+        ("Friday July 1 - Friday July 8", 2016, ((2016, 7, 1), (2016, 7, 8))),
+        ("Monday-Friday, December 19-23", 2016, ((2016, 12, 19), (2016, 12, 23))),
+        ("August 31-Sept 3", 2018, ((2018, 8, 31), (2018, 9, 3))),
+        ("Saturday December 24", 2016, ((2016, 12, 24), (2016, 12, 24))),
+    ],
+)
+def test_parse_datestr_ranges(content_str, calendar_year, expected):
+    assert parse_schedule.parse_datestr(content_str, calendar_year) == expected
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] == ["--record"]:
+        record_golden()
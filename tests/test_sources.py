@@ -0,0 +1,27 @@
+"""Venue source plugins
+"""
+import pytest
+
+from movies2ical.sources import (
+    StanfordTheatreSource,
+    VenueSource,
+    check_source_plugin,
+)
+
+
+class NoParserSource(VenueSource):
+    plugin = "no_parser"
+
+
+def test_incomplete_plugin_rejected():
+    with pytest.raises(TypeError):
+        NoParserSource()
+    with pytest.raises(TypeError, match="parse_calendar"):
+        check_source_plugin(NoParserSource)
+    with pytest.raises(TypeError):
+        check_source_plugin(object)
+
+
+def test_stanford_plugin_accepted():
+    check_source_plugin(StanfordTheatreSource)
+    assert StanfordTheatreSource().name == "stanford"
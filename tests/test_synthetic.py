@@ -0,0 +1,60 @@
+"""Scaling of every stage on synthetic calendars
+"""
+import gc
+import logging
+
+import pytest
+
+from movies2ical.synthetic import (
+    BENCHMARK_STAGES,
+    benchmark_size,
+    growth_exponents,
+    seasons,
+)
+
+# small enough to run quickly, big enough that quadratic stages stand out
+SIZES = (100, 800)
+REPEATS = 3
+
+# exponents near 1 are linear, 2 quadratic (small sizes have fixed costs
+#   too, which only bring exponents down)
+MAX_GROWTH = 1.5
+
+
+def fastest_timings(size, work_dir):
+    """Returns (dict): fastest time of each stage over REPEATS runs
+    """
+    # garbage collections at random times are most of the noise
+    gc.collect()
+    gc.disable()
+    try:
+        runs = [benchmark_size(size, work_dir, seed=0) for _ in range(REPEATS)]
+    finally:
+        gc.enable()
+    return dict(runs[0], **{x: min(y[x] for y in runs) for x in BENCHMARK_STAGES})
+
+
+@pytest.fixture(scope="module")
+def growths(tmp_path_factory):
+    # synthetic calendars have many time conflicts, don't warn about each
+    logging.disable(logging.WARNING)
+    try:
+        work_dir = tmp_path_factory.mktemp("synthetic")
+        (timings1, timings2) = [fastest_timings(x, work_dir) for x in SIZES]
+    finally:
+        logging.disable(logging.NOTSET)
+    assert (timings1["num_play_dates"], timings2["num_play_dates"]) == SIZES
+    return growth_exponents(timings1, timings2)
+
+
+@pytest.mark.parametrize("stage", BENCHMARK_STAGES)
+def test_stage_growth(stage, growths):
+    assert growths[stage] < MAX_GROWTH
+
+
+def test_seasons():
+    play_dates = [
+        {"show_startdate": x}
+        for x in [(2019, 1, 1), (2019, 6, 1), (2019, 1, 2), (2019, 1, 2)]
+    ]
+    assert [len(x) for x in seasons(play_dates)] == [2, 2]
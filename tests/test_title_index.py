@@ -0,0 +1,167 @@
+"""Matching movies listed without IMDb links: candidates in calendar text,
+title normalization, the title index, and skipping what can't be fetched
+"""
+import json
+import logging
+
+from imdb import IMDbError
+import pytest
+
+from movies2ical import cache_io, imdb, title_index
+from movies2ical.parse_schedule import UNLINKED_MOVIE_RE
+from movies2ical.title_index import TitleIndex, normalize_title
+
+
+@pytest.mark.parametrize(
+    "text",
+    [
+        "Ninotchka (1939)",
+        "  The Thin Man (1934) ",
+        "20,000 Years in Sing Sing (1932)",
+        'Dial "M" for Murder (1954)',
+        "It's a Gift (1934)",
+    ],
+)
+def test_unlinked_movie_candidates(text):
+    assert UNLINKED_MOVIE_RE.search(text)
+
+
+@pytest.mark.parametrize(
+    "text",
+    [
+        # show times or other text after the year
+        "Ninotchka (1939) 7:30",
+        "Helpmates (1932) (short subject)",
+        # lower-case start, i.e. running text
+        "restored by the archive (2019)",
+        "two movies: Ninotchka (1939) and Rebecca (1940)",
+        "Not a year (1939-1940)",
+        "A sentence of program notes that goes on much longer than any movie "
+        "title would ever be (1999)",
+    ],
+)
+def test_not_unlinked_movie_candidates(text):
+    assert not UNLINKED_MOVIE_RE.search(text)
+
+
+def test_unlinked_candidate_can_be_other_text():
+    # looks like a movie, only an exact IMDb title and year match makes it one
+    assert UNLINKED_MOVIE_RE.search("Restored Print (1999)")
+
+
+@pytest.mark.parametrize(
+    "title,normalized",
+    [
+        ("The Thin Man", "thin man"),
+        ('Dial "M" for Murder', "dial m for murder"),
+        ("Mother Wore Tights", "mother wore tights"),
+        ("Breathe In", "breathe in"),
+        ("Bathe the Baby", "bathe baby"),
+        ("THE 39 STEPS", "39 steps"),
+    ],
+)
+def test_normalize_title(title, normalized):
+    assert normalize_title(title) == normalized
+
+
+def write_cached(imdb_cache_dir, movie_num, title, year):
+    with open(imdb_cache_dir / (movie_num + ".json"), "w") as imdb_fh:
+        json.dump({"title": title, "year": year}, imdb_fh)
+
+
+@pytest.fixture
+def index(tmp_path):
+    imdb_cache_dir = tmp_path / "imdb_cache"
+    imdb_cache_dir.mkdir()
+    write_cached(imdb_cache_dir, "0031725", "Ninotchka", 1939)
+    write_cached(imdb_cache_dir, "0025878", "The Thin Man", 1934)
+    write_cached(imdb_cache_dir, "0021079", "Little Caesar", 1931)
+    write_cached(imdb_cache_dir, "0000001", "Little Caesar", 1960)
+    return TitleIndex(imdb_cache_dir, tmp_path / "title_index.json").load()
+
+
+def test_lookup(index):
+    assert index.lookup("Ninotchka (1939)") == "0031725"
+    assert index.lookup('"Ninotchka" (1939)') == "0031725"
+    assert index.lookup("Thin Man (1934)") == "0025878"
+    assert index.lookup("Ninotchka (1940)") is None
+    assert index.lookup("Ninotchka") == "0031725"
+    # two cached movies of that title
+    assert index.lookup("Little Caesar") is None
+    assert index.lookup("Little Caesar (1931)") == "0021079"
+
+
+def test_add(index):
+    index.add("0032976", {"title": "Rebecca (1940)", "year": 1940})
+    assert index.lookup("Rebecca (1940)") == "0032976"
+    # records without title and year aren't indexed
+    index.add("0000002", {})
+    index.add("0000003", None)
+    assert "0000002" not in index.movies
+    assert "0000003" not in index.movies
+
+
+def test_saved_index_reloaded(index, tmp_path):
+    reloaded = TitleIndex(index.imdb_cache_dir, index.index_filename)
+    # saved index is used instead of reading cached records again
+    write_cached(index.imdb_cache_dir, "0031725", "Changed", 1939)
+    reloaded.load()
+    assert reloaded.lookup("Ninotchka (1939)") == "0031725"
+
+
+def test_index_of_old_version_rebuilt(index, monkeypatch):
+    monkeypatch.setattr(title_index, "TITLE_INDEX_VERSION", 0)
+    write_cached(index.imdb_cache_dir, "0031725", "Changed", 1939)
+    rebuilt = TitleIndex(index.imdb_cache_dir, index.index_filename).load()
+    assert rebuilt.lookup("Ninotchka (1939)") is None
+    assert rebuilt.lookup("Changed (1939)") == "0031725"
+
+
+@pytest.fixture
+def imdb_unreachable(tmp_path, monkeypatch):
+    """Empty imdb cache, and every IMDb fetch fails
+    """
+
+    def fetch_imdb_movie(imdb_movie_num, movie_name, info=None):
+        raise IMDbError("unreachable")
+
+    monkeypatch.setattr(imdb, "IMDB_CACHE_DIR", tmp_path)
+    monkeypatch.setattr(imdb, "fetch_imdb_movie", fetch_imdb_movie)
+    monkeypatch.setattr(cache_io, "LOCK_DIR", tmp_path / "locks")
+
+
+def play_date(name, imdb_url):
+    return {"name": name, "imdb_url": imdb_url}
+
+
+def skipped_warnings(caplog):
+    return [
+        x.movie
+        for x in caplog.records
+        if getattr(x, "warning_type", None) == "imdb_info_failed"
+    ]
+
+
+def test_imdb_info_failure_skips_play_date(imdb_unreachable, caplog):
+    play_dates = [play_date("Ninotchka (1939)", imdb.IMDB_TITLE_URL % "0031725")]
+    with caplog.at_level(logging.WARNING):
+        assert imdb.get_imdb_info(play_dates) == []
+    assert skipped_warnings(caplog) == ["Ninotchka (1939)"]
+
+
+def test_unlinked_info_failure_skips_play_date(
+    imdb_unreachable, monkeypatch, index, caplog
+):
+    monkeypatch.setattr(imdb, "get_title_index", lambda: index)
+    monkeypatch.setattr(imdb, "search_imdb_movie", lambda name: "0032976")
+    play_dates = [
+        play_date("Rebecca (1940)", None),
+        play_date("Ninotchka (1939)", None),
+    ]
+    with caplog.at_level(logging.WARNING):
+        resolved = imdb.resolve_unlinked(play_dates)
+    # Ninotchka found in index, Rebecca found by search but can't be fetched
+    assert [x["name"] for x in resolved] == ["Ninotchka (1939)"]
+    assert resolved[0]["imdb_url"] == imdb.IMDB_TITLE_URL % "0031725"
+    assert skipped_warnings(caplog) == ["Rebecca (1940)"]
+    assert "0032976" not in index.movies
@@ -0,0 +1,61 @@
+"""Checks of computed showings
+"""
+import datetime
+import logging
+
+import pytz
+
+from movies2ical.occurrences import UtcOffsets, expand_occurrences, local_run_showings
+from movies2ical.verify import check_schedule_overlap
+
+TZ = pytz.timezone("America/Los_Angeles")
+
+
+def play_date(name, hour, minute, minutes):
+    showings = local_run_showings(
+        datetime.date(2019, 1, 11),
+        datetime.date(2019, 1, 12),
+        datetime.time(hour, minute),
+        datetime.timedelta(minutes=minutes),
+        UtcOffsets(TZ),
+    )
+    return {"name": name, "showings": showings}
+
+
+def conflicts(caplog):
+    return [
+        x.args[2:5:2]
+        for x in caplog.records
+        if getattr(x, "warning_type", None) == "time_conflict"
+    ]
+
+
+def test_long_showing_overlaps_two(caplog):
+    # B ends before C starts, but both start while A plays
+    play_dates = [
+        play_date("A", 19, 0, 240),
+        play_date("B", 19, 30, 60),
+        play_date("C", 21, 0, 60),
+    ]
+    with caplog.at_level(logging.WARNING):
+        check_schedule_overlap(play_dates, tz=TZ)
+    assert conflicts(caplog) == [("A", "B"), ("A", "C")]
+
+
+def test_correct_endtimes(caplog):
+    play_dates = [
+        play_date("A", 19, 0, 240),
+        play_date("B", 19, 30, 60),
+        play_date("C", 21, 0, 60),
+    ]
+    occurrences = expand_occurrences(play_dates)
+    with caplog.at_level(logging.WARNING):
+        check_schedule_overlap(
+            play_dates, correct_endtimes=True, tz=TZ, occurrences=occurrences
+        )
+    # once A ends before B starts, it no longer overlaps C
+    assert conflicts(caplog) == [("A", "B")]
+    showing = play_dates[0]["showings"][0]
+    assert showing["datetime_end"] - showing["datetime_start"] == datetime.timedelta(
+        minutes=29
+    )
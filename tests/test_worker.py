@@ -0,0 +1,54 @@
+"""Worker jobs: each calendar's jobs are keyed by the calendar, not its
+output path
+"""
+from pathlib import Path
+
+import pytest
+
+from movies2ical.schedule_acquire import find_calendar_files
+from movies2ical.sources import StanfordTheatreSource
+from movies2ical.worker import do_fetch_job
+
+
+@pytest.fixture
+def same_name_files(tmp_path):
+    srcfiles = []
+    for (subdir, contents) in [("a", "<html>a</html>"), ("b", "<html>b</html>")]:
+        (tmp_path / subdir).mkdir()
+        srcfile = tmp_path / subdir / "Cal_2019.html"
+        srcfile.write_text(contents)
+        srcfiles.append(srcfile)
+    return srcfiles
+
+
+def test_same_output_path_rejected(same_name_files, tmp_path):
+    with pytest.raises(ValueError, match="same output file"):
+        find_calendar_files(same_name_files)
+    # same name in different directories of one directory argument is fine
+    assert [str(x[1]) for x in find_calendar_files([tmp_path])] == [
+        "a/Cal_2019.html",
+        "b/Cal_2019.html",
+    ]
+
+
+def test_same_contents_skipped(same_name_files):
+    same_name_files[1].write_text(same_name_files[0].read_text())
+    assert find_calendar_files(same_name_files) == [
+        (same_name_files[0], Path("Cal_2019.html"))
+    ]
+
+
+def test_next_job_keyed_by_calendar(same_name_files):
+    run = {"sources": {"stanford": StanfordTheatreSource()}}
+    keys = []
+    for srcfile in same_name_files:
+        payload = {
+            "key": str(srcfile),
+            "source": "stanford",
+            "srcfile": str(srcfile),
+            "relpath": srcfile.name,
+        }
+        (_, [(kind, key, next_payload)]) = do_fetch_job(payload, run)
+        assert (kind, next_payload["key"]) == ("parse", str(srcfile))
+        keys.append(key)
+    assert keys == [str(x) for x in same_name_files]